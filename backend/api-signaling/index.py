@@ -1,101 +1,95 @@
-import json
-import asyncio
-from datetime import datetime
+import core
+import metrics
+from registry import create_registry
 
-connections = {}
+registry = create_registry()
+routes = {}
 
+metrics.register('registry', registry.stats)
+
+PREFLIGHT = core.preflight('GET, POST, OPTIONS', 'Content-Type')
+PEER_NOT_FOUND_BODY = core.dumps({'error': 'Peer not found'})
+UNKNOWN_ROUTE_BODY = core.dumps({'error': 'Unknown route'})
+
+
+def relay_response(connection_ids: list, raw_body: str) -> dict:
+    '''Ответ send_to_connection: исходный JSON сообщения вставляется в data как есть, без пересериализации'''
+    head = core.dumps({
+        'action': 'send_to_connection',
+        'connection_id': connection_ids[-1],
+        'connection_ids': connection_ids
+    })
+    return core.raw_response(200, f'{head[:-1]},"data":{raw_body.strip()}}}')
+
+
+def route(route_key: str):
+    def decorator(fn):
+        routes[route_key] = fn
+        return fn
+    return decorator
+
+
+@route('$connect')
+def on_connect(event: dict, connection_id: str) -> dict:
+    query_params = event.get('queryStringParameters') or {}
+    peer_id = query_params.get('peer_id', '')
+
+    registry.connect(connection_id, peer_id)
+
+    return core.EMPTY_OK
+
+
+@route('$disconnect')
+def on_disconnect(event: dict, connection_id: str) -> dict:
+    registry.disconnect(connection_id)
+
+    return core.EMPTY_OK
+
+
+def relay(body: dict, connection_id: str):
+    """Общая часть $default: heartbeat отправителя и соединения адресата; None — ping"""
+    if connection_id:
+        registry.heartbeat(connection_id)
+
+    if body.get('type') == 'ping':
+        return None
+
+    return registry.lookup(body.get('to'))
+
+
+@route('$default')
+def on_message(event: dict, connection_id: str) -> dict:
+    body = core.json_body(event)
+    target_connection_ids = relay(body, connection_id)
+
+    if target_connection_ids is None:
+        return core.EMPTY_OK
+
+    if target_connection_ids:
+        return relay_response(target_connection_ids, event['body'])
+
+    return core.raw_response(404, PEER_NOT_FOUND_BODY)
+
+
+@metrics.instrument('api-signaling')
 def handler(event: dict, context) -> dict:
     """WebSocket сервер для сигнализации WebRTC звонков"""
-    
+
     method = event.get('httpMethod', 'GET')
-    
+
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
+        return PREFLIGHT
+
     request_context = event.get('requestContext', {})
     connection_id = request_context.get('connectionId')
     route_key = request_context.get('routeKey', '$default')
-    
-    if route_key == '$connect':
-        query_params = event.get('queryStringParameters', {})
-        peer_id = query_params.get('peer_id', '')
-        
-        connections[connection_id] = {
-            'peer_id': peer_id,
-            'connected_at': datetime.now().isoformat()
-        }
-        
-        return {
-            'statusCode': 200,
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    elif route_key == '$disconnect':
-        if connection_id in connections:
-            del connections[connection_id]
-        
-        return {
-            'statusCode': 200,
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    elif route_key == '$default':
-        body_str = event.get('body', '{}')
-        if not body_str or body_str.strip() == '':
-            body_str = '{}'
-        body = json.loads(body_str)
-        message_type = body.get('type')
-        to_peer_id = body.get('to')
-        
-        target_connection_id = None
-        for conn_id, conn_data in connections.items():
-            if conn_data['peer_id'] == to_peer_id:
-                target_connection_id = conn_id
-                break
-        
-        if target_connection_id:
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({
-                    'action': 'send_to_connection',
-                    'connection_id': target_connection_id,
-                    'data': body
-                }),
-                'isBase64Encoded': False
-            }
-        
-        return {
-            'statusCode': 404,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': 'Peer not found'}),
-            'isBase64Encoded': False
-        }
-    
-    return {
-        'statusCode': 400,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*'
-        },
-        'body': json.dumps({'error': 'Unknown route'}),
-        'isBase64Encoded': False
-    }
\ No newline at end of file
+
+    if method == 'GET' and not connection_id:
+        return core.response(200, registry.stats())
+
+    fn = routes.get(route_key)
+    if fn is None:
+        return core.raw_response(400, UNKNOWN_ROUTE_BODY)
+    metrics.set_route(route_key)
+
+    return fn(event, connection_id)
@@ -0,0 +1,283 @@
+'''Реестр WebSocket-соединений для маршрутизации сообщений сигнализации.
+
+Бэкенд выбирается переменной SIGNALING_REGISTRY:
+- memory — индекс в памяти процесса (один экземпляр функции);
+- postgres — таблица ws_connections, общая для всех экземпляров.
+'''
+import os
+import sys
+import time
+from datetime import datetime
+
+import metrics
+
+REGISTRY_TTL = float(os.environ.get('SIGNALING_REGISTRY_TTL', '120'))
+HEARTBEAT_FLUSH_INTERVAL = float(os.environ.get('SIGNALING_HEARTBEAT_FLUSH', '15'))
+SWEEP_INTERVAL = float(os.environ.get('SIGNALING_SWEEP_INTERVAL', '60'))
+
+
+class PeerIndex:
+    '''Двусторонний индекс: поиск соединений пира и пира соединения за O(1).
+
+    У одного пира может быть несколько соединений (несколько устройств),
+    они хранятся в порядке подключения, последнее — самое свежее.
+    '''
+
+    def __init__(self):
+        self._connections = {}
+        self._peers = {}
+
+    def add(self, connection_id: str, peer_id: str) -> None:
+        self.remove(connection_id)
+        self._connections[connection_id] = {
+            'peer_id': peer_id,
+            'connected_at': datetime.now().isoformat(),
+            'last_seen': time.monotonic()
+        }
+        self._peers.setdefault(peer_id, {})[connection_id] = None
+
+    def remove(self, connection_id: str):
+        conn_data = self._connections.pop(connection_id, None)
+        if conn_data is None:
+            return None
+        peer_id = conn_data['peer_id']
+        peer_connections = self._peers.get(peer_id)
+        if peer_connections is not None:
+            peer_connections.pop(connection_id, None)
+            if not peer_connections:
+                del self._peers[peer_id]
+        return peer_id
+
+    def touch(self, connection_id: str) -> None:
+        conn_data = self._connections.get(connection_id)
+        if conn_data is not None:
+            conn_data['last_seen'] = time.monotonic()
+
+    def last_seen(self, connection_id: str):
+        conn_data = self._connections.get(connection_id)
+        return conn_data['last_seen'] if conn_data else None
+
+    def expire(self, ttl: float) -> list:
+        deadline = time.monotonic() - ttl
+        stale = [
+            connection_id
+            for connection_id, conn_data in self._connections.items()
+            if conn_data['last_seen'] < deadline
+        ]
+        for connection_id in stale:
+            self.remove(connection_id)
+        return stale
+
+    def connections_of(self, peer_id: str) -> list:
+        return list(self._peers.get(peer_id, ()))
+
+    def latest_connection(self, peer_id: str):
+        peer_connections = self._peers.get(peer_id)
+        if not peer_connections:
+            return None
+        return next(reversed(peer_connections))
+
+    def peer_of(self, connection_id: str):
+        conn_data = self._connections.get(connection_id)
+        return conn_data['peer_id'] if conn_data else None
+
+    def __len__(self) -> int:
+        return len(self._connections)
+
+    def __contains__(self, connection_id: str) -> bool:
+        return connection_id in self._connections
+
+    def memory_bytes(self) -> int:
+        '''Приблизительный объём памяти индекса (контейнеры и ключи)'''
+        total = sys.getsizeof(self._connections) + sys.getsizeof(self._peers)
+        for connection_id, conn_data in self._connections.items():
+            total += sys.getsizeof(connection_id) + sys.getsizeof(conn_data)
+            total += sum(sys.getsizeof(v) for v in conn_data.values())
+        for peer_id, peer_connections in self._peers.items():
+            total += sys.getsizeof(peer_id) + sys.getsizeof(peer_connections)
+        return total
+
+    def stats(self) -> dict:
+        return {
+            'connections': len(self._connections),
+            'peers': len(self._peers),
+            'memory_bytes': self.memory_bytes()
+        }
+
+
+class MemoryRegistry:
+    '''Реестр в памяти процесса; маршруты видны только этому экземпляру'''
+
+    backend = 'memory'
+
+    def __init__(self, ttl: float = REGISTRY_TTL, sweep_interval: float = SWEEP_INTERVAL):
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.index = PeerIndex()
+        self._last_sweep = time.monotonic()
+
+    def connect(self, connection_id: str, peer_id: str) -> None:
+        self.index.add(connection_id, peer_id)
+        self._maybe_sweep()
+
+    def disconnect(self, connection_id: str) -> None:
+        self.index.remove(connection_id)
+
+    def heartbeat(self, connection_id: str) -> None:
+        self.index.touch(connection_id)
+        self._maybe_sweep()
+
+    def lookup(self, peer_id: str) -> list:
+        deadline = time.monotonic() - self.ttl
+        connection_ids = []
+        for connection_id in self.index.connections_of(peer_id):
+            if self.index.last_seen(connection_id) < deadline:
+                self.index.remove(connection_id)
+            else:
+                connection_ids.append(connection_id)
+        return connection_ids
+
+    def sweep(self) -> int:
+        self._last_sweep = time.monotonic()
+        return len(self.index.expire(self.ttl))
+
+    def _maybe_sweep(self) -> None:
+        if time.monotonic() - self._last_sweep >= self.sweep_interval:
+            self.sweep()
+
+    def stats(self) -> dict:
+        return dict(self.index.stats(), backend=self.backend)
+
+
+class PostgresRegistry:
+    '''Реестр в таблице ws_connections, общий для всех экземпляров функции.
+
+    Heartbeat'ы копятся в памяти и сбрасываются одним UPDATE не чаще
+    раза в flush_interval; устаревшие строки удаляются по TTL.
+    '''
+
+    backend = 'postgres'
+
+    def __init__(self, ttl: float = REGISTRY_TTL, flush_interval: float = HEARTBEAT_FLUSH_INTERVAL,
+                 sweep_interval: float = SWEEP_INTERVAL, getconn=None, putconn=None):
+        if getconn is None or putconn is None:
+            import db
+            getconn, putconn = db.getconn, db.putconn
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.sweep_interval = sweep_interval
+        self._getconn = getconn
+        self._putconn = putconn
+        self._pending = set()
+        self._last_flush = time.monotonic()
+        self._last_sweep = time.monotonic()
+
+    def _execute(self, sql: str, params=(), fetch: bool = False):
+        conn = self._getconn()
+        try:
+            try:
+                return self._run(conn, sql, params, fetch)
+            except Exception as e:
+                import db
+                if not db.dropped(conn, e):
+                    raise
+                conn = db.replace(conn)
+                return self._run(conn, sql, params, fetch)
+        finally:
+            self._putconn(conn)
+
+    @staticmethod
+    def _run(conn, sql: str, params, fetch: bool):
+        cur = metrics.cursor(conn.cursor())
+        try:
+            cur.execute(sql, params)
+            rows = cur.fetchall() if fetch else None
+            conn.commit()
+            return rows
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            cur.close()
+
+    def connect(self, connection_id: str, peer_id: str) -> None:
+        self._execute(
+            "INSERT INTO ws_connections (connection_id, peer_id) VALUES (%s, %s) "
+            "ON CONFLICT (connection_id) DO UPDATE SET peer_id = EXCLUDED.peer_id, "
+            "connected_at = CURRENT_TIMESTAMP, last_seen = CURRENT_TIMESTAMP",
+            (connection_id, peer_id)
+        )
+        self._pending.discard(connection_id)
+        self._maybe_sweep()
+
+    def disconnect(self, connection_id: str) -> None:
+        self._pending.discard(connection_id)
+        self._execute("DELETE FROM ws_connections WHERE connection_id = %s", (connection_id,))
+
+    def heartbeat(self, connection_id: str) -> None:
+        self._pending.add(connection_id)
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+        self._maybe_sweep()
+
+    def flush(self) -> int:
+        pending, self._pending = list(self._pending), set()
+        self._last_flush = time.monotonic()
+        if pending:
+            self._execute(
+                "UPDATE ws_connections SET last_seen = CURRENT_TIMESTAMP WHERE connection_id = ANY(%s)",
+                (pending,)
+            )
+        return len(pending)
+
+    def lookup(self, peer_id: str) -> list:
+        rows = self._execute(
+            "SELECT connection_id FROM ws_connections "
+            "WHERE peer_id = %s AND last_seen > CURRENT_TIMESTAMP - make_interval(secs => %s) "
+            "ORDER BY connected_at",
+            (peer_id, self.ttl),
+            fetch=True
+        )
+        return [row[0] for row in rows]
+
+    def sweep(self) -> int:
+        self._last_sweep = time.monotonic()
+        rows = self._execute(
+            "DELETE FROM ws_connections WHERE last_seen < CURRENT_TIMESTAMP - make_interval(secs => %s) "
+            "RETURNING connection_id",
+            (self.ttl,),
+            fetch=True
+        )
+        return len(rows)
+
+    def _maybe_sweep(self) -> None:
+        if time.monotonic() - self._last_sweep >= self.sweep_interval:
+            self.sweep()
+
+    def stats(self) -> dict:
+        rows = self._execute(
+            "SELECT COUNT(*), COUNT(DISTINCT peer_id) FROM ws_connections "
+            "WHERE last_seen > CURRENT_TIMESTAMP - make_interval(secs => %s)",
+            (self.ttl,),
+            fetch=True
+        )
+        return {
+            'connections': rows[0][0],
+            'peers': rows[0][1],
+            'pending_heartbeats': len(self._pending),
+            'backend': self.backend
+        }
+
+
+REGISTRY_BACKENDS = {
+    'memory': MemoryRegistry,
+    'postgres': PostgresRegistry,
+}
+
+
+def create_registry(backend: str = None):
+    backend = backend or os.environ.get('SIGNALING_REGISTRY', 'memory')
+    if backend not in REGISTRY_BACKENDS:
+        raise ValueError(f'Unknown signaling registry backend: {backend}')
+    return REGISTRY_BACKENDS[backend]()
@@ -0,0 +1,328 @@
+'''Самостоятельный WebSocket-сервер сигнализации на asyncio.
+
+Семантика та же, что у функции: $connect и $disconnect проходят через
+index.handler, сообщения — через index.relay (heartbeat, ping, поиск
+адресата). Реестр — MemoryRegistry процесса без TTL: живость соединений
+проверяет WebSocket ping (SIGNALING_PING_INTERVAL).
+
+- У каждого соединения своя очередь отправки на SIGNALING_SEND_QUEUE
+  кадров; её разбирает одна задача, которая ждёт drain сокета. Медленного
+  получателя с переполненной очередью сервер закрывает кодом 1013, а не
+  копит кадры в памяти.
+- Кадр пересылается теми же байтами, что пришли: recv(decode=False) и
+  send(text=True) без декодирования, повторной сериализации и копий на
+  каждого адресата.
+- --workers N запускает N процессов на одном порту (SO_REUSEPORT). Процессы
+  обмениваются подключениями и пересылают кадры чужим соединениям через
+  Unix datagram-сокеты в --run-dir.
+
+    pip install -r backend/api-signaling/requirements-server.txt
+    python backend/api-signaling/server.py --port 8765 --workers 4
+
+uvloop используется, если установлен.
+'''
+import argparse
+import asyncio
+import multiprocessing
+import multiprocessing.connection
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import uuid
+from urllib.parse import parse_qsl, urlsplit
+
+import core
+import index
+from registry import MemoryRegistry
+
+SERVER_HOST = os.environ.get('SIGNALING_SERVER_HOST', '0.0.0.0')
+SERVER_PORT = int(os.environ.get('SIGNALING_SERVER_PORT', '8765'))
+SERVER_WORKERS = int(os.environ.get('SIGNALING_SERVER_WORKERS', str(os.cpu_count() or 1)))
+SEND_QUEUE = int(os.environ.get('SIGNALING_SEND_QUEUE', '256'))
+MAX_MESSAGE = int(os.environ.get('SIGNALING_MAX_MESSAGE', str(64 * 1024)))
+PING_INTERVAL = float(os.environ.get('SIGNALING_PING_INTERVAL', '20'))
+
+OVERFLOW_CODE = 1013
+PEER_NOT_FOUND_FRAME = index.PEER_NOT_FOUND_BODY.encode()
+INVALID_MESSAGE_FRAME = core.dumps({'error': 'Invalid message'}).encode()
+
+# Сообщения между воркерами: тип (1 байт) + поля через \0
+HELLO, CONNECT, DISCONNECT, FORWARD = b'H', b'C', b'D', b'F'
+
+
+def owner_of(connection_id: str) -> int:
+    return int(connection_id.split('-', 1)[0])
+
+
+class Connection:
+    '''Соединение клиента с ограниченной очередью отправки'''
+
+    __slots__ = ('id', 'peer_id', 'ws', 'queue', 'writer')
+
+    def __init__(self, connection_id: str, peer_id: str, ws):
+        self.id = connection_id
+        self.peer_id = peer_id
+        self.ws = ws
+        self.queue = asyncio.Queue(SEND_QUEUE)
+        self.writer = asyncio.ensure_future(self._drain())
+
+    def push(self, frame: bytes) -> bool:
+        try:
+            self.queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            asyncio.ensure_future(self.ws.close(OVERFLOW_CODE, 'send queue overflow'))
+            return False
+
+    async def _drain(self) -> None:
+        from websockets.exceptions import ConnectionClosed
+
+        try:
+            while True:
+                frame = await self.queue.get()
+                await self.ws.send(frame, text=True)
+        except ConnectionClosed:
+            pass
+
+
+class Mesh(asyncio.DatagramProtocol):
+    '''Связь воркеров: рассылка подключений и пересылка кадров чужим соединениям'''
+
+    def __init__(self, server, run_dir: str):
+        self.server = server
+        self.run_dir = run_dir
+        self.transport = None
+
+    def path(self, worker: int) -> str:
+        return os.path.join(self.run_dir, f'worker-{worker}.sock')
+
+    async def start(self) -> None:
+        path = self.path(self.server.worker)
+        if os.path.exists(path):
+            os.unlink(path)
+        await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: self, local_addr=path, family=socket.AF_UNIX
+        )
+        self.broadcast(HELLO + str(self.server.worker).encode())
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def send(self, worker: int, data: bytes) -> None:
+        try:
+            self.transport.sendto(data, self.path(worker))
+        except OSError:
+            # Воркер ещё не поднялся или перезапускается — узнает всё из HELLO
+            self.server.stats['mesh_errors'] += 1
+
+    def broadcast(self, data: bytes) -> None:
+        for worker in range(self.server.workers):
+            if worker != self.server.worker:
+                self.send(worker, data)
+
+    def announce(self, connection_id: str, peer_id: str, worker: int = None) -> None:
+        data = CONNECT + connection_id.encode() + b'\0' + peer_id.encode()
+        if worker is None:
+            self.broadcast(data)
+        else:
+            self.send(worker, data)
+
+    def forward(self, connection_id: str, frame: bytes) -> None:
+        self.send(owner_of(connection_id), FORWARD + connection_id.encode() + b'\0' + frame)
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        kind, payload = data[:1], data[1:]
+        if kind == FORWARD:
+            connection_id, _, frame = payload.partition(b'\0')
+            self.server.deliver(connection_id.decode(), frame)
+        elif kind == CONNECT:
+            connection_id, _, peer_id = payload.partition(b'\0')
+            self.server.add_remote(connection_id.decode(), peer_id.decode())
+        elif kind == DISCONNECT:
+            self.server.remove_remote(payload.decode())
+        elif kind == HELLO:
+            self.server.on_hello(int(payload))
+
+
+class Server:
+    '''Один воркер: приём соединений и маршрутизация кадров'''
+
+    def __init__(self, worker: int = 0, workers: int = 1, run_dir: str = None):
+        self.worker = worker
+        self.workers = workers
+        self.local = {}
+        self.remote = {}
+        self.mesh = Mesh(self, run_dir) if workers > 1 else None
+        self.stats = {'connections': 0, 'messages': 0, 'forwarded': 0, 'overflows': 0, 'mesh_errors': 0}
+        index.registry = MemoryRegistry(ttl=float('inf'))
+
+    def deliver(self, connection_id: str, frame: bytes) -> None:
+        conn = self.local.get(connection_id)
+        if conn is not None:
+            if not conn.push(frame):
+                self.stats['overflows'] += 1
+        elif self.mesh is not None and owner_of(connection_id) != self.worker:
+            self.stats['forwarded'] += 1
+            self.mesh.forward(connection_id, frame)
+
+    def add_remote(self, connection_id: str, peer_id: str) -> None:
+        self.remote.setdefault(owner_of(connection_id), set()).add(connection_id)
+        index.registry.connect(connection_id, peer_id)
+
+    def remove_remote(self, connection_id: str) -> None:
+        self.remote.get(owner_of(connection_id), set()).discard(connection_id)
+        index.registry.disconnect(connection_id)
+
+    def on_hello(self, worker: int) -> None:
+        '''Воркер (пере)запустился: забываем его старые соединения и шлём ему свои'''
+        for connection_id in self.remote.pop(worker, ()):
+            index.registry.disconnect(connection_id)
+        for conn in self.local.values():
+            self.mesh.announce(conn.id, conn.peer_id, worker)
+
+    def _event(self, route_key: str, connection_id: str, query: dict = None) -> dict:
+        return {
+            'httpMethod': 'GET',
+            'queryStringParameters': query or {},
+            'requestContext': {'routeKey': route_key, 'connectionId': connection_id}
+        }
+
+    async def serve(self, ws) -> None:
+        connection_id = f'{self.worker}-{uuid.uuid4().hex}'
+        query = dict(parse_qsl(urlsplit(ws.request.path).query))
+        result = index.handler(self._event('$connect', connection_id, query), None)
+        if result.get('statusCode') != 200:
+            await ws.close(1008, 'connect rejected')
+            return
+
+        conn = Connection(connection_id, query.get('peer_id', ''), ws)
+        self.local[connection_id] = conn
+        self.stats['connections'] += 1
+        if self.mesh is not None:
+            self.mesh.announce(connection_id, conn.peer_id)
+        try:
+            await self._receive(conn)
+        finally:
+            del self.local[connection_id]
+            conn.writer.cancel()
+            index.handler(self._event('$disconnect', connection_id), None)
+            if self.mesh is not None:
+                self.mesh.broadcast(DISCONNECT + connection_id.encode())
+
+    async def _receive(self, conn: Connection) -> None:
+        from websockets.exceptions import ConnectionClosed
+
+        while True:
+            try:
+                frame = await conn.ws.recv(decode=False)
+            except ConnectionClosed:
+                return
+            self.stats['messages'] += 1
+            try:
+                body = core.loads(frame)
+            except ValueError:
+                body = None
+            if not isinstance(body, dict):
+                conn.push(INVALID_MESSAGE_FRAME)
+                continue
+
+            target_connection_ids = index.relay(body, conn.id)
+            if target_connection_ids is None:
+                continue
+            if not target_connection_ids:
+                conn.push(PEER_NOT_FOUND_FRAME)
+                continue
+            for connection_id in target_connection_ids:
+                self.deliver(connection_id, frame)
+
+    async def run(self, host: str, port: int) -> None:
+        from websockets.asyncio.server import serve
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+
+        if self.mesh is not None:
+            await self.mesh.start()
+        async with serve(
+            self.serve, host, port,
+            reuse_port=self.workers > 1,
+            compression=None,
+            max_size=MAX_MESSAGE,
+            ping_interval=PING_INTERVAL,
+            ping_timeout=PING_INTERVAL
+        ):
+            print(f'воркер {self.worker}: ws://{host}:{port}', file=sys.stderr)
+            await stop.wait()
+
+
+def run_worker(worker: int, workers: int, host: str, port: int, run_dir: str = None) -> None:
+    server = Server(worker, workers, run_dir)
+    try:
+        import uvloop
+    except ImportError:
+        asyncio.run(server.run(host, port))
+    else:
+        uvloop.run(server.run(host, port))
+
+
+def supervise(args) -> None:
+    '''Запускает воркеры и перезапускает упавшие до SIGINT / SIGTERM'''
+    run_dir = args.run_dir or tempfile.mkdtemp(prefix='signaling-')
+    os.makedirs(run_dir, exist_ok=True)
+    context = multiprocessing.get_context('fork')
+    processes = {}
+    stopping = False
+
+    def start(worker: int) -> None:
+        process = context.Process(
+            target=run_worker, args=(worker, args.workers, args.host, args.port, run_dir), daemon=True
+        )
+        process.start()
+        processes[worker] = process
+
+    def stop(signum, frame) -> None:
+        nonlocal stopping
+        stopping = True
+        for process in processes.values():
+            process.terminate()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    for worker in range(args.workers):
+        start(worker)
+    try:
+        while not stopping:
+            multiprocessing.connection.wait([p.sentinel for p in processes.values()], timeout=1)
+            for worker, process in list(processes.items()):
+                if not process.is_alive() and not stopping:
+                    print(f'воркер {worker} завершился с кодом {process.exitcode}, перезапуск', file=sys.stderr)
+                    start(worker)
+    finally:
+        for process in processes.values():
+            process.join(5)
+        if not args.run_dir:
+            shutil.rmtree(run_dir, ignore_errors=True)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='WebSocket-сервер сигнализации')
+    parser.add_argument('--host', default=SERVER_HOST)
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--workers', type=int, default=SERVER_WORKERS, help='процессов на порту (по числу ядер)')
+    parser.add_argument('--run-dir', help='каталог Unix-сокетов воркеров (временный по умолчанию)')
+    args = parser.parse_args(argv)
+
+    if args.workers <= 1:
+        run_worker(0, 1, args.host, args.port)
+    else:
+        supervise(args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
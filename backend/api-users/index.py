@@ -1,131 +1,159 @@
-import json
-import os
-import psycopg2
-from datetime import datetime
 import uuid
 
+import admission
+import core
+import db
+import metrics
+import presence
+
+presence_buffer = presence.PresenceBuffer('peer_id', 'varchar')
+router = core.Router()
+
+metrics.register('pool', db.stats)
+metrics.register('presence', presence_buffer.stats)
+metrics.register('admission', admission.stats)
+
+PREFLIGHT = core.preflight('GET, POST, OPTIONS', 'Content-Type')
+
+
+def action_of(event: dict) -> str:
+    return core.query_params(event).get('action', 'list')
+
+
+@router.route('POST', 'register')
+def register(event: dict, conn, cur) -> dict:
+    body = core.json_body(event)
+    name = body.get('name', '')
+    phone = body.get('phone', '')
+    peer_id = f"peer_{uuid.uuid4().hex[:8]}"
+
+    cur.execute(
+        "INSERT INTO users (name, phone, peer_id, status) VALUES (%s, %s, %s, %s) RETURNING id, name, phone, peer_id, status",
+        (name, phone, peer_id, 'online')
+    )
+    row = cur.fetchone()
+    conn.commit()
+
+    user = {
+        'id': row[0],
+        'name': row[1],
+        'phone': row[2],
+        'peer_id': row[3],
+        'status': row[4]
+    }
+
+    return core.response(200, {'user': user})
+
+
+@router.route('GET', 'list')
+def list_online(event: dict, conn, cur) -> dict:
+    cur.execute("SELECT id, name, phone, peer_id, status FROM users WHERE status IN ('online', 'busy', 'in_call') ORDER BY name")
+    rows = cur.fetchall()
+
+    users = [
+        {
+            'id': row[0],
+            'name': row[1],
+            'phone': row[2],
+            'peer_id': row[3],
+            'status': row[4]
+        }
+        for row in rows
+    ]
+
+    return core.response(200, {'users': users})
+
+
+@router.route('POST', 'status')
+def update_status(event: dict, conn, cur) -> dict:
+    peer_id = action_of(event).split('/')[-1]
+    body = core.json_body(event)
+    status = body.get('status', 'online')
+
+    try:
+        presence_buffer.add(peer_id, status)
+    except ValueError as e:
+        return core.error(400, str(e))
+    # Явная смена статуса пишется сразу вместе с накопленным: буферизуются только heartbeat'ы
+    presence_buffer.flush(cur)
+    conn.commit()
+
+    return core.success()
+
+
+@router.route('POST', 'heartbeat')
+def heartbeat(event: dict, conn, cur) -> dict:
+    body = core.json_body(event)
+    heartbeats = body.get('heartbeats', [])
+
+    try:
+        for beat in heartbeats:
+            presence_buffer.add(beat['peer_id'], beat.get('status'))
+    except (KeyError, TypeError, ValueError) as e:
+        return core.error(400, f'Некорректный heartbeat: {e}')
+
+    flushed = 0
+    if presence_buffer.due():
+        flushed = presence_buffer.flush(cur)
+        conn.commit()
+
+    return core.response(202, {'success': True, 'queued': len(heartbeats), 'flushed': flushed})
+
+
+def serve(event: dict, route, conn) -> dict:
+    cur = metrics.cursor(conn.cursor())
+    try:
+        if presence_buffer.due():
+            presence_buffer.flush(cur)
+            conn.commit()
+
+        return route(event, conn, cur)
+    finally:
+        cur.close()
+
+
+@metrics.instrument('api-users')
 def handler(event: dict, context) -> dict:
     """API для управления пользователями VoIP системы"""
-    
+
     method = event.get('httpMethod', 'GET')
-    query_params = event.get('queryStringParameters', {})
-    path = query_params.get('action', 'list')
-    
+
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    cur = conn.cursor()
-    
+        return PREFLIGHT
+
+    action = action_of(event)
+    route_key = action.split('/', 1)[0]
+    route = router.resolve(method, route_key)
+    if route is None or (route_key == 'status' and '/' not in action):
+        return core.not_found()
+    metrics.set_route(route.__name__)
+
+    rejected = admission.limit(event, route)
+    if rejected is not None:
+        return rejected
+
+    if not admission.enter(route):
+        return admission.too_many(admission.WAIT)
     try:
-        if path == 'register' and method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            name = body.get('name', '')
-            phone = body.get('phone', '')
-            peer_id = f"peer_{uuid.uuid4().hex[:8]}"
-            
-            cur.execute(
-                "INSERT INTO users (name, phone, peer_id, status) VALUES (%s, %s, %s, %s) RETURNING id, name, phone, peer_id, status",
-                (name, phone, peer_id, 'online')
-            )
-            row = cur.fetchone()
-            conn.commit()
-            
-            user = {
-                'id': row[0],
-                'name': row[1],
-                'phone': row[2],
-                'peer_id': row[3],
-                'status': row[4]
-            }
-            
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'user': user}),
-                'isBase64Encoded': False
-            }
-        
-        elif path == 'list' and method == 'GET':
-            cur.execute("SELECT id, name, phone, peer_id, status FROM users WHERE status IN ('online', 'busy', 'in_call') ORDER BY name")
-            rows = cur.fetchall()
-            
-            users = [
-                {
-                    'id': row[0],
-                    'name': row[1],
-                    'phone': row[2],
-                    'peer_id': row[3],
-                    'status': row[4]
-                }
-                for row in rows
-            ]
-            
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'users': users}),
-                'isBase64Encoded': False
-            }
-        
-        elif path.startswith('status/') and method == 'POST':
-            peer_id = path.split('/')[-1]
-            body = json.loads(event.get('body', '{}'))
-            status = body.get('status', 'online')
-            
-            cur.execute(
-                "UPDATE users SET status = %s, last_seen = %s WHERE peer_id = %s",
-                (status, datetime.now(), peer_id)
-            )
-            conn.commit()
-            
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'success': True}),
-                'isBase64Encoded': False
-            }
-        
-        else:
-            return {
-                'statusCode': 404,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'error': 'Not found'}),
-                'isBase64Encoded': False
-            }
-    
+        with metrics.pool_wait():
+            conn = db.getconn()
     except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': str(e)}),
-            'isBase64Encoded': False
-        }
+        admission.leave()
+        metrics.record_error(e)
+        return core.error(503, str(e), admission.retry_headers(1))
+
+    try:
+        try:
+            return serve(event, route, conn)
+        except Exception as e:
+            if not db.dropped(conn, e):
+                raise
+            conn = db.replace(conn)
+            return serve(event, route, conn)
+
+    except Exception as e:
+        metrics.record_error(e)
+        return core.error(500, str(e))
     finally:
-        cur.close()
-        conn.close()
\ No newline at end of file
+        db.putconn(conn)
+        admission.leave()
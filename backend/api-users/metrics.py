@@ -0,0 +1,246 @@
+'''Встроенные метрики обработчика: гистограммы латентности маршрутов,
+SQL-запросов, ожидания пула и размеров тел запросов и ответов.
+
+Файл одинаковый во всех функциях backend/.
+
+- METRICS_SAMPLE_RATE — доля запросов с замером времени (1 — все, 0 — выключено);
+  счётчики запросов и ошибок ведутся всегда;
+- METRICS_LOG_INTERVAL — как часто печатать снимок одной JSON-строкой в лог, секунд (60, 0 — не печатать);
+- METRICS_TOKEN — если задан, снимок по GET /metrics (или ?action=metrics) отдаётся
+  только с заголовком X-Metrics-Token.
+'''
+import bisect
+import functools
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import core
+
+SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', '1'))
+LOG_INTERVAL = float(os.environ.get('METRICS_LOG_INTERVAL', '60'))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+BUCKETS_BYTES = (128, 512, 1024, 4096, 16384, 65536, 262144, 1048576)
+MAX_STATEMENTS = 1000
+
+_STATEMENT_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE)\s+(\w+)', re.IGNORECASE)
+
+
+class Histogram:
+    '''Гистограмма с фиксированными границами корзин, квантили — по верхней границе'''
+
+    __slots__ = ('bounds', 'counts', 'count', 'total', 'max')
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= rank:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return 0.0
+
+    def snapshot(self) -> dict:
+        return {
+            'count': self.count,
+            'sum': round(self.total, 3),
+            'max': round(self.max, 3),
+            'p50': round(self.quantile(0.5), 3),
+            'p95': round(self.quantile(0.95), 3),
+            'p99': round(self.quantile(0.99), 3),
+            'buckets': {str(bound): n for bound, n in zip(self.bounds + ('inf',), self.counts) if n}
+        }
+
+
+_lock = threading.Lock()
+_histograms = {}
+_requests = {}
+_errors = {}
+_providers = {}
+_statement_keys = {}
+_state = threading.local()
+_started = time.time()
+_last_log = time.monotonic()
+
+
+def observe(name: str, label: str, value: float, bounds: tuple = BUCKETS_MS) -> None:
+    with _lock:
+        histogram = _histograms.get((name, label))
+        if histogram is None:
+            histogram = _histograms[(name, label)] = Histogram(bounds)
+        histogram.observe(value)
+
+
+def register(name: str, provider) -> None:
+    '''Добавляет в снимок stats() модуля: пула, bcrypt, реестра и т.п.'''
+    _providers[name] = provider
+
+
+def set_route(name: str) -> None:
+    _state.route = name
+
+
+def sampled() -> bool:
+    return getattr(_state, 'sampled', False)
+
+
+def statement_key(sql: str) -> str:
+    '''Короткое имя запроса: первое слово и первая таблица — "UPDATE users"'''
+    key = _statement_keys.get(sql)
+    if key is None:
+        words = sql.split(None, 1)
+        table = _STATEMENT_TABLE.search(sql)
+        key = (words[0].upper() if words else '') + (f' {table.group(1)}' if table else '')
+        if len(_statement_keys) < MAX_STATEMENTS:
+            _statement_keys[sql] = key
+    return key
+
+
+class TimedCursor:
+    '''Обёртка курсора, замеряющая каждый execute'''
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, params=None):
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(sql, params)
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            _state.sql_ms = getattr(_state, 'sql_ms', 0.0) + elapsed_ms
+            observe('sql_ms', f'{getattr(_state, "route", "")}: {statement_key(sql)}', elapsed_ms)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cursor.close()
+
+
+def cursor(cur):
+    '''Курсор с замером SQL, если текущий запрос попал в выборку'''
+    return TimedCursor(cur) if sampled() else cur
+
+
+@contextmanager
+def pool_wait():
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _state.pool_ms = (time.perf_counter() - started) * 1000
+
+
+def record_error(e: Exception) -> None:
+    key = (getattr(_state, 'route', ''), type(e).__name__)
+    with _lock:
+        _errors[key] = _errors.get(key, 0) + 1
+
+
+def snapshot(function: str) -> dict:
+    with _lock:
+        histograms = {}
+        for (name, label), histogram in _histograms.items():
+            histograms.setdefault(name, {})[label] = histogram.snapshot()
+        requests = {}
+        for (route, status), n in _requests.items():
+            requests.setdefault(route, {})[str(status)] = n
+        errors = {}
+        for (route, error_type), n in _errors.items():
+            errors.setdefault(route, {})[error_type] = n
+    data = {
+        'function': function,
+        'uptime_s': round(time.time() - _started),
+        'sample_rate': SAMPLE_RATE,
+        'requests': requests,
+        'errors': errors,
+        'histograms': histograms
+    }
+    for name, provider in _providers.items():
+        data[name] = provider()
+    return data
+
+
+def _is_metrics_request(event: dict) -> bool:
+    if event.get('httpMethod') != 'GET':
+        return False
+    return core.route_key(event.get('url', '/')) == 'metrics' or core.query_params(event).get('action') == 'metrics'
+
+
+def _record(state, event: dict, result: dict, elapsed_ms: float) -> None:
+    key = (state.route, result.get('statusCode', 200) if result else 500)
+    with _lock:
+        _requests[key] = _requests.get(key, 0) + 1
+    if not state.sampled:
+        return
+    observe('request_ms', state.route, elapsed_ms)
+    observe('app_ms', state.route, max(0.0, elapsed_ms - state.pool_ms - state.sql_ms))
+    if state.pool_ms:
+        observe('pool_wait_ms', state.route, state.pool_ms)
+    observe('request_bytes', state.route, len(event.get('body') or ''), BUCKETS_BYTES)
+    if result:
+        observe('response_bytes', state.route, len(result.get('body') or ''), BUCKETS_BYTES)
+
+
+def _maybe_log(function: str) -> None:
+    global _last_log
+    if LOG_INTERVAL <= 0 or time.monotonic() - _last_log < LOG_INTERVAL:
+        return
+    _last_log = time.monotonic()
+    print(core.dumps({'metrics': snapshot(function)}), flush=True)
+
+
+def instrument(function: str):
+    '''Оборачивает handler: замер запроса, счётчики по маршруту и коду ответа, GET /metrics.
+
+    Маршрут для меток обработчик сообщает через set_route().
+    '''
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event: dict, context):
+            if _is_metrics_request(event):
+                if METRICS_TOKEN and core.header(event, 'X-Metrics-Token') != METRICS_TOKEN:
+                    return core.error(403, 'Нужен X-Metrics-Token')
+                return core.response(200, snapshot(function))
+
+            state = _state
+            state.sampled = SAMPLE_RATE >= 1 or (SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE)
+            state.route = 'preflight' if event.get('httpMethod') == 'OPTIONS' else 'unrouted'
+            state.pool_ms = 0.0
+            state.sql_ms = 0.0
+            started = time.perf_counter()
+            result = None
+            try:
+                result = handler(event, context)
+                return result
+            finally:
+                _record(state, event, result, (time.perf_counter() - started) * 1000)
+                _maybe_log(function)
+        return wrapper
+    return decorator
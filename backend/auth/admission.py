@@ -0,0 +1,180 @@
+'''Допуск запросов: лимит частоты на клиента и ограничение одновременной работы с базой.
+
+Файл одинаковый в backend/auth, backend/signaling и backend/api-users.
+
+- Token bucket на клиента (user_id проверенной сессии, иначе IP
+  источника из requestContext): ADMISSION_RATE запросов в секунду с
+  запасом ADMISSION_BURST. Сессию обработчик берёт из кеша sessions, без
+  базы; заголовки запроса (X-Authorization, X-Forwarded-For) и user_id в
+  запросе сами по себе нового бакета не дают. У маршрутов звонка
+  (route(..., priority='call')) свой бакет ADMISSION_CALL_RATE /
+  ADMISSION_CALL_BURST, опросы его не тратят.
+- За одним IP стоит целая площадка (офис за NAT), поэтому бакет IP в
+  ADMISSION_SITE_CLIENTS раз больше бакета сессии.
+- Не больше ADMISSION_MAX_ACTIVE запросов экземпляра одновременно держат
+  соединение с базой; ADMISSION_CALL_RESERVE мест из них только для
+  звонков, и ждущие звонки проходят раньше опросов.
+
+Лишние запросы получают 429 с Retry-After (со случайной добавкой, чтобы
+повторы после обрыва сети не приходили одной волной).
+'''
+import math
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+
+import core
+
+RATE = float(os.environ.get('ADMISSION_RATE', '5'))
+BURST = float(os.environ.get('ADMISSION_BURST', '20'))
+CALL_RATE = float(os.environ.get('ADMISSION_CALL_RATE', '20'))
+CALL_BURST = float(os.environ.get('ADMISSION_CALL_BURST', '60'))
+MAX_ACTIVE = int(os.environ.get('ADMISSION_MAX_ACTIVE', os.environ.get('DB_POOL_MAX', '4')))
+CALL_RESERVE = int(os.environ.get('ADMISSION_CALL_RESERVE', '1'))
+WAIT = float(os.environ.get('ADMISSION_WAIT', '0.5'))
+CALL_WAIT = float(os.environ.get('ADMISSION_CALL_WAIT', '3'))
+CLIENTS_MAX = int(os.environ.get('ADMISSION_CLIENTS_MAX', '10000'))
+SITE_CLIENTS = max(1, int(os.environ.get('ADMISSION_SITE_CLIENTS', '20')))
+
+CALL = 'call'
+RETRY_HEADERS = {'Access-Control-Expose-Headers': 'Retry-After'}
+
+
+class TokenBuckets:
+    '''Token bucket на ключ клиента; давно не виденные ключи вытесняются'''
+
+    def __init__(self, rate: float, burst: float, maxsize: int = CLIENTS_MAX):
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str) -> float:
+        '''0 — токен взят, иначе через сколько секунд появится следующий'''
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class Gate:
+    '''Ограничение одновременной работы с базой с резервом мест для звонков'''
+
+    def __init__(self, limit: int = MAX_ACTIVE, reserve: int = CALL_RESERVE):
+        self.limit = max(1, limit)
+        self.reserve = min(max(0, reserve), self.limit - 1)
+        self.active = 0
+        self.waiting_calls = 0
+        self._cond = threading.Condition()
+
+    def _free(self, call: bool) -> bool:
+        if call:
+            return self.active < self.limit
+        return self.active < self.limit - self.reserve and not self.waiting_calls
+
+    def acquire(self, call: bool, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            if call:
+                self.waiting_calls += 1
+            try:
+                while not self._free(call):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+                self.active += 1
+                return True
+            finally:
+                if call:
+                    self.waiting_calls -= 1
+
+    def release(self) -> None:
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+
+buckets = {CALL: TokenBuckets(CALL_RATE, CALL_BURST), None: TokenBuckets(RATE, BURST)}
+site_buckets = {CALL: TokenBuckets(CALL_RATE * SITE_CLIENTS, CALL_BURST * SITE_CLIENTS),
+                None: TokenBuckets(RATE * SITE_CLIENTS, BURST * SITE_CLIENTS)}
+gate = Gate()
+_stats = {'admitted': 0, 'limited': 0, 'shed': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name: str) -> None:
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def priority_of(route) -> str:
+    return route.route_options.get('priority') if route is not None else None
+
+
+def client_key(event: dict, user_id=None) -> str:
+    if user_id is not None:
+        return f'user:{user_id}'
+    # X-Forwarded-For задаёт сам клиент; без sourceIp — один общий бакет
+    identity = (event.get('requestContext') or {}).get('identity') or {}
+    return identity.get('sourceIp') or 'anonymous'
+
+
+def retry_headers(retry_after: float) -> dict:
+    seconds = max(1, math.ceil(retry_after)) + random.randint(0, 2)
+    return dict(RETRY_HEADERS, **{'Retry-After': str(seconds)})
+
+
+def too_many(retry_after: float) -> dict:
+    return core.error(429, 'Слишком много запросов, повторите позже', retry_headers(retry_after))
+
+
+def limit(event: dict, route, user_id=None):
+    '''Ответ 429, если клиент исчерпал свой бакет; иначе None.
+
+    user_id — из уже проверенной сессии; без него клиент считается по IP
+    с бакетом площадки.
+    '''
+    table = buckets if user_id is not None else site_buckets
+    wait = table[priority_of(route)].take(client_key(event, user_id))
+    if wait:
+        _count('limited')
+        return too_many(wait)
+    return None
+
+
+def enter(route) -> bool:
+    '''Занимает место для работы с базой; False — запрос нужно отклонить'''
+    call = priority_of(route) == CALL
+    if gate.acquire(call, CALL_WAIT if call else WAIT):
+        _count('admitted')
+        return True
+    _count('shed')
+    return False
+
+
+def leave() -> None:
+    gate.release()
+
+
+def stats() -> dict:
+    with _stats_lock:
+        data = dict(_stats)
+    data.update(active=gate.active, limit=gate.limit, reserve=gate.reserve,
+                clients=sum(len(b) for table in (buckets, site_buckets) for b in table.values()))
+    return data
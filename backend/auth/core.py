@@ -0,0 +1,150 @@
+'''Общее ядро обработчиков: таблица маршрутов, готовые заголовки и ответы, JSON.
+
+Файл одинаковый во всех функциях backend/.
+
+JSON-кодировщик выбирается переменной JSON_ENCODER: orjson (если пакет
+установлен) или json из стандартной библиотеки; по умолчанию — первый
+доступный.
+'''
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+CORS_HEADERS = {'Access-Control-Allow-Origin': '*'}
+# Сколько секунд браузер кеширует ответ на preflight; пустое значение — не кешировать
+PREFLIGHT_MAX_AGE = os.environ.get('CORS_MAX_AGE', '86400')
+
+
+def _stdlib_dumps(data) -> str:
+    return json.dumps(data, default=str)
+
+
+def _orjson_dumps(data) -> str:
+    return orjson.dumps(data, default=str, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+
+
+ENCODERS = {'json': (_stdlib_dumps, json.loads)}
+if orjson is not None:
+    ENCODERS['orjson'] = (_orjson_dumps, orjson.loads)
+
+encoder = None
+dumps = None
+loads = None
+
+
+def set_encoder(name: str = None) -> str:
+    '''Переключает JSON-кодировщик; неизвестное или недоступное имя — stdlib'''
+    global encoder, dumps, loads
+    name = name or os.environ.get('JSON_ENCODER') or ('orjson' if orjson is not None else 'json')
+    if name not in ENCODERS:
+        name = 'json'
+    encoder = name
+    dumps, loads = ENCODERS[name]
+    return name
+
+
+set_encoder()
+
+
+def json_body(event: dict) -> dict:
+    body = event.get('body')
+    if not body or not body.strip():
+        return {}
+    return loads(body)
+
+
+def query_params(event: dict) -> dict:
+    return event.get('queryStringParameters') or {}
+
+
+def header(event: dict, name: str):
+    name = name.lower()
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def response(status: int, data, headers: dict = None) -> dict:
+    return {
+        'statusCode': status,
+        'headers': dict(JSON_HEADERS, **headers) if headers else JSON_HEADERS,
+        'body': dumps(data),
+        'isBase64Encoded': False
+    }
+
+
+def raw_response(status: int, body: str, headers: dict = None) -> dict:
+    '''Ответ с уже сериализованным телом'''
+    return {
+        'statusCode': status,
+        'headers': headers if headers is not None else JSON_HEADERS,
+        'body': body,
+        'isBase64Encoded': False
+    }
+
+
+def error(status: int, message: str, headers: dict = None) -> dict:
+    return response(status, {'error': message}, headers)
+
+
+def preflight(methods: str, allow_headers: str, max_age: str = PREFLIGHT_MAX_AGE) -> dict:
+    headers = {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Methods': methods,
+        'Access-Control-Allow-Headers': allow_headers
+    }
+    if max_age:
+        headers['Access-Control-Max-Age'] = max_age
+    return {'statusCode': 200, 'headers': headers, 'body': '', 'isBase64Encoded': False}
+
+
+EMPTY_OK = {'statusCode': 200, 'body': '', 'isBase64Encoded': False}
+NOT_FOUND_BODY = dumps({'error': 'Not found'})
+SUCCESS_BODY = dumps({'success': True})
+
+
+def not_found() -> dict:
+    return raw_response(404, NOT_FOUND_BODY)
+
+
+def success() -> dict:
+    return raw_response(200, SUCCESS_BODY)
+
+
+def route_key(url: str) -> str:
+    '''Последний сегмент пути без query-строки: "/fn-id/initiate?x=1" -> "initiate"'''
+    path = (url or '/').split('?', 1)[0].strip().strip('/')
+    return path.rsplit('/', 1)[-1]
+
+
+class Router:
+    '''Точное сопоставление (метод, сегмент) -> обработчик за один поиск в dict.
+
+    Для метода можно задать маршрут по умолчанию (path=None) — он
+    отвечает, когда точного совпадения нет.
+    '''
+
+    def __init__(self):
+        self._routes = {}
+
+    def route(self, method: str, path: str = None, **options):
+        def decorator(fn):
+            fn.route_options = options
+            self._routes[(method, path)] = fn
+            return fn
+        return decorator
+
+    def resolve(self, method: str, path: str):
+        fn = self._routes.get((method, path))
+        if fn is None:
+            fn = self._routes.get((method, None))
+        return fn
+
+    def routes(self) -> list:
+        return [(method, path, fn.__name__) for (method, path), fn in self._routes.items()]
@@ -0,0 +1,249 @@
+'''Пул соединений с Postgres, живущий между тёплыми вызовами функции.
+
+Файл одинаковый во всех функциях backend/: каждая функция деплоится
+отдельно, поэтому общий код копируется в её каталог.
+
+psycopg2 импортируется при первом обращении к базе, а не при загрузке
+модуля: холодный старт и preflight-запросы драйвер не грузят.
+
+Соединение, которое сервер закрыл, пока оно лежало в пуле (рестарт,
+idle-kill), проявляется OperationalError на первом запросе. Обработчик
+проверяет это через dropped() и повторяет запрос один раз на новом
+соединении из replace(): незакоммиченная транзакция на сервере уже
+откатилась. После commit повтора нет.
+'''
+import os
+import threading
+import time
+
+POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '5'))
+VALIDATE_AFTER = float(os.environ.get('DB_POOL_VALIDATE_AFTER', '30'))
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+_connection_class = None
+
+
+def _connection_factory():
+    '''Соединение пула: помнит, взято ли оно из простоя и был ли commit'''
+    global _connection_class
+    if _connection_class is None:
+        import psycopg2.extensions
+
+        class PooledConnection(psycopg2.extensions.connection):
+            reused = False
+            committed = False
+
+            def commit(self):
+                self.committed = True
+                super().commit()
+
+        _connection_class = PooledConnection
+    return _connection_class
+
+
+class ConnectionPool:
+    '''Ограниченный пул с ленивой проверкой соединений при выдаче'''
+
+    def __init__(self, dsn: str, maxconn: int = POOL_MAX, timeout: float = POOL_TIMEOUT,
+                 validate_after: float = VALIDATE_AFTER):
+        self.dsn = dsn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.validate_after = validate_after
+        self._idle = []
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'waits': 0,
+            'wait_ms': 0.0,
+            'timeouts': 0,
+            'reconnects': 0,
+            'discarded': 0,
+            'retries': 0,
+            'reserved': 0,
+        }
+
+    def getconn(self):
+        if not self._slots.acquire(blocking=False):
+            started = time.perf_counter()
+            acquired = self._slots.acquire(timeout=self.timeout)
+            with self._lock:
+                self._stats['waits'] += 1
+                self._stats['wait_ms'] += (time.perf_counter() - started) * 1000
+                if not acquired:
+                    self._stats['timeouts'] += 1
+            if not acquired:
+                raise PoolTimeout('Нет свободных соединений с базой данных')
+        try:
+            return self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, discard: bool = False):
+        import psycopg2.extensions
+
+        try:
+            if not discard and not conn.closed:
+                status = conn.get_transaction_status()
+                if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                    discard = True
+                elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+        except psycopg2.Error:
+            discard = True
+        try:
+            if discard or conn.closed:
+                self._close(conn)
+                with self._lock:
+                    self._stats['discarded'] += 1
+            else:
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    self._stats['misses'] += 1
+                    break
+                conn, released_at = self._idle.pop()
+            if self._usable(conn, released_at):
+                with self._lock:
+                    self._stats['hits'] += 1
+                self._mark(conn, reused=True)
+                return conn
+            self._close(conn)
+            with self._lock:
+                self._stats['reconnects'] += 1
+        return self._connect()
+
+    def _connect(self):
+        '''Новое соединение; обрыв при подключении повторяется один раз'''
+        import psycopg2
+
+        try:
+            conn = psycopg2.connect(self.dsn, connection_factory=_connection_factory())
+        except psycopg2.OperationalError:
+            with self._lock:
+                self._stats['reconnects'] += 1
+            conn = psycopg2.connect(self.dsn, connection_factory=_connection_factory())
+        self._mark(conn, reused=False)
+        return conn
+
+    @staticmethod
+    def _mark(conn, reused: bool):
+        try:
+            conn.reused = reused
+            conn.committed = False
+        except AttributeError:
+            pass
+
+    def reserve(self):
+        '''Навсегда забирает место из пула под соединение вне его (LISTEN и т.п.)'''
+        if self.maxconn <= 1 or not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeout('Нет свободных соединений с базой данных')
+        with self._lock:
+            self.maxconn -= 1
+            self._stats['reserved'] += 1
+
+    def replace(self, conn):
+        '''Закрывает оборванное соединение и открывает новое, не освобождая места в пуле'''
+        self._close(conn)
+        with self._lock:
+            self._stats['discarded'] += 1
+            self._stats['retries'] += 1
+        return self._connect()
+
+    def _usable(self, conn, released_at: float) -> bool:
+        import psycopg2
+
+        if conn.closed:
+            return False
+        if time.monotonic() - released_at < self.validate_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @staticmethod
+    def _close(conn):
+        import psycopg2
+
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+            data['idle'] = len(self._idle)
+        data['max'] = self.maxconn
+        return data
+
+    def closeall(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._close(conn)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(os.environ['DATABASE_URL'])
+    return _pool
+
+
+def getconn():
+    return get_pool().getconn()
+
+
+def putconn(conn, discard: bool = False):
+    '''Возвращает соединение в пул; оборванные соединения выбрасываются'''
+    get_pool().putconn(conn, discard=discard)
+
+
+def dropped(conn, error: Exception) -> bool:
+    '''Сервер закрыл соединение, взятое из пула, до первого commit — запрос можно повторить'''
+    import psycopg2
+
+    return (isinstance(error, psycopg2.OperationalError) and bool(conn.closed)
+            and getattr(conn, 'reused', False) and not getattr(conn, 'committed', False))
+
+
+def replace(conn):
+    '''Новое соединение вместо оборванного; место в пуле остаётся занятым'''
+    return get_pool().replace(conn)
+
+
+def dict_cursor(conn):
+    '''Курсор, отдающий строки словарями (RealDictCursor)'''
+    from psycopg2.extras import RealDictCursor
+    return conn.cursor(cursor_factory=RealDictCursor)
+
+
+def stats() -> dict:
+    if _pool is None:
+        return {}
+    return _pool.stats()
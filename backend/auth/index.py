@@ -1,179 +1,345 @@
-import json
+import base64
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
-import bcrypt
-import secrets
 
-def handler(event: dict, context) -> dict:
-    '''API для регистрации и авторизации пользователей VoIP системы'''
-    method = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Authorization'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    dsn = os.environ.get('DATABASE_URL')
-    if not dsn:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Database connection not configured'}),
-            'isBase64Encoded': False
-        }
-    
-    try:
-        conn = psycopg2.connect(dsn)
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        path = event.get('url', '/').strip()
-        
-        if method == 'POST' and 'register' in path:
-            body = json.loads(event.get('body', '{}'))
-            username = body.get('username', '').strip()
-            phone = body.get('phone', '').strip()
-            password = body.get('password', '')
-            
-            if not username or not phone or not password:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Заполните все поля'}),
-                    'isBase64Encoded': False
-                }
-            
-            cur.execute("SELECT id FROM users WHERE username = %s OR phone = %s", (username, phone))
-            if cur.fetchone():
-                return {
-                    'statusCode': 409,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Пользователь с таким именем или телефоном уже существует'}),
-                    'isBase64Encoded': False
-                }
-            
-            password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-            
+import admission
+import core
+import db
+import metrics
+import passwords
+import presence
+import provisioning
+import sessions
+import users_cache
+
+presence_buffer = presence.PresenceBuffer('id', 'int')
+router = core.Router()
+
+metrics.register('pool', db.stats)
+metrics.register('passwords', passwords.stats)
+metrics.register('sessions', sessions.stats)
+metrics.register('presence', presence_buffer.stats)
+metrics.register('users_cache', users_cache.cache.stats)
+metrics.register('admission', admission.stats)
+
+PREFLIGHT = core.preflight('GET, POST, PUT, OPTIONS', 'Content-Type, X-Authorization, If-None-Match')
+USER_EXISTS_BODY = core.dumps({'error': 'Пользователь с таким именем или телефоном уже существует'})
+
+
+@router.route('POST', 'register', db=False)
+def register(event: dict) -> dict:
+    body = core.json_body(event)
+    username = body.get('username', '').strip()
+    phone = body.get('phone', '').strip()
+    password = body.get('password', '')
+
+    if not username or not phone or not password:
+        return core.error(400, 'Заполните все поля')
+
+    def is_taken(conn, cur):
+        cur.execute(
+            "SELECT EXISTS(SELECT 1 FROM users WHERE username = %s) OR EXISTS(SELECT 1 FROM users WHERE phone = %s) AS taken",
+            (username, phone)
+        )
+        taken = cur.fetchone()['taken']
+        conn.rollback()
+        return taken
+
+    if with_db(register, is_taken):
+        return core.raw_response(409, USER_EXISTS_BODY)
+
+    password_hash = passwords.hash_password(password)
+
+    def create(conn, cur):
+        import psycopg2.errors
+        try:
             cur.execute(
                 "INSERT INTO users (username, phone, password_hash, role, status) VALUES (%s, %s, %s, 'user', 'offline') RETURNING id, username, phone, role",
                 (username, phone, password_hash)
             )
-            user = cur.fetchone()
-            conn.commit()
-            
-            token = secrets.token_urlsafe(32)
-            
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 201,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'user': dict(user), 'token': token}),
-                'isBase64Encoded': False
-            }
-        
-        elif method == 'POST' and 'login' in path:
-            body = json.loads(event.get('body', '{}'))
-            phone = body.get('phone', '').strip()
-            password = body.get('password', '')
-            
-            if not phone or not password:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Введите телефон и пароль'}),
-                    'isBase64Encoded': False
-                }
-            
-            cur.execute("SELECT id, username, phone, password_hash, role FROM users WHERE phone = %s", (phone,))
-            user = cur.fetchone()
-            
-            if not user or not bcrypt.checkpw(password.encode('utf-8'), user['password_hash'].encode('utf-8')):
-                return {
-                    'statusCode': 401,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Неверный телефон или пароль'}),
-                    'isBase64Encoded': False
-                }
-            
-            cur.execute("UPDATE users SET status = 'online', last_seen = CURRENT_TIMESTAMP WHERE id = %s", (user['id'],))
-            conn.commit()
-            
-            token = secrets.token_urlsafe(32)
-            user_data = {k: v for k, v in user.items() if k != 'password_hash'}
-            
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'user': user_data, 'token': token}),
-                'isBase64Encoded': False
-            }
-        
-        elif method == 'GET':
-            cur.execute("SELECT id, username, phone, role, status, last_seen FROM users ORDER BY last_seen DESC")
+        except psycopg2.errors.UniqueViolation:
+            conn.rollback()
+            return None
+        user = cur.fetchone()
+        token = sessions.create(cur, user['id'])
+        conn.commit()
+        return {'user': dict(user), 'token': token}
+
+    created = with_db(register, create)
+    if created is None:
+        return core.raw_response(409, USER_EXISTS_BODY)
+
+    return core.response(201, created)
+
+
+@router.route('POST', 'login', db=False)
+def login(event: dict) -> dict:
+    body = core.json_body(event)
+    phone = body.get('phone', '').strip()
+    password = body.get('password', '')
+
+    if not phone or not password:
+        return core.error(400, 'Введите телефон и пароль')
+
+    def lookup(conn, cur):
+        user = users_cache.cache.get(cur, 'phone', phone)
+        conn.rollback()
+        return user
+
+    user = with_db(login, lookup)
+
+    if not user or not passwords.verify_password(password, user['password_hash']):
+        return core.error(401, 'Неверный телефон или пароль')
+
+    new_hash = passwords.hash_password(password) if passwords.needs_rehash(user['password_hash']) else None
+
+    def sign_in(conn, cur):
+        cur.execute(
+            "UPDATE users SET status = 'online', last_seen = CURRENT_TIMESTAMP, password_hash = COALESCE(%s, password_hash) WHERE id = %s",
+            (new_hash, user['id'])
+        )
+        token = sessions.create(cur, user['id'])
+        conn.commit()
+        return token
+
+    token = with_db(login, sign_in)
+    if new_hash:
+        users_cache.cache.invalidate(user['id'])
+
+    user_data = {k: user[k] for k in ('id', 'username', 'phone', 'role')}
+
+    return core.response(200, {'user': user_data, 'token': token})
+
+
+@router.route('POST', 'logout')
+def logout(event: dict, conn, cur) -> dict:
+    token = sessions.token_from_event(event)
+
+    if not token:
+        return core.error(401, 'Требуется авторизация')
+
+    revoked = sessions.revoke(cur, token)
+    conn.commit()
+
+    return core.response(200, {'success': revoked})
+
+
+@router.route('POST', 'import', db=False)
+def import_users(event: dict) -> dict:
+    text = event.get('body') or ''
+    if event.get('isBase64Encoded'):
+        text = base64.b64decode(text).decode('utf-8-sig')
+    fmt = core.query_params(event).get('format') or provisioning.detect_format(text, core.header(event, 'Content-Type'))
+    if fmt not in ('csv', 'jsonl'):
+        return core.error(400, 'format: csv или jsonl')
+
+    rows, errors = provisioning.parse(text, fmt)
+    users, invalid = provisioning.check(rows)
+    token = sessions.token_from_event(event)
+
+    def authorize(conn, cur):
+        '''(ответ с отказом или None, свободные строки, занятые)'''
+        user_id = sessions.validate(token, conn)
+        if user_id is None:
+            return core.error(401, 'Требуется авторизация'), [], []
+        admin = users_cache.cache.get(cur, 'id', user_id)
+        conn.rollback()
+        if not admin or admin['role'] != 'admin':
+            return core.error(403, 'Импорт доступен только администратору'), [], []
+        if len(rows) > provisioning.IMPORT_MAX_ROWS:
+            return core.error(413, f'Не больше {provisioning.IMPORT_MAX_ROWS} строк за запрос, большие файлы — через provisioning.py'), [], []
+
+        fresh, taken = provisioning.exclude_taken(cur, users)
+        conn.rollback()
+        return None, fresh, taken
+
+    rejected, fresh, taken = with_db(import_users, authorize)
+    if rejected is not None:
+        return rejected
+
+    # bcrypt — секунды на пачку, соединение и место в admission на это время отпущены
+    hashed, failed = provisioning.hash_users(fresh)
+    created, conflicts = with_db(import_users, lambda conn, cur: provisioning.insert_users(conn, cur, hashed))
+
+    return core.response(200, provisioning.report(created, errors + invalid + taken + failed + conflicts))
+
+
+@router.route('GET', 'session')
+def session(event: dict, conn, cur) -> dict:
+    user_id = sessions.validate(sessions.token_from_event(event), conn)
+
+    if user_id is None:
+        return core.error(401, 'Сессия недействительна')
+
+    return core.response(200, {'user_id': user_id})
+
+
+@router.route('GET')
+def list_users(event: dict, conn, cur) -> dict:
+    query = core.query_params(event)
+
+    position = users_cache.feed_position(cur)
+    version, cursor = position['version'], position['cursor']
+    etag = f'"users-{version}-{cursor}"'
+    cache_headers = {
+        'Access-Control-Expose-Headers': 'ETag',
+        'ETag': etag,
+        'Cache-Control': 'no-cache'
+    }
+
+    if core.header(event, 'If-None-Match') == etag:
+        return core.raw_response(304, '', dict(core.JSON_HEADERS, **cache_headers))
+
+    since = query.get('since')
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError:
+            return core.error(400, 'since должен быть числом')
+
+    # Курсор больше horizon выдан до перехода на номера транзакций — отдаём полный список
+    if since is not None and since <= position['horizon']:
+        users = []
+        if since <= version:
+            cur.execute(
+                "SELECT id, username, phone, role, status, last_seen FROM users WHERE version >= %s ORDER BY version",
+                (since,)
+            )
             users = cur.fetchall()
-            
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'users': [dict(u) for u in users]}, default=str),
-                'isBase64Encoded': False
-            }
-        
-        elif method == 'PUT' and 'status' in path:
-            body = json.loads(event.get('body', '{}'))
-            user_id = body.get('user_id')
-            status = body.get('status', 'offline')
-            
-            if not user_id:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'user_id required'}),
-                    'isBase64Encoded': False
-                }
-            
-            cur.execute("UPDATE users SET status = %s, last_seen = CURRENT_TIMESTAMP WHERE id = %s", (status, user_id))
+
+        return core.response(200, {'users': users, 'cursor': cursor, 'delta': True}, cache_headers)
+
+    cur.execute("SELECT id, username, phone, role, status, last_seen FROM users ORDER BY last_seen DESC")
+    users = cur.fetchall()
+
+    return core.response(200, {'users': users, 'cursor': cursor, 'delta': False}, cache_headers)
+
+
+@router.route('PUT', 'status')
+def update_status(event: dict, conn, cur) -> dict:
+    body = core.json_body(event)
+    user_id = body.get('user_id')
+    status = body.get('status', 'offline')
+
+    if not user_id:
+        return core.error(400, 'user_id required')
+
+    try:
+        presence_buffer.add(int(user_id), status)
+    except ValueError as e:
+        return core.error(400, str(e))
+    presence_buffer.flush(cur)
+    conn.commit()
+
+    return core.success()
+
+
+@router.route('POST', 'heartbeat')
+def heartbeat(event: dict, conn, cur) -> dict:
+    body = core.json_body(event)
+    heartbeats = body.get('heartbeats') or [body]
+
+    try:
+        for beat in heartbeats:
+            presence_buffer.add(int(beat['user_id']), beat.get('status'))
+    except (KeyError, TypeError, ValueError) as e:
+        return core.error(400, f'Некорректный heartbeat: {e}')
+
+    flushed = 0
+    if presence_buffer.due():
+        flushed = presence_buffer.flush(cur)
+        conn.commit()
+
+    return core.response(202, {'success': True, 'queued': len(heartbeats), 'flushed': flushed})
+
+
+class Unavailable(Exception):
+    '''Нет места в admission или свободного соединения; response — готовый ответ'''
+
+    def __init__(self, response: dict):
+        super().__init__(response['body'])
+        self.response = response
+
+
+def with_db(route, work):
+    '''work(conn, cur) с местом в admission и соединением из пула.
+
+    Маршруты с db=False берут их только на время работы с базой: bcrypt
+    (сотни миллисекунд) считается без соединения. Соединение, оборванное
+    сервером до commit, заменяется новым, и work повторяется один раз.
+    '''
+    if not admission.enter(route):
+        raise Unavailable(admission.too_many(admission.WAIT))
+    try:
+        try:
+            with metrics.pool_wait():
+                conn = db.getconn()
+        except Exception as e:
+            metrics.record_error(e)
+            raise Unavailable(core.error(503, str(e), admission.retry_headers(1)))
+
+        try:
+            try:
+                return serve(work, conn)
+            except Exception as e:
+                if not db.dropped(conn, e):
+                    raise
+                conn = db.replace(conn)
+                return serve(work, conn)
+        finally:
+            db.putconn(conn)
+    finally:
+        admission.leave()
+
+
+def serve(work, conn):
+    cur = metrics.cursor(db.dict_cursor(conn))
+    try:
+        if presence_buffer.due():
+            presence_buffer.flush(cur)
             conn.commit()
-            
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'success': True}),
-                'isBase64Encoded': False
-            }
-        
+
+        return work(conn, cur)
+    finally:
         cur.close()
-        conn.close()
-        
-        return {
-            'statusCode': 404,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Not found'}),
-            'isBase64Encoded': False
-        }
-    
+
+
+@metrics.instrument('auth')
+def handler(event: dict, context) -> dict:
+    '''API для регистрации и авторизации пользователей VoIP системы'''
+    method = event.get('httpMethod', 'GET')
+
+    if method == 'OPTIONS':
+        return PREFLIGHT
+
+    route = router.resolve(method, core.route_key(event.get('url', '/')))
+    if route is None:
+        return core.not_found()
+    metrics.set_route(route.__name__)
+
+    if not os.environ.get('DATABASE_URL'):
+        return core.error(500, 'Database connection not configured')
+
+    token = sessions.token_from_event(event)
+    rejected = admission.limit(event, route, sessions.cached(token))
+    if rejected is not None:
+        return rejected
+
+    def work(conn, cur):
+        # Проверенная сессия попадает в кеш, и admission считает следующие
+        # запросы клиента по user_id, а не по IP
+        sessions.validate(token, conn)
+        return route(event, conn, cur)
+
+    try:
+        if not route.route_options.get('db', True):
+            return route(event)
+        return with_db(route, work)
+
+    except Unavailable as e:
+        return e.response
+    except passwords.PasswordHasherBusy as e:
+        metrics.record_error(e)
+        return core.error(503, str(e), admission.retry_headers(1))
     except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': str(e)}),
-            'isBase64Encoded': False
-        }
\ No newline at end of file
+        metrics.record_error(e)
+        return core.error(500, str(e))
@@ -0,0 +1,123 @@
+'''Хеширование паролей bcrypt в ограниченном пуле потоков.
+
+bcrypt отпускает GIL, поэтому хеши считаются параллельно на всех ядрах,
+а число задач в работе и в очереди ограничено HASH_QUEUE: при перегрузке
+запрос получает PasswordHasherBusy вместо бесконечного ожидания.
+
+bcrypt и пул потоков загружаются при первом хешировании, а не при импорте:
+холодный старт auth и запросы без паролей их не ждут.
+'''
+import os
+import threading
+import time
+
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+HASH_WORKERS = int(os.environ.get('HASH_WORKERS', str(os.cpu_count() or 2)))
+HASH_QUEUE = int(os.environ.get('HASH_QUEUE', str(HASH_WORKERS * 4)))
+HASH_TIMEOUT = float(os.environ.get('HASH_TIMEOUT', '10'))
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(HASH_QUEUE)
+_timings = {}
+_timings_lock = threading.Lock()
+
+
+def _record(operation: str, elapsed_ms: float) -> None:
+    with _timings_lock:
+        stat = _timings.setdefault(operation, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        stat['count'] += 1
+        stat['total_ms'] += elapsed_ms
+        stat['max_ms'] = max(stat['max_ms'], elapsed_ms)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                _executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='bcrypt')
+    return _executor
+
+
+def _run(operation: str, fn, *args):
+    from concurrent.futures import TimeoutError
+
+    if not _slots.acquire(timeout=HASH_TIMEOUT):
+        _record(f'{operation}_rejected', 0.0)
+        raise PasswordHasherBusy('Сервер перегружен, повторите вход позже')
+    started = time.perf_counter()
+    try:
+        future = _get_executor().submit(fn, *args)
+    except Exception:
+        _slots.release()
+        raise
+    # Место освобождается, когда bcrypt действительно закончил: по таймауту
+    # задача продолжает считаться в пуле и должна оставаться в HASH_QUEUE
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        return future.result(timeout=HASH_TIMEOUT)
+    except TimeoutError:
+        _record(f'{operation}_timeout', 0.0)
+        raise PasswordHasherBusy('Сервер перегружен, повторите вход позже')
+    finally:
+        _record(operation, (time.perf_counter() - started) * 1000)
+
+
+def hash_password(password: str, rounds: int = None) -> str:
+    import bcrypt
+
+    salt = bcrypt.gensalt(rounds or BCRYPT_ROUNDS)
+    return _run('hash', bcrypt.hashpw, password.encode('utf-8'), salt).decode('utf-8')
+
+
+def hash_many(passwords: list, rounds: int = None) -> list:
+    '''Хеши для пачки паролей; None там, где пул был перегружен.
+
+    Одновременно занято не больше HASH_WORKERS мест очереди, так что
+    входы пользователей обслуживаются и во время массового импорта.
+    '''
+    from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+    def hash_or_none(password: str):
+        try:
+            return hash_password(password, rounds)
+        except (PasswordHasherBusy, TimeoutError):
+            return None
+
+    with ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='bcrypt-feed') as feeders:
+        return list(feeders.map(hash_or_none, passwords))
+
+
+def verify_password(password: str, password_hash: str) -> bool:
+    import bcrypt
+
+    return _run('verify', bcrypt.checkpw, password.encode('utf-8'), password_hash.encode('utf-8'))
+
+
+def hash_cost(password_hash: str) -> int:
+    '''Cost factor из хеша вида $2b$12$...; 0, если формат не распознан'''
+    parts = password_hash.split('$')
+    if len(parts) < 4 or not parts[2].isdigit():
+        return 0
+    return int(parts[2])
+
+
+def needs_rehash(password_hash: str) -> bool:
+    return hash_cost(password_hash) != BCRYPT_ROUNDS
+
+
+def stats() -> dict:
+    with _timings_lock:
+        result = {op: dict(stat) for op, stat in _timings.items()}
+    for stat in result.values():
+        stat['avg_ms'] = stat['total_ms'] / stat['count'] if stat['count'] else 0.0
+    result['rounds'] = BCRYPT_ROUNDS
+    result['workers'] = HASH_WORKERS
+    return result
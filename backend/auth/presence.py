@@ -0,0 +1,103 @@
+'''Буфер обновлений присутствия (status / last_seen) с пакетной записью.
+
+Обновления копятся в памяти процесса, повторные по одному ключу
+схлопываются, и буфер сбрасывается одним UPDATE ... FROM unnest(...)
+по размеру, по возрасту или принудительно. Время «сейчас» ставит база
+(CURRENT_TIMESTAMP при записи): last_seen сравнивается с её часами, а
+часы и пояс функции могут от них отличаться. Заодно не чаще раза в
+PRESENCE_SWEEP_INTERVAL пользователи без heartbeat дольше
+PRESENCE_STALE_AFTER переводятся в offline (частичный индекс
+idx_users_stale_presence).
+
+Файл одинаковый в backend/auth и backend/api-users.
+'''
+import os
+import threading
+import time
+from datetime import datetime
+
+PRESENCE_FLUSH_INTERVAL = float(os.environ.get('PRESENCE_FLUSH_INTERVAL', '2'))
+PRESENCE_BATCH_MAX = int(os.environ.get('PRESENCE_BATCH_MAX', '500'))
+PRESENCE_STALE_AFTER = int(os.environ.get('PRESENCE_STALE_AFTER', '90'))
+PRESENCE_SWEEP_INTERVAL = float(os.environ.get('PRESENCE_SWEEP_INTERVAL', '30'))
+
+STATUSES = ('online', 'offline', 'busy', 'in_call')
+
+
+class PresenceBuffer:
+    '''Схлопывающий буфер обновлений users по столбцу key_column'''
+
+    def __init__(self, key_column: str, key_type: str):
+        self.key_column = key_column
+        self.key_type = key_type
+        self._pending = {}
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.coalesced = 0
+
+    def add(self, key, status: str = None, seen: datetime = None) -> None:
+        '''status=None обновляет только last_seen и не трогает текущий статус.
+
+        seen — только явно известное время; без него last_seen = CURRENT_TIMESTAMP.
+        '''
+        if status is not None and status not in STATUSES:
+            raise ValueError(f'Недопустимый статус: {status}')
+        with self._lock:
+            previous = self._pending.get(key)
+            if previous is not None:
+                self.coalesced += 1
+                if status is None:
+                    status = previous[0]
+            elif not self._pending:
+                self._oldest = time.monotonic()
+            self._pending[key] = (status, seen)
+
+    def due(self) -> bool:
+        with self._lock:
+            if not self._pending:
+                return False
+            return (len(self._pending) >= PRESENCE_BATCH_MAX
+                    or time.monotonic() - self._oldest >= PRESENCE_FLUSH_INTERVAL)
+
+    def flush(self, cur) -> int:
+        '''Пишет накопленное одним UPDATE в транзакции cur; коммит за вызывающим'''
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._oldest = None
+        if pending:
+            keys = list(pending)
+            cur.execute(
+                f"UPDATE users SET status = COALESCE(v.status, users.status), "
+                f"last_seen = GREATEST(users.last_seen, COALESCE(v.seen, CURRENT_TIMESTAMP)) "
+                f"FROM unnest(%s::{self.key_type}[], %s::varchar[], %s::timestamp[]) AS v(key, status, seen) "
+                f"WHERE users.{self.key_column} = v.key",
+                (keys, [pending[k][0] for k in keys], [pending[k][1] for k in keys])
+            )
+            self.flushes += 1
+            self.flushed_rows += len(keys)
+        self.mark_stale_offline(cur)
+        return len(pending)
+
+    def mark_stale_offline(self, cur, force: bool = False) -> int:
+        if not force and time.monotonic() - self._last_sweep < PRESENCE_SWEEP_INTERVAL:
+            return 0
+        self._last_sweep = time.monotonic()
+        cur.execute(
+            "UPDATE users SET status = 'offline' "
+            "WHERE status <> 'offline' AND last_seen < CURRENT_TIMESTAMP - make_interval(secs => %s)",
+            (PRESENCE_STALE_AFTER,)
+        )
+        return cur.rowcount
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            'pending': pending,
+            'flushes': self.flushes,
+            'flushed_rows': self.flushed_rows,
+            'coalesced': self.coalesced
+        }
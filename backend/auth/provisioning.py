@@ -0,0 +1,228 @@
+'''Массовое заведение пользователей (добавочных) из CSV или JSONL.
+
+CSV — с заголовком username,phone,password[,role]; JSONL — по объекту
+с теми же полями на строку. Порядок работы на пачку:
+
+1. разбор и проверка строк, дубликаты внутри файла;
+2. один запрос на занятые username / phone в базе;
+3. bcrypt для оставшихся строк параллельно (passwords.hash_many);
+4. COPY во временную таблицу и один INSERT ... ON CONFLICT DO NOTHING.
+
+Ошибки копятся по номерам строк и не прерывают пачку. Через
+POST /import в auth принимается до IMPORT_MAX_ROWS строк (нужна сессия
+администратора): bcrypt всей пачки должен уложиться в таймаут функции,
+и считается он без соединения с базой. Большие файлы — из командной строки:
+
+    DATABASE_URL=... python backend/auth/provisioning.py extensions.csv
+'''
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+
+import passwords
+
+IMPORT_MAX_ROWS = int(os.environ.get('IMPORT_MAX_ROWS', '20'))
+IMPORT_BATCH = 1000
+
+ROLES = ('user', 'admin')
+LIMITS = {'username': 100, 'phone': 20}
+TAKEN_ERROR = 'Пользователь с таким именем или телефоном уже существует'
+
+
+def detect_format(text: str, content_type: str = None) -> str:
+    content_type = (content_type or '').lower()
+    if 'csv' in content_type:
+        return 'csv'
+    if 'json' in content_type:
+        return 'jsonl'
+    return 'jsonl' if text.lstrip().startswith('{') else 'csv'
+
+
+def parse(text: str, fmt: str) -> tuple:
+    '''Возвращает ([(номер строки, dict)], [ошибки]); номера — как в файле'''
+    rows = []
+    errors = []
+    if fmt == 'csv':
+        reader = csv.DictReader(io.StringIO(text))
+        missing = {'username', 'phone', 'password'} - set(reader.fieldnames or ())
+        if missing:
+            return [], [{'line': 1, 'error': f"Нет столбцов: {', '.join(sorted(missing))}"}]
+        for record in reader:
+            rows.append((reader.line_num, record))
+        return rows, errors
+
+    for line, raw in enumerate(text.splitlines(), 1):
+        if not raw.strip():
+            continue
+        try:
+            record = json.loads(raw)
+        except ValueError as e:
+            errors.append({'line': line, 'error': f'Некорректный JSON: {e}'})
+            continue
+        if not isinstance(record, dict):
+            errors.append({'line': line, 'error': 'Ожидается объект'})
+            continue
+        rows.append((line, record))
+    return rows, errors
+
+
+def check(rows: list) -> tuple:
+    '''Обязательные поля, длины, роль и дубликаты внутри файла'''
+    valid = []
+    errors = []
+    seen = {'username': set(), 'phone': set()}
+    for line, record in rows:
+        user = {
+            'line': line,
+            'username': str(record.get('username') or '').strip(),
+            'phone': str(record.get('phone') or '').strip(),
+            'password': str(record.get('password') or ''),
+            'role': str(record.get('role') or 'user').strip()
+        }
+        if not user['username'] or not user['phone'] or not user['password']:
+            error = 'Заполните username, phone и password'
+        elif user['role'] not in ROLES:
+            error = f"role: одно из {', '.join(ROLES)}"
+        else:
+            error = next((f'{field} длиннее {limit} символов'
+                          for field, limit in LIMITS.items() if len(user[field]) > limit), None)
+        if error is None:
+            error = next((f'{field} повторяется в файле'
+                          for field in seen if user[field] in seen[field]), None)
+        if error:
+            errors.append({'line': line, 'error': error})
+            continue
+        for field in seen:
+            seen[field].add(user[field])
+        valid.append(user)
+    return valid, errors
+
+
+def find_taken(cur, users: list) -> tuple:
+    '''Занятые username и phone одним запросом'''
+    cur.execute(
+        "SELECT username, phone FROM users WHERE username = ANY(%s) OR phone = ANY(%s)",
+        ([u['username'] for u in users], [u['phone'] for u in users])
+    )
+    usernames = set()
+    phones = set()
+    for row in cur.fetchall():
+        usernames.add(row['username'])
+        phones.add(row['phone'])
+    return usernames, phones
+
+
+def load(cur, users: list) -> dict:
+    '''COPY во временную таблицу и вставка; возвращает username -> id вставленных'''
+    cur.execute(
+        "CREATE TEMP TABLE users_import (line INTEGER, username VARCHAR(100), phone VARCHAR(20), "
+        "password_hash VARCHAR(255), role VARCHAR(20)) ON COMMIT DROP"
+    )
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for u in users:
+        writer.writerow((u['line'], u['username'], u['phone'], u['password_hash'], u['role']))
+    buffer.seek(0)
+    cur.copy_expert("COPY users_import FROM STDIN WITH (FORMAT csv)", buffer)
+    cur.execute(
+        "INSERT INTO users (username, phone, password_hash, role, status) "
+        "SELECT username, phone, password_hash, role, 'offline' FROM users_import ORDER BY line "
+        "ON CONFLICT DO NOTHING RETURNING id, username"
+    )
+    return {row['username']: row['id'] for row in cur.fetchall()}
+
+
+def exclude_taken(cur, users: list) -> tuple:
+    '''Строки, чьи username и phone свободны, и ошибки для занятых'''
+    if not users:
+        return [], []
+    usernames, phones = find_taken(cur, users)
+    fresh = []
+    errors = []
+    for u in users:
+        if u['username'] in usernames or u['phone'] in phones:
+            errors.append({'line': u['line'], 'error': TAKEN_ERROR})
+        else:
+            fresh.append(u)
+    return fresh, errors
+
+
+def hash_users(users: list) -> tuple:
+    '''bcrypt для строк; вызывать без соединения с базой'''
+    hashed = []
+    errors = []
+    for u, password_hash in zip(users, passwords.hash_many([u['password'] for u in users])):
+        if password_hash is None:
+            errors.append({'line': u['line'], 'error': 'Не удалось вычислить хеш пароля, повторите'})
+        else:
+            u['password_hash'] = password_hash
+            hashed.append(u)
+    return hashed, errors
+
+
+def insert_users(conn, cur, users: list) -> tuple:
+    '''Вставляет строки с хешами одной транзакцией: (заведённые, ошибки)'''
+    created = []
+    errors = []
+    if not users:
+        return created, errors
+    ids = load(cur, users)
+    conn.commit()
+    for u in users:
+        if u['username'] in ids:
+            created.append({'line': u['line'], 'id': ids[u['username']], 'username': u['username']})
+        else:
+            errors.append({'line': u['line'], 'error': TAKEN_ERROR})
+    return created, errors
+
+
+def report(created: list, errors: list) -> dict:
+    return {'created': created, 'errors': sorted(errors, key=lambda e: e['line'])}
+
+
+def provision(conn, cur, rows: list) -> dict:
+    '''Заводит проверенные строки одной транзакцией; ошибки — по строкам'''
+    users, errors = check(rows)
+    fresh, taken = exclude_taken(cur, users)
+    conn.rollback()
+    hashed, failed = hash_users(fresh)
+    created, conflicts = insert_users(conn, cur, hashed)
+    return report(created, errors + taken + failed + conflicts)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Массовое заведение пользователей из CSV / JSONL')
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=('csv', 'jsonl'))
+    parser.add_argument('--batch', type=int, default=IMPORT_BATCH, help='строк на транзакцию (1000)')
+    args = parser.parse_args(argv)
+
+    with open(args.path, encoding='utf-8-sig') as f:
+        text = f.read()
+    rows, errors = parse(text, args.format or detect_format(text, 'csv' if args.path.endswith('.csv') else None))
+
+    import psycopg2
+    from psycopg2.extras import RealDictCursor
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    created = 0
+    try:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        for start in range(0, len(rows), args.batch):
+            result = provision(conn, cur, rows[start:start + args.batch])
+            created += len(result['created'])
+            errors.extend(result['errors'])
+            print(f'{min(start + args.batch, len(rows))}/{len(rows)}: заведено {created}', file=sys.stderr)
+    finally:
+        conn.close()
+
+    for error in sorted(errors, key=lambda e: e['line']):
+        print(json.dumps(error, ensure_ascii=False))
+    print(f'заведено {created}, ошибок {len(errors)}', file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
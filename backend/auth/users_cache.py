@@ -0,0 +1,148 @@
+'''Кеш записей пользователей в процессе: поиск по id и телефону без похода в users.
+
+Хранятся только редко меняющиеся поля (USER_FIELDS), статус присутствия
+не кешируется. Свежесть держится двумя механизмами:
+- версия: раз в USER_CACHE_SYNC секунд сверяется позиция ленты
+  (feed_position), и если появились строки не старше прошлого курсора,
+  закешированные из них перечитываются одним запросом по idx_users_version;
+- TTL (USER_CACHE_TTL) — на случай удалений, которые версию не меняют.
+Отрицательные ответы не кешируются, поэтому регистрация не требует сброса.
+'''
+import os
+import threading
+import time
+from collections import OrderedDict
+
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', '10000'))
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', '300'))
+USER_CACHE_SYNC = float(os.environ.get('USER_CACHE_SYNC', '5'))
+
+USER_FIELDS = ('id', 'username', 'phone', 'password_hash', 'role', 'version')
+KEYS = ('id', 'phone')
+
+# users.version — номер записавшей строку транзакции (V0014). Транзакции с
+# номером меньше xmin снимка завершены, поэтому курсор не выше xmin: всё, что
+# закоммитится после чтения, получит version >= cursor. horizon — первый ещё не
+# выданный номер; курсор больше него остался от прежней нумерации.
+FEED_POSITION_SQL = (
+    "SELECT COALESCE(MAX(version), 0) AS version, "
+    "LEAST(COALESCE(MAX(version), 0) + 1, txid_snapshot_xmin(txid_current_snapshot())) AS cursor, "
+    "txid_snapshot_xmax(txid_current_snapshot()) AS horizon "
+    "FROM users"
+)
+
+
+def feed_position(cur) -> dict:
+    '''Последняя версия, курсор ленты (строки с version >= cursor) и граница нумерации'''
+    cur.execute(FEED_POSITION_SQL)
+    return cur.fetchone()
+
+
+class UserCache:
+    '''Ограниченный LRU id -> запись с вторичными индексами по KEYS'''
+
+    def __init__(self, maxsize: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL,
+                 sync_interval: float = USER_CACHE_SYNC):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.sync_interval = sync_interval
+        self.cursor = None
+        self._last_sync = 0.0
+        self._records = OrderedDict()
+        self._index = {key: {} for key in KEYS if key != 'id'}
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'loads': 0, 'refreshed': 0, 'invalidated': 0, 'evicted': 0}
+
+    def get(self, cur, key: str, value):
+        return self.get_many(cur, key, [value]).get(value)
+
+    def get_many(self, cur, key: str, values: list) -> dict:
+        '''value -> запись для найденных; промахи дочитываются одним запросом'''
+        self.sync(cur)
+        found = {}
+        missing = []
+        now = time.monotonic()
+        with self._lock:
+            for value in values:
+                user_id = value if key == 'id' else self._index[key].get(value)
+                entry = self._records.get(user_id)
+                if entry is not None and entry[1] >= now:
+                    self._records.move_to_end(user_id)
+                    found[value] = entry[0]
+                    self._stats['hits'] += 1
+                else:
+                    missing.append(value)
+                    self._stats['misses'] += 1
+
+        if missing:
+            cur.execute(f"SELECT {', '.join(USER_FIELDS)} FROM users WHERE {key} = ANY(%s)", (missing,))
+            rows = [dict(row) for row in cur.fetchall()]
+            with self._lock:
+                self._stats['loads'] += 1
+                for row in rows:
+                    self._store(row)
+            for row in rows:
+                found[row[key]] = row
+        return found
+
+    def sync(self, cur, force: bool = False) -> int:
+        '''Перечитывает закешированные записи, изменившиеся с прошлой проверки'''
+        if not force and time.monotonic() - self._last_sync < self.sync_interval:
+            return 0
+        self._last_sync = time.monotonic()
+        position = feed_position(cur)
+        since = self.cursor if self.cursor is not None and self.cursor <= position['horizon'] else 0
+        if self.cursor is None or position['version'] < since:
+            self.cursor = position['cursor']
+            return 0
+        with self._lock:
+            cached_ids = list(self._records)
+        rows = []
+        if cached_ids:
+            cur.execute(
+                f"SELECT {', '.join(USER_FIELDS)} FROM users WHERE version >= %s AND id = ANY(%s)",
+                (since, cached_ids)
+            )
+            rows = [dict(row) for row in cur.fetchall()]
+        with self._lock:
+            for row in rows:
+                self._store(row)
+            self._stats['refreshed'] += len(rows)
+        self.cursor = position['cursor']
+        return len(rows)
+
+    def invalidate(self, user_id) -> None:
+        with self._lock:
+            if self._drop(user_id):
+                self._stats['invalidated'] += 1
+
+    def _store(self, record: dict) -> None:
+        self._drop(record['id'])
+        self._records[record['id']] = (record, time.monotonic() + self.ttl)
+        for key, index in self._index.items():
+            if record.get(key) is not None:
+                index[record[key]] = record['id']
+        while len(self._records) > self.maxsize:
+            user_id = next(iter(self._records))
+            self._drop(user_id)
+            self._stats['evicted'] += 1
+
+    def _drop(self, user_id) -> bool:
+        entry = self._records.pop(user_id, None)
+        if entry is None:
+            return False
+        for key, index in self._index.items():
+            if index.get(entry[0].get(key)) == user_id:
+                del index[entry[0][key]]
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+            data['size'] = len(self._records)
+        lookups = data['hits'] + data['misses']
+        data['hit_rate'] = round(data['hits'] / lookups, 4) if lookups else None
+        return data
+
+
+cache = UserCache()
@@ -0,0 +1,164 @@
+'''События звонков для long-poll доставки: входящий offer, answer, ICE, отбой.
+
+События пишутся в таблицу call_events в той же транзакции, что и
+изменение звонка; триггер делает pg_notify('voip_events', user_id).
+Один фоновый поток на процесс слушает канал и будит ждущие запросы.
+Его LISTEN-соединение открывается мимо пула, но занимает в нём место
+(ConnectionPool.reserve), так что DB_POOL_MAX остаётся пределом соединений
+экземпляра.
+'''
+import os
+import select
+import threading
+import time
+
+import db
+import sdp
+
+EVENTS_CHANNEL = 'voip_events'
+EVENTS_MAX_WAIT = float(os.environ.get('SIGNALING_EVENTS_MAX_WAIT', '25'))
+EVENTS_RECHECK = float(os.environ.get('SIGNALING_EVENTS_RECHECK', '5'))
+EVENTS_RETENTION = int(os.environ.get('SIGNALING_EVENTS_RETENTION', '600'))
+EVENTS_BATCH_LIMIT = 100
+CLEANUP_INTERVAL = 60
+
+
+class EventBus:
+    '''Диспетчер NOTIFY-уведомлений по пользователям внутри процесса'''
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self._waiters = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._reserved = False
+
+    def subscribe(self, user_id: str) -> threading.Event:
+        self._ensure_listener()
+        waiter = threading.Event()
+        with self._lock:
+            self._waiters.setdefault(str(user_id), set()).add(waiter)
+        return waiter
+
+    def unsubscribe(self, user_id: str, waiter: threading.Event) -> None:
+        with self._lock:
+            waiters = self._waiters.get(str(user_id))
+            if waiters is not None:
+                waiters.discard(waiter)
+                if not waiters:
+                    del self._waiters[str(user_id)]
+
+    def dispatch(self, user_id: str) -> None:
+        with self._lock:
+            waiters = list(self._waiters.get(str(user_id), ()))
+        for waiter in waiters:
+            waiter.set()
+
+    def _ensure_listener(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._listen, name='voip-events', daemon=True)
+                self._thread.start()
+
+    def _listen(self) -> None:
+        import psycopg2
+        import psycopg2.extensions
+
+        if not self._reserved:
+            try:
+                db.get_pool().reserve()
+            except db.PoolTimeout:
+                # Без слушателя запросы просто перепроверяют таблицу раз в EVENTS_RECHECK
+                return
+            self._reserved = True
+
+        backoff = 1.0
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute(f'LISTEN {EVENTS_CHANNEL}')
+                backoff = 1.0
+                while True:
+                    if select.select([conn], [], [], EVENTS_RECHECK) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self.dispatch(conn.notifies.pop(0).payload)
+            except psycopg2.Error:
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+            finally:
+                if conn is not None and not conn.closed:
+                    conn.close()
+
+
+_bus = None
+_bus_lock = threading.Lock()
+_last_cleanup = 0.0
+
+
+def get_bus() -> EventBus:
+    global _bus
+    if _bus is None:
+        with _bus_lock:
+            if _bus is None:
+                _bus = EventBus(os.environ['DATABASE_URL'])
+    return _bus
+
+
+def fetch_events(user_id: str, since: int, encoding: str = None) -> list:
+    global _last_cleanup
+    conn = db.getconn()
+    try:
+        with conn.cursor() as cur:
+            if time.monotonic() - _last_cleanup >= CLEANUP_INTERVAL:
+                cur.execute(
+                    "DELETE FROM call_events WHERE created_at < CURRENT_TIMESTAMP - make_interval(secs => %s)",
+                    (EVENTS_RETENTION,)
+                )
+                _last_cleanup = time.monotonic()
+            cur.execute(
+                "SELECT e.id, e.type, e.call_id, e.payload, "
+                "CASE e.type WHEN 'offer' THEN s.offer WHEN 'answer' THEN s.answer END "
+                "FROM call_events e LEFT JOIN call_sdp s ON s.call_id = e.call_id AND e.type IN ('offer', 'answer') "
+                "WHERE e.user_id = %s AND e.id > %s ORDER BY e.id LIMIT %s",
+                (user_id, since, EVENTS_BATCH_LIMIT)
+            )
+            rows = cur.fetchall()
+        conn.commit()
+    finally:
+        db.putconn(conn)
+    pending = []
+    for event_id, event_type, call_id, payload, description in rows:
+        if description is not None:
+            payload = dict(payload, **{event_type: sdp.unpack(description, encoding)})
+        pending.append({'id': event_id, 'type': event_type, 'call_id': call_id, 'payload': payload})
+    return pending
+
+
+def wait_for_events(user_id: str, since: int, timeout: float, encoding: str = None) -> list:
+    '''Ждёт событий пользователя после курсора since, но не дольше timeout.
+
+    Соединение из пула берётся только на время выборки; между выборками
+    запрос спит на уведомлении и перепроверяет таблицу раз в EVENTS_RECHECK
+    на случай потерянного NOTIFY. SDP в событиях offer / answer отдаётся
+    в компактной кодировке encoding, если она задана.
+    '''
+    deadline = time.monotonic() + min(max(timeout, 0), EVENTS_MAX_WAIT)
+    bus = get_bus()
+    waiter = bus.subscribe(user_id)
+    try:
+        while True:
+            waiter.clear()
+            events = fetch_events(user_id, since, encoding)
+            remaining = deadline - time.monotonic()
+            if events or remaining <= 0:
+                return events
+            waiter.wait(min(remaining, EVENTS_RECHECK))
+    finally:
+        bus.unsubscribe(user_id, waiter)
@@ -0,0 +1,83 @@
+'''История звонков с keyset-пагинацией по (started_at, id).
+
+Для пользователя запрос разбивается на две ветки UNION ALL (звонил /
+принимал), каждая идёт по своему составному индексу из
+V0008__add_call_logs_history_indexes.sql вместо OR по двум столбцам.
+'''
+from datetime import datetime
+
+HISTORY_COLUMNS = (
+    'id', 'caller_id', 'receiver_id', 'caller_phone', 'receiver_phone',
+    'status', 'duration', 'started_at', 'ended_at'
+)
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+
+def encode_cursor(row: dict) -> str:
+    return f"{row['started_at'].isoformat()}_{row['id']}"
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        started_at, call_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(started_at), int(call_id)
+    except ValueError:
+        raise ValueError('Некорректный cursor')
+
+
+def parse_fields(fields) -> list:
+    if not fields:
+        return list(HISTORY_COLUMNS)
+    columns = [f.strip() for f in fields.split(',') if f.strip()]
+    unknown = [c for c in columns if c not in HISTORY_COLUMNS]
+    if unknown:
+        raise ValueError(f"Неизвестные поля: {', '.join(unknown)}")
+    for required in ('id', 'started_at'):
+        if required not in columns:
+            columns.append(required)
+    return columns
+
+
+def build_query(query: dict) -> tuple:
+    '''Собирает SQL и параметры выборки истории по параметрам запроса.
+
+    Параметры: user_id, cursor, limit, status (через запятую),
+    from / to (ISO-даты по started_at), fields (проекция столбцов).
+    '''
+    columns = ', '.join(parse_fields(query.get('fields')))
+    try:
+        limit = int(query.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        raise ValueError('limit должен быть числом')
+    limit = max(1, min(limit, MAX_LIMIT))
+
+    conditions = []
+    params = []
+    if query.get('status'):
+        conditions.append('status = ANY(%s)')
+        params.append([s.strip() for s in query['status'].split(',') if s.strip()])
+    for key, op in (('from', '>='), ('to', '<')):
+        if query.get(key):
+            try:
+                params.append(datetime.fromisoformat(query[key]))
+            except ValueError:
+                raise ValueError(f'Некорректная дата {key}')
+            conditions.append(f'started_at {op} %s')
+    if query.get('cursor'):
+        conditions.append('(started_at, id) < (%s, %s)')
+        params.extend(decode_cursor(query['cursor']))
+
+    order = 'ORDER BY started_at DESC, id DESC LIMIT %s'
+    user_id = query.get('user_id')
+    if not user_id:
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        return f'SELECT {columns} FROM call_logs {where} {order}', params + [limit]
+
+    branches = []
+    branch_params = []
+    for branch in ('caller_id = %s', 'receiver_id = %s AND caller_id IS DISTINCT FROM receiver_id'):
+        where = ' AND '.join([branch] + conditions)
+        branches.append(f'(SELECT {columns} FROM call_logs WHERE {where} {order})')
+        branch_params += [user_id] + params + [limit]
+    return f"SELECT * FROM ({' UNION ALL '.join(branches)}) h {order}", branch_params + [limit]
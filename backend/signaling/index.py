@@ -1,207 +1,454 @@
-import json
+import math
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from datetime import datetime
+import time
 
+import admission
+import core
+import db
+import events
+import history
+import metrics
+import reaper
+import rollups
+import sdp
+import sessions
+
+ICE_BATCH_LIMIT = 100
+OFFER_TTL = int(os.environ.get('SIGNALING_OFFER_TTL', '120'))
+SDP_GC_INTERVAL = 60
+REQUIRE_AUTH = os.environ.get('SIGNALING_REQUIRE_AUTH', '') == '1'
+
+_last_sdp_gc = 0.0
+router = core.Router()
+
+metrics.register('pool', db.stats)
+metrics.register('sessions', sessions.stats)
+metrics.register('reaper', reaper.stats)
+metrics.register('admission', admission.stats)
+
+PREFLIGHT = core.preflight('GET, POST, PUT, OPTIONS', f'Content-Type, X-Authorization, {sdp.ENCODING_HEADER}')
+
+# Звонок создаётся одним запросом: блокировка обоих абонентов в порядке id
+# (без взаимных блокировок при встречных звонках), проверка занятости,
+# запись call_logs и call_open, перевод обоих в in_call, SDP offer и событие
+# для callee. Нет строки — абонента нет; id IS NULL — callee занят.
+INITIATE_SQL = """
+WITH locked AS (
+    SELECT id, phone, status FROM users
+    WHERE id IN (%(caller_id)s, %(receiver_id)s)
+    ORDER BY id
+    FOR UPDATE
+),
+parties AS (
+    SELECT c.id AS caller_id, c.phone AS caller_phone,
+           r.id AS receiver_id, r.phone AS receiver_phone, r.status AS receiver_status
+    FROM locked c, locked r
+    WHERE c.id = %(caller_id)s AND r.id = %(receiver_id)s AND c.id <> r.id
+),
+call AS (
+    INSERT INTO call_logs (caller_id, receiver_id, caller_phone, receiver_phone, status)
+    SELECT caller_id, receiver_id, caller_phone, receiver_phone, 'ringing'
+    FROM parties
+    WHERE receiver_status NOT IN ('in_call', 'busy')
+    RETURNING id, started_at, caller_id, receiver_id, caller_phone
+),
+opened AS (
+    INSERT INTO call_open (call_id, started_at, caller_id, receiver_id)
+    SELECT id, started_at, caller_id, receiver_id FROM call
+),
+engaged AS (
+    UPDATE users SET status = 'in_call', last_seen = CURRENT_TIMESTAMP
+    FROM call
+    WHERE users.id IN (call.caller_id, call.receiver_id)
+),
+stored AS (
+    INSERT INTO call_sdp (call_id, offer)
+    SELECT id, %(offer)s FROM call
+),
+notified AS (
+    INSERT INTO call_events (user_id, type, call_id, payload)
+    SELECT receiver_id, 'offer', id, jsonb_build_object('caller_id', caller_id, 'caller_phone', caller_phone)
+    FROM call
+)
+SELECT parties.receiver_status, call.id
+FROM parties LEFT JOIN call ON TRUE
+"""
+
+
+# call_logs секционирована по started_at: запросы по id звонка берут его
+# started_at из call_open, и лишние секции отсекаются при запуске запроса
+STARTED_AT = "(SELECT started_at FROM call_open WHERE call_id = %(call_id)s)"
+
+ANSWER_SQL = f"""
+WITH c AS (
+    UPDATE call_logs SET status = 'active'
+    WHERE id = %(call_id)s AND started_at = {STARTED_AT}
+    RETURNING id, caller_id
+)
+INSERT INTO call_events (user_id, type, call_id) SELECT caller_id, 'answer', id FROM c
+"""
+
+# Завершение одним запросом: закрыть звонок (прежний статус нужен сводке —
+# отвечен ли он), убрать его из call_open (SDP и ICE удаляются каскадом),
+# освободить абонентов, добавить звонок в call_stats_hourly и разослать
+# hangup второй стороне.
+END_SQL = f"""
+WITH prev AS (
+    SELECT status FROM call_logs WHERE id = %(call_id)s AND started_at = {STARTED_AT}
+),
+c AS (
+    UPDATE call_logs SET status = 'completed', ended_at = CURRENT_TIMESTAMP,
+        duration = EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - started_at))::INTEGER,
+        rolled_up = %(inline)s
+    WHERE id = %(call_id)s AND started_at = {STARTED_AT} AND ended_at IS NULL
+    RETURNING id, caller_id, receiver_id, started_at, duration
+),
+closed AS (
+    DELETE FROM call_open WHERE call_id = %(call_id)s
+),
+ended AS (
+    SELECT c.caller_id, c.receiver_id, c.started_at, c.duration, (prev.status = 'active')::int AS answered
+    FROM c, prev WHERE %(inline)s
+),
+freed AS (
+    UPDATE users SET status = 'online', last_seen = CURRENT_TIMESTAMP
+    FROM c WHERE users.id IN (c.caller_id, c.receiver_id) AND users.status = 'in_call'
+),
+rolled AS ({rollups.upsert_sql('ended')})
+INSERT INTO call_events (user_id, type, call_id)
+SELECT u, 'hangup', c.id FROM c, unnest(ARRAY[c.caller_id, c.receiver_id]) AS u
+WHERE u IS DISTINCT FROM %(user_id)s
+"""
+
+
+def collect_unanswered_offers(cur) -> None:
+    '''Удаляет SDP звонков, на которые не ответили за OFFER_TTL секунд'''
+    global _last_sdp_gc
+    if time.monotonic() - _last_sdp_gc < SDP_GC_INTERVAL:
+        return
+    _last_sdp_gc = time.monotonic()
+    cur.execute(
+        "DELETE FROM call_sdp WHERE answer IS NULL AND created_at < CURRENT_TIMESTAMP - make_interval(secs => %s)",
+        (OFFER_TTL,)
+    )
+
+
+PARTY_SQL = "SELECT %(user_id)s IN (caller_id, receiver_id) AS party FROM call_open WHERE call_id = %(call_id)s"
+
+
+def is_party(event: dict, conn, cur, call_id) -> bool:
+    '''False, если у запроса есть сессия, а её пользователь не участник открытого звонка.
+
+    SDP и ICE-кандидаты хранятся, пока звонок открыт (call_open), и
+    содержат ufrag/pwd и отпечаток DTLS — отдавать их можно только сторонам.
+    '''
+    user_id = sessions.validate(sessions.token_from_event(event), conn)
+    if user_id is None:
+        return True
+    cur.execute(PARTY_SQL, {'user_id': user_id, 'call_id': call_id})
+    row = cur.fetchone()
+    return row is None or row['party']
+
+
+@router.route('POST', 'initiate', priority=admission.CALL)
+def initiate(event: dict, conn, cur) -> dict:
+    body = core.json_body(event)
+    caller_id = body.get('caller_id')
+    receiver_id = body.get('receiver_id')
+    offer = body.get('offer')
+
+    if not caller_id or not receiver_id or not offer:
+        return core.error(400, 'caller_id, receiver_id и offer обязательны')
+
+    auth_user_id = sessions.validate(sessions.token_from_event(event), conn)
+    if auth_user_id is not None and str(auth_user_id) != str(caller_id):
+        return core.error(403, 'Нельзя звонить от имени другого пользователя')
+
+    try:
+        packed = sdp.pack(offer)
+    except ValueError as e:
+        return core.error(400, f'Некорректный offer: {e}')
+
+    collect_unanswered_offers(cur)
+    cur.execute(INITIATE_SQL, {
+        'caller_id': caller_id,
+        'receiver_id': receiver_id,
+        'offer': packed
+    })
+    call = cur.fetchone()
+    conn.commit()
+
+    if not call:
+        return core.error(404, 'Пользователь не найден')
+
+    if call['id'] is None:
+        return core.response(409, {'error': 'Абонент занят', 'status': call['receiver_status']})
+
+    return core.response(200, {
+        'call_id': call['id'],
+        'status': 'ringing',
+        'offer': offer
+    })
+
+
+@router.route('POST', 'answer', priority=admission.CALL)
+def answer_call(event: dict, conn, cur) -> dict:
+    body = core.json_body(event)
+    call_id = body.get('call_id')
+    answer = body.get('answer')
+
+    if not call_id or not answer:
+        return core.error(400, 'call_id и answer обязательны')
+
+    try:
+        packed = sdp.pack(answer)
+    except ValueError as e:
+        return core.error(400, f'Некорректный answer: {e}')
+
+    cur.execute(ANSWER_SQL, {'call_id': call_id})
+    cur.execute(
+        "UPDATE call_sdp SET answer = %s, answered_at = CURRENT_TIMESTAMP WHERE call_id = %s",
+        (packed, call_id)
+    )
+    conn.commit()
+
+    return core.response(200, {
+        'call_id': call_id,
+        'status': 'active',
+        'answer': answer
+    })
+
+
+@router.route('POST', 'end', priority=admission.CALL)
+def end_call(event: dict, conn, cur) -> dict:
+    body = core.json_body(event)
+    call_id = body.get('call_id')
+
+    if not call_id:
+        return core.error(400, 'call_id обязателен')
+
+    cur.execute(END_SQL, {'call_id': call_id, 'user_id': body.get('user_id'), 'inline': rollups.ROLLUP_INLINE})
+    collect_unanswered_offers(cur)
+    rollups.catch_up(cur)
+    conn.commit()
+
+    return core.response(200, {'call_id': call_id, 'status': 'completed'})
+
+
+@router.route('POST', 'ice', priority=admission.CALL)
+def add_ice_candidates(event: dict, conn, cur) -> dict:
+    body = core.json_body(event)
+    candidate = body.get('candidate')
+    candidates = body.get('candidates') or ([candidate] if candidate else [])
+    call_id = body.get('call_id')
+    sender_id = body.get('sender_id')
+
+    if not candidates or not call_id:
+        return core.error(400, 'candidate и call_id обязательны')
+
+    cur.execute(
+        "INSERT INTO call_ice_candidates (call_id, sender_id, candidate) "
+        "SELECT o.call_id, %s, u.candidate FROM call_open o, unnest(%s::jsonb[]) AS u(candidate) "
+        "WHERE o.call_id = %s RETURNING id",
+        (sender_id, [core.dumps(c) for c in candidates], call_id)
+    )
+    seqs = [row['id'] for row in cur.fetchall()]
+
+    if not seqs:
+        conn.rollback()
+        return core.error(409, 'Звонок не найден или уже завершён')
+
+    cur.execute(
+        "INSERT INTO call_events (user_id, type, call_id, payload) "
+        "SELECT u, 'ice', o.call_id, %s FROM call_open o, unnest(ARRAY[o.caller_id, o.receiver_id]) AS u "
+        "WHERE o.call_id = %s AND u IS DISTINCT FROM %s",
+        (core.dumps({'seq': max(seqs)}), call_id, sender_id)
+    )
+    conn.commit()
+
+    result = {'success': True, 'count': len(seqs), 'seq': max(seqs)}
+    if candidate:
+        result['candidate'] = candidate
+
+    return core.response(200, result)
+
+
+@router.route('GET', 'sdp', priority=admission.CALL)
+def get_sdp(event: dict, conn, cur) -> dict:
+    call_id = core.query_params(event).get('call_id')
+
+    if not call_id:
+        return core.error(400, 'call_id обязателен')
+
+    if not is_party(event, conn, cur, call_id):
+        return core.error(403, 'Звонок другого пользователя')
+
+    cur.execute("SELECT offer, answer FROM call_sdp WHERE call_id = %s", (call_id,))
+    row = cur.fetchone()
+
+    if not row:
+        return core.error(404, 'SDP звонка не найден')
+
+    encoding = sdp.negotiate(core.header(event, sdp.ENCODING_HEADER))
+    return core.response(200, {
+        'call_id': call_id,
+        'offer': sdp.unpack(row['offer'], encoding),
+        'answer': sdp.unpack(row['answer'], encoding)
+    })
+
+
+@router.route('GET', 'ice', priority=admission.CALL)
+def drain_ice_candidates(event: dict, conn, cur) -> dict:
+    query = core.query_params(event)
+    call_id = query.get('call_id')
+    user_id = query.get('user_id')
+
+    if not call_id:
+        return core.error(400, 'call_id обязателен')
+
+    try:
+        since = int(query.get('since', 0))
+        limit = max(1, min(int(query.get('limit', ICE_BATCH_LIMIT)), ICE_BATCH_LIMIT))
+    except ValueError:
+        return core.error(400, 'since и limit должны быть числами')
+
+    if not is_party(event, conn, cur, call_id):
+        return core.error(403, 'Звонок другого пользователя')
+
+    cur.execute(
+        "SELECT id, sender_id, candidate FROM call_ice_candidates "
+        "WHERE call_id = %s AND id > %s AND (%s IS NULL OR sender_id IS DISTINCT FROM %s) ORDER BY id LIMIT %s",
+        (call_id, since, user_id, user_id, limit)
+    )
+    rows = cur.fetchall()
+
+    return core.response(200, {
+        'call_id': call_id,
+        'candidates': [row['candidate'] for row in rows],
+        'cursor': rows[-1]['id'] if rows else since,
+        'more': len(rows) == limit
+    })
+
+
+@router.route('GET')
+def call_history(event: dict, conn, cur) -> dict:
+    try:
+        sql, params = history.build_query(core.query_params(event))
+    except ValueError as e:
+        return core.error(400, str(e))
+
+    cur.execute(sql, params)
+    calls = cur.fetchall()
+    next_cursor = history.encode_cursor(calls[-1]) if len(calls) == params[-1] else None
+
+    return core.response(200, {'calls': calls, 'next_cursor': next_cursor})
+
+
+@router.route('GET', 'stats')
+def call_stats(event: dict, conn, cur) -> dict:
+    try:
+        sql, params = rollups.build_query(core.query_params(event))
+    except ValueError as e:
+        return core.error(400, str(e))
+
+    rollups.catch_up(cur)
+    conn.commit()
+    cur.execute(sql, params)
+    rows = [rollups.summarize(row) for row in cur.fetchall()]
+
+    return core.response(200, {'stats': rows})
+
+
+@router.route('GET', 'events', db=False)
+def wait_events(event: dict) -> dict:
+    query = core.query_params(event)
+    user_id = query.get('user_id')
+
+    if not user_id:
+        return core.error(400, 'user_id обязателен')
+
+    if REQUIRE_AUTH and str(sessions.validate(sessions.token_from_event(event))) != str(user_id):
+        return core.error(401, 'Требуется авторизация')
+
+    try:
+        since = int(query.get('since', 0))
+        timeout = float(query.get('timeout', events.EVENTS_MAX_WAIT))
+        if not math.isfinite(timeout):
+            raise ValueError(timeout)
+    except ValueError:
+        return core.error(400, 'since и timeout должны быть числами')
+
+    try:
+        pending = events.wait_for_events(user_id, since, timeout, sdp.negotiate(core.header(event, sdp.ENCODING_HEADER)))
+    except Exception as e:
+        metrics.record_error(e)
+        return core.error(500, str(e))
+
+    return core.response(200, {'events': pending, 'cursor': pending[-1]['id'] if pending else since})
+
+
+def serve(event: dict, route, conn) -> dict:
+    cur = metrics.cursor(db.dict_cursor(conn))
+    try:
+        # Проверка и без REQUIRE_AUTH: сессия попадает в кеш, и admission
+        # считает следующие запросы клиента по user_id, а не по IP
+        if sessions.validate(sessions.token_from_event(event), conn) is None and REQUIRE_AUTH:
+            return core.error(401, 'Требуется авторизация')
+
+        if reaper.due():
+            reaper.reap(cur)
+            conn.commit()
+
+        return route(event, conn, cur)
+    finally:
+        cur.close()
+
+
+@metrics.instrument('signaling')
 def handler(event: dict, context) -> dict:
     '''WebRTC signaling сервер для установки P2P соединений между пользователями'''
     method = event.get('httpMethod', 'GET')
-    
+
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Authorization'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    dsn = os.environ.get('DATABASE_URL')
-    if not dsn:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Database connection not configured'}),
-            'isBase64Encoded': False
-        }
-    
+        return PREFLIGHT
+
+    route = router.resolve(method, core.route_key(event.get('url', '/')))
+    if route is None:
+        return core.not_found()
+    metrics.set_route(route.__name__)
+
+    if not os.environ.get('DATABASE_URL'):
+        return core.error(500, 'Database connection not configured')
+
+    rejected = admission.limit(event, route, sessions.cached(sessions.token_from_event(event)))
+    if rejected is not None:
+        return rejected
+
+    if not route.route_options.get('db', True):
+        return route(event)
+
+    if not admission.enter(route):
+        return admission.too_many(admission.WAIT)
     try:
-        conn = psycopg2.connect(dsn)
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        path = event.get('url', '/').strip()
-        
-        if method == 'POST' and 'initiate' in path:
-            body = json.loads(event.get('body', '{}'))
-            caller_id = body.get('caller_id')
-            receiver_id = body.get('receiver_id')
-            offer = body.get('offer')
-            
-            if not caller_id or not receiver_id or not offer:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'caller_id, receiver_id и offer обязательны'}),
-                    'isBase64Encoded': False
-                }
-            
-            cur.execute("SELECT phone FROM users WHERE id = %s", (caller_id,))
-            caller = cur.fetchone()
-            cur.execute("SELECT phone FROM users WHERE id = %s", (receiver_id,))
-            receiver = cur.fetchone()
-            
-            if not caller or not receiver:
-                return {
-                    'statusCode': 404,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Пользователь не найден'}),
-                    'isBase64Encoded': False
-                }
-            
-            cur.execute(
-                "INSERT INTO call_logs (caller_id, receiver_id, caller_phone, receiver_phone, status) VALUES (%s, %s, %s, %s, 'ringing') RETURNING id",
-                (caller_id, receiver_id, caller['phone'], receiver['phone'])
-            )
-            call = cur.fetchone()
-            conn.commit()
-            
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'call_id': call['id'],
-                    'status': 'ringing',
-                    'offer': offer
-                }),
-                'isBase64Encoded': False
-            }
-        
-        elif method == 'POST' and 'answer' in path:
-            body = json.loads(event.get('body', '{}'))
-            call_id = body.get('call_id')
-            answer = body.get('answer')
-            
-            if not call_id or not answer:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'call_id и answer обязательны'}),
-                    'isBase64Encoded': False
-                }
-            
-            cur.execute("UPDATE call_logs SET status = 'active' WHERE id = %s", (call_id,))
-            conn.commit()
-            
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'call_id': call_id,
-                    'status': 'active',
-                    'answer': answer
-                }),
-                'isBase64Encoded': False
-            }
-        
-        elif method == 'POST' and 'end' in path:
-            body = json.loads(event.get('body', '{}'))
-            call_id = body.get('call_id')
-            
-            if not call_id:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'call_id обязателен'}),
-                    'isBase64Encoded': False
-                }
-            
-            cur.execute(
-                "UPDATE call_logs SET status = 'completed', ended_at = CURRENT_TIMESTAMP, duration = EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - started_at))::INTEGER WHERE id = %s",
-                (call_id,)
-            )
-            conn.commit()
-            
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'call_id': call_id, 'status': 'completed'}),
-                'isBase64Encoded': False
-            }
-        
-        elif method == 'POST' and 'ice' in path:
-            body = json.loads(event.get('body', '{}'))
-            candidate = body.get('candidate')
-            call_id = body.get('call_id')
-            
-            if not candidate or not call_id:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'candidate и call_id обязательны'}),
-                    'isBase64Encoded': False
-                }
-            
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'success': True, 'candidate': candidate}),
-                'isBase64Encoded': False
-            }
-        
-        elif method == 'GET':
-            query = event.get('queryStringParameters', {})
-            user_id = query.get('user_id')
-            
-            if user_id:
-                cur.execute(
-                    "SELECT * FROM call_logs WHERE caller_id = %s OR receiver_id = %s ORDER BY started_at DESC LIMIT 50",
-                    (user_id, user_id)
-                )
-            else:
-                cur.execute("SELECT * FROM call_logs ORDER BY started_at DESC LIMIT 50")
-            
-            calls = cur.fetchall()
-            
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'calls': [dict(c) for c in calls]}, default=str),
-                'isBase64Encoded': False
-            }
-        
-        cur.close()
-        conn.close()
-        
-        return {
-            'statusCode': 404,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Not found'}),
-            'isBase64Encoded': False
-        }
-    
+        with metrics.pool_wait():
+            conn = db.getconn()
+    except Exception as e:
+        admission.leave()
+        metrics.record_error(e)
+        return core.error(503, str(e), admission.retry_headers(1))
+
+    try:
+        try:
+            return serve(event, route, conn)
+        except Exception as e:
+            if not db.dropped(conn, e):
+                raise
+            conn = db.replace(conn)
+            return serve(event, route, conn)
+
     except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': str(e)}),
-            'isBase64Encoded': False
-        }
\ No newline at end of file
+        metrics.record_error(e)
+        return core.error(500, str(e))
+    finally:
+        db.putconn(conn)
+        admission.leave()
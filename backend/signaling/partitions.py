@@ -0,0 +1,144 @@
+'''Помесячные секции call_logs (V0012__partition_call_logs_by_month.sql).
+
+Секции создаются и архивируются отдельным запуском по расписанию, не на
+пути звонка: CREATE TABLE ... PARTITION OF блокирует call_logs и задержал
+бы /initiate и историю. Запуск создаёт секции на
+CALL_LOGS_PARTITIONS_AHEAD месяцев вперёд; если он пропущен, строки
+попадают в call_logs_default.
+
+    DATABASE_URL=... python backend/signaling/partitions.py --archive-dir /var/archive/call_logs
+
+Секции старше CALL_LOGS_RETENTION_MONTHS месяцев отсоединяются,
+выгружаются в <archive-dir>/<секция>.csv.gz (COPY ... CSV HEADER) и
+удаляются. Секции с ещё не учтёнными в сводке звонками пропускаются;
+отсоединённая, но не выгруженная секция дописывается следующим запуском.
+Отсоединяя секцию, запуск помечает её комментарием DETACHED_MARK и
+выгружает только помеченные таблицы.
+'''
+import argparse
+import gzip
+import os
+import re
+import sys
+
+import rollups
+
+PARTITIONS_AHEAD = int(os.environ.get('CALL_LOGS_PARTITIONS_AHEAD', '3'))
+RETENTION_MONTHS = int(os.environ.get('CALL_LOGS_RETENTION_MONTHS', '12'))
+
+PARTITION_NAME = re.compile(r'^call_logs_(\d{4}_\d{2}|legacy)$')
+DETACHED_MARK = 'partitions.py: detached for archive'
+
+EXPIRED_SQL = r"""
+SELECT name FROM (
+    SELECT c.relname AS name,
+           (regexp_match(pg_get_expr(c.relpartbound, c.oid), 'TO \(''([^'']+)''\)'))[1]::timestamp AS until
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'call_logs'::regclass AND pg_get_expr(c.relpartbound, c.oid) <> 'DEFAULT'
+) p
+WHERE until <= date_trunc('month', CURRENT_TIMESTAMP) - make_interval(months => %s)
+ORDER BY until
+"""
+
+# Отсоединённые этим запуском или прошлыми, но ещё не выгруженные секции.
+# Одноимённые таблицы без пометки не трогаются.
+DETACHED_SQL = r"""
+SELECT relname AS name FROM pg_class
+WHERE relkind = 'r' AND NOT relispartition AND relname ~ '^call_logs_(\d{4}_\d{2}|legacy)$'
+  AND relnamespace = current_schema()::regnamespace
+  AND obj_description(oid, 'pg_class') = %s
+ORDER BY relname
+"""
+
+
+def ensure(cur) -> int:
+    '''Создаёт недостающие будущие секции; коммит за вызывающим'''
+    cur.execute('SELECT create_call_logs_partitions(%s) AS created', (PARTITIONS_AHEAD,))
+    return cur.fetchone()['created']
+
+
+def expired(cur, keep_months: int = RETENTION_MONTHS) -> list:
+    cur.execute(EXPIRED_SQL, (keep_months,))
+    return [row['name'] for row in cur.fetchall()]
+
+
+def detached(cur) -> list:
+    cur.execute(DETACHED_SQL, (DETACHED_MARK,))
+    return [row['name'] for row in cur.fetchall()]
+
+
+def archive(conn, name: str, directory: str) -> str:
+    '''Выгружает отсоединённую секцию в gzip CSV и удаляет её'''
+    if not PARTITION_NAME.match(name):
+        raise ValueError(f'Не секция call_logs: {name}')
+    from psycopg2 import sql
+
+    path = os.path.join(directory, f'{name}.csv.gz')
+    partial = f'{path}.part'
+    table = sql.Identifier(name)
+    with conn.cursor() as cur:
+        with gzip.open(partial, 'wb') as out:
+            cur.copy_expert(sql.SQL('COPY {} TO STDOUT WITH (FORMAT csv, HEADER)').format(table).as_string(conn), out)
+            out.flush()
+            os.fsync(out.fileobj.fileno())
+        os.replace(partial, path)
+        cur.execute(sql.SQL('DROP TABLE {}').format(table))
+    conn.commit()
+    return path
+
+
+def run_retention(conn, directory: str, keep_months: int = RETENTION_MONTHS, log=print) -> list:
+    '''Отсоединяет и архивирует устаревшие секции, возвращает пути архивов'''
+    from psycopg2 import sql
+    from psycopg2.extras import RealDictCursor
+
+    os.makedirs(directory, exist_ok=True)
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        while rollups.catch_up(cur, force=True):
+            conn.commit()
+        ensure(cur)
+        conn.commit()
+
+        for name in expired(cur, keep_months):
+            cur.execute(
+                sql.SQL('SELECT EXISTS(SELECT 1 FROM {} WHERE ended_at IS NOT NULL AND NOT rolled_up) AS pending')
+                .format(sql.Identifier(name))
+            )
+            if cur.fetchone()['pending']:
+                log(f'{name}: есть звонки вне сводки, пропущена')
+                continue
+            cur.execute(sql.SQL('ALTER TABLE call_logs DETACH PARTITION {}').format(sql.Identifier(name)))
+            cur.execute(sql.SQL('COMMENT ON TABLE {} IS %s').format(sql.Identifier(name)), (DETACHED_MARK,))
+            conn.commit()
+            log(f'{name}: отсоединена')
+
+        pending = detached(cur)
+    conn.commit()
+
+    archives = []
+    for name in pending:
+        archives.append(archive(conn, name, directory))
+        log(f'{name}: выгружена в {archives[-1]}')
+    return archives
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Архивация старых секций call_logs')
+    parser.add_argument('--archive-dir', default=os.environ.get('CALL_LOGS_ARCHIVE_DIR'), required=False)
+    parser.add_argument('--keep-months', type=int, default=RETENTION_MONTHS)
+    args = parser.parse_args(argv)
+    if not args.archive_dir:
+        parser.error('нужен --archive-dir или CALL_LOGS_ARCHIVE_DIR')
+
+    import psycopg2
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    try:
+        run_retention(conn, args.archive_dir, args.keep_months)
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+'''Сборщик зависших звонков: клиент упал и не прислал /end.
+
+Раз в CALL_REAP_INTERVAL секунд один запрос (по частичному индексу
+открытых звонков из V0013__add_call_logs_open_index.sql) закрывает пачку:
+- ringing без ответа дольше CALL_RING_TIMEOUT — missed, длительность 0;
+- active, где кто-то из абонентов не виден дольше CALL_ACTIVE_STALE или
+  звонок длится больше CALL_MAX_DURATION, — completed; конец звонка —
+  последний момент, когда были видны оба абонента.
+Абоненты выходят из in_call (в offline, если сами пропали), если у них
+нет другого открытого звонка; звонок удаляется из call_open (вместе с ним
+каскадом SDP и ICE), обоим уходит hangup. В сводку такие звонки добирает rollups.catch_up().
+'''
+import os
+import threading
+import time
+
+RING_TIMEOUT = int(os.environ.get('CALL_RING_TIMEOUT', '60'))
+ACTIVE_STALE = int(os.environ.get('CALL_ACTIVE_STALE', '90'))
+MAX_DURATION = int(os.environ.get('CALL_MAX_DURATION', str(4 * 3600)))
+REAP_INTERVAL = float(os.environ.get('CALL_REAP_INTERVAL', '15'))
+REAP_BATCH = int(os.environ.get('CALL_REAP_BATCH', '500'))
+
+REAP_SQL = """
+WITH stuck AS (
+    SELECT c.id, c.started_at, c.status,
+           CASE WHEN c.status = 'active'
+                THEN GREATEST(c.started_at, LEAST(caller.last_seen, receiver.last_seen, CURRENT_TIMESTAMP))
+                ELSE CURRENT_TIMESTAMP END AS ended
+    FROM call_logs c
+    LEFT JOIN users caller ON caller.id = c.caller_id
+    LEFT JOIN users receiver ON receiver.id = c.receiver_id
+    WHERE c.ended_at IS NULL AND (
+        (c.status <> 'active' AND c.started_at < CURRENT_TIMESTAMP - make_interval(secs => %(ring_timeout)s))
+        OR (c.status = 'active' AND (
+            c.started_at < CURRENT_TIMESTAMP - make_interval(secs => %(max_duration)s)
+            OR LEAST(caller.last_seen, receiver.last_seen) < CURRENT_TIMESTAMP - make_interval(secs => %(active_stale)s)
+        ))
+    )
+    ORDER BY c.started_at
+    LIMIT %(batch)s
+    FOR UPDATE OF c SKIP LOCKED
+),
+reaped AS (
+    UPDATE call_logs c SET
+        status = CASE WHEN s.status = 'active' THEN 'completed' ELSE 'missed' END,
+        ended_at = s.ended,
+        duration = CASE WHEN s.status = 'active'
+                        THEN EXTRACT(EPOCH FROM (s.ended - s.started_at))::INTEGER ELSE 0 END
+    FROM stuck s
+    WHERE c.id = s.id AND c.started_at = s.started_at
+    RETURNING c.id, c.caller_id, c.receiver_id, c.status
+),
+freed AS (
+    UPDATE users SET status = CASE
+        WHEN users.last_seen < CURRENT_TIMESTAMP - make_interval(secs => %(active_stale)s) THEN 'offline'
+        ELSE 'online' END
+    FROM reaped r
+    WHERE users.id IN (r.caller_id, r.receiver_id) AND users.status = 'in_call'
+      AND NOT EXISTS (
+          SELECT 1 FROM call_open o
+          WHERE users.id IN (o.caller_id, o.receiver_id)
+            AND o.call_id NOT IN (SELECT id FROM reaped)
+      )
+),
+closed AS (
+    DELETE FROM call_open USING reaped r WHERE call_open.call_id = r.id
+),
+notified AS (
+    INSERT INTO call_events (user_id, type, call_id)
+    SELECT u, 'hangup', r.id FROM reaped r, unnest(ARRAY[r.caller_id, r.receiver_id]) AS u
+    WHERE u IS NOT NULL
+)
+SELECT COUNT(*) FILTER (WHERE status = 'missed') AS missed,
+       COUNT(*) FILTER (WHERE status = 'completed') AS completed
+FROM reaped
+"""
+
+_last_reap = 0.0
+_stats = {'runs': 0, 'missed': 0, 'completed': 0}
+_lock = threading.Lock()
+
+
+def due() -> bool:
+    return time.monotonic() - _last_reap >= REAP_INTERVAL
+
+
+def reap(cur) -> dict:
+    '''Закрывает одну пачку зависших звонков; коммит за вызывающим'''
+    global _last_reap
+    _last_reap = time.monotonic()
+    cur.execute(REAP_SQL, {
+        'ring_timeout': RING_TIMEOUT,
+        'active_stale': ACTIVE_STALE,
+        'max_duration': MAX_DURATION,
+        'batch': REAP_BATCH
+    })
+    row = cur.fetchone() or {}
+    result = {'missed': row.get('missed') or 0, 'completed': row.get('completed') or 0}
+    with _lock:
+        _stats['runs'] += 1
+        _stats['missed'] += result['missed']
+        _stats['completed'] += result['completed']
+    return result
+
+
+def stats() -> dict:
+    with _lock:
+        return dict(_stats)
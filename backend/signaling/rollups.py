@@ -0,0 +1,143 @@
+'''Сводки по звонкам (CDR rollups): call_stats_hourly по пользователю и часу.
+
+Завершённый звонок добавляется в сводку одним INSERT ... ON CONFLICT
+прямо в запросе /end (CALL_ROLLUP_INLINE=1) и помечается rolled_up.
+Звонки, завершённые в обход /end, и всё, что пропущено при
+CALL_ROLLUP_INLINE=0, добирает пакетный catch_up() по частичному
+индексу из V0011__create_call_stats_hourly.sql.
+
+Отчёты (build_query) суммируют часовые строки, поэтому их стоимость
+зависит от длины диапазона, а не от числа звонков. Границы from / to
+округляются до часа.
+'''
+import os
+import time
+from datetime import datetime, timedelta
+
+ROLLUP_INLINE = os.environ.get('CALL_ROLLUP_INLINE', '1') == '1'
+ROLLUP_INTERVAL = float(os.environ.get('CALL_ROLLUP_INTERVAL', '60'))
+ROLLUP_BATCH = int(os.environ.get('CALL_ROLLUP_BATCH', '1000'))
+
+GROUPS = ('hour', 'day', 'week', 'month', 'total')
+DEFAULT_RANGE = timedelta(days=7)
+
+_last_catch_up = 0.0
+
+
+def upsert_sql(source: str) -> str:
+    '''INSERT в сводку из CTE source(caller_id, receiver_id, started_at, duration, answered).
+
+    Каждый звонок даёт строку звонящему и принимающему; строки заранее
+    сгруппированы, чтобы ON CONFLICT не задевал одну строку дважды.
+    '''
+    return f"""
+INSERT INTO call_stats_hourly AS s
+    (user_id, hour, calls_out, calls_in, answered_out, answered_in, duration_out, duration_in, max_duration)
+SELECT p.user_id, date_trunc('hour', src.started_at),
+       SUM(p.outgoing), SUM(1 - p.outgoing),
+       SUM(p.outgoing * src.answered), SUM((1 - p.outgoing) * src.answered),
+       SUM(p.outgoing * src.answered * src.duration), SUM((1 - p.outgoing) * src.answered * src.duration),
+       MAX(src.answered * src.duration)
+FROM {source} AS src
+CROSS JOIN LATERAL (VALUES (src.caller_id, 1), (src.receiver_id, 0)) AS p(user_id, outgoing)
+WHERE p.user_id IS NOT NULL
+GROUP BY 1, 2
+ON CONFLICT (user_id, hour) DO UPDATE SET
+    calls_out = s.calls_out + EXCLUDED.calls_out,
+    calls_in = s.calls_in + EXCLUDED.calls_in,
+    answered_out = s.answered_out + EXCLUDED.answered_out,
+    answered_in = s.answered_in + EXCLUDED.answered_in,
+    duration_out = s.duration_out + EXCLUDED.duration_out,
+    duration_in = s.duration_in + EXCLUDED.duration_in,
+    max_duration = GREATEST(s.max_duration, EXCLUDED.max_duration)
+"""
+
+
+# Отвеченным пакет считает завершённый звонок с ненулевой длительностью:
+# прежний статус (active) известен только в момент /end.
+CATCH_UP_SQL = f"""
+WITH picked AS (
+    UPDATE call_logs SET rolled_up = TRUE
+    WHERE id IN (
+        SELECT id FROM call_logs
+        WHERE ended_at IS NOT NULL AND NOT rolled_up
+        ORDER BY id LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING caller_id, receiver_id, started_at, COALESCE(duration, 0) AS duration,
+              (status = 'completed' AND duration > 0)::int AS answered
+),
+rolled AS ({upsert_sql('picked')})
+SELECT COUNT(*) AS rolled FROM picked
+"""
+
+
+def catch_up(cur, force: bool = False) -> int:
+    '''Добавляет в сводку до ROLLUP_BATCH завершённых звонков; коммит за вызывающим'''
+    global _last_catch_up
+    if not force and time.monotonic() - _last_catch_up < ROLLUP_INTERVAL:
+        return 0
+    _last_catch_up = time.monotonic()
+    cur.execute(CATCH_UP_SQL, (ROLLUP_BATCH,))
+    row = cur.fetchone()
+    return row['rolled'] if row else 0
+
+
+def _parse_hour(value: str, key: str) -> datetime:
+    try:
+        return datetime.fromisoformat(value).replace(minute=0, second=0, microsecond=0)
+    except ValueError:
+        raise ValueError(f'Некорректная дата {key}')
+
+
+def build_query(query: dict) -> tuple:
+    '''SQL отчёта по сводке: user_id (иначе по всем), from / to, group.
+
+    group — hour, day (по умолчанию), week, month или total. Без from
+    берутся последние 7 дней.
+    '''
+    group = query.get('group', 'day')
+    if group not in GROUPS:
+        raise ValueError(f"group: одно из {', '.join(GROUPS)}")
+    end = _parse_hour(query['to'], 'to') if query.get('to') else None
+    start = _parse_hour(query['from'], 'from') if query.get('from') else (end or datetime.now()) - DEFAULT_RANGE
+
+    bucket = 'NULL::timestamp' if group == 'total' else f"date_trunc('{group}', hour)"
+    conditions = ['hour >= %s']
+    params = [start]
+    if end is not None:
+        conditions.append('hour < %s')
+        params.append(end)
+
+    user_id = query.get('user_id')
+    if user_id:
+        conditions.insert(0, 'user_id = %s')
+        params.insert(0, user_id)
+        totals = ('calls_out + calls_in', 'answered_out + answered_in', 'duration_out + duration_in')
+    else:
+        # У каждого звонка ровно одна строка звонящего — по ней и считаем.
+        totals = ('calls_out', 'answered_out', 'duration_out')
+
+    calls, answered, duration = totals
+    sql = (
+        f'SELECT {bucket} AS bucket, SUM({calls}) AS calls, SUM({answered}) AS answered, '
+        f'SUM({duration}) AS total_duration, MAX(max_duration) AS max_duration '
+        f"FROM call_stats_hourly WHERE {' AND '.join(conditions)} GROUP BY 1 ORDER BY 1"
+    )
+    return sql, params
+
+
+def summarize(row: dict) -> dict:
+    calls = int(row['calls'] or 0)
+    answered = int(row['answered'] or 0)
+    total_duration = int(row['total_duration'] or 0)
+    return {
+        'bucket': row['bucket'],
+        'calls': calls,
+        'answered': answered,
+        'missed': calls - answered,
+        'answer_rate': round(answered / calls, 4) if calls else None,
+        'total_duration': total_duration,
+        'avg_duration': round(total_duration / answered, 1) if answered else None,
+        'max_duration': int(row['max_duration'] or 0)
+    }
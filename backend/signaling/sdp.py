@@ -0,0 +1,160 @@
+'''SDP offer/answer звонка: хранение в bytea и компактный формат передачи.
+
+Компактное описание — {"type", "encoding", "data"}, где data — base64 от
+raw deflate текста SDP с LF вместо CRLF. Кодировки (ENCODINGS):
+- zdict1 — deflate с общим словарём частых строк SDP (SDP_DICTIONARY);
+- deflate — без словаря, её умеет CompressionStream('deflate-raw') браузера.
+
+Клиент перечисляет понятные ему кодировки в заголовке X-SDP-Encoding, и
+SDP в ответах приходит в первой подходящей; без заголовка — обычный
+{"type", "sdp"}. Компактное описание от клиента хранится теми же сжатыми
+байтами (после проверки распаковкой) и отдаётся без пересжатия клиенту с
+той же кодировкой. Обычные описания хранятся в zdict1.
+'''
+import base64
+import json
+import zlib
+
+COMPRESS_THRESHOLD = 1024
+COMPRESS_LEVEL = 6
+MAX_SDP = 64 * 1024
+
+RAW = b'j'
+ZLIB = b'z'
+COMPACT = {'zdict1': b'd', 'deflate': b'f'}
+ENCODINGS = tuple(COMPACT)
+ENCODING_HEADER = 'X-SDP-Encoding'
+
+_ENCODING_OF = {marker: name for name, marker in COMPACT.items()}
+
+# Строки, которые есть почти в каждом SDP от браузеров. Deflate дешевле
+# ссылается на близкие к концу словаря строки, поэтому самые частые — в конце.
+# Менять словарь можно только вместе с именем кодировки (zdict2, ...).
+SDP_DICTIONARY = (
+    'a=extmap:1 urn:ietf:params:rtp-hdrext:ssrc-audio-level\n'
+    'a=extmap:2 http://www.webrtc.org/experiments/rtp-hdrext/abs-send-time\n'
+    'a=extmap:3 http://www.ietf.org/id/draft-holmer-rmcat-transport-wide-cc-extensions-01\n'
+    'a=extmap:4 urn:ietf:params:rtp-hdrext:sdes:mid\n'
+    'a=rtpmap:63 red/48000/2\na=fmtp:63 111/111\n'
+    'a=rtpmap:9 G722/8000\na=rtpmap:0 PCMU/8000\na=rtpmap:8 PCMA/8000\n'
+    'a=rtpmap:13 CN/8000\na=rtpmap:110 telephone-event/48000\na=rtpmap:126 telephone-event/8000\n'
+    'a=rtpmap:111 opus/48000/2\na=rtcp-fb:111 transport-cc\na=fmtp:111 minptime=10;useinbandfec=1\n'
+    'a=extmap-allow-mixed\na=msid-semantic: WMS\na=ice-options:trickle\na=setup:actpass\na=setup:active\n'
+    'a=fingerprint:sha-256 \na=sendrecv\na=rtcp-mux\na=rtcp-rsize\na=mid:0\n'
+    'v=0\no=- 2 IN IP4 127.0.0.1\ns=-\nt=0 0\na=group:BUNDLE 0\n'
+    'm=audio 9 UDP/TLS/RTP/SAVPF 111 63 9 0 8 13 110 126\nc=IN IP4 0.0.0.0\na=rtcp:9 IN IP4 0.0.0.0\n'
+    'a=ssrc: cname:\na=ssrc: msid:\na=msid:\na=ice-ufrag:\na=ice-pwd:\n'
+    'a=candidate: 1 udp 2122260223  typ host generation 0 network-id 1\n'
+    'a=candidate: 1 udp 1686052607  typ srflx raddr  rport  generation 0 network-id 1\n'
+    'a=candidate: 1 tcp 1518280447  9 typ host tcptype active generation 0 network-id 1\n'
+).encode('ascii')
+
+
+def minify(text: str) -> str:
+    return text.replace('\r\n', '\n')
+
+
+def expand(text: str) -> str:
+    '''LF -> CRLF; уже пришедшие CRLF не удваиваются'''
+    return minify(text).replace('\n', '\r\n')
+
+
+def negotiate(header_value: str):
+    '''Первая из перечисленных клиентом кодировок, которую знает сервер'''
+    for name in (header_value or '').split(','):
+        name = name.strip().lower()
+        if name in COMPACT:
+            return name
+    return None
+
+
+def _compress(text: str, encoding: str) -> bytes:
+    options = {'zdict': SDP_DICTIONARY} if encoding == 'zdict1' else {}
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -15, **options)
+    return compressor.compress(text.encode('utf-8')) + compressor.flush()
+
+
+def _decompress(data: bytes, encoding: str) -> str:
+    options = {'zdict': SDP_DICTIONARY} if encoding == 'zdict1' else {}
+    try:
+        decompressor = zlib.decompressobj(-15, **options)
+        text = decompressor.decompress(data, MAX_SDP)
+    except zlib.error as e:
+        raise ValueError(f'Повреждённый SDP: {e}')
+    if decompressor.unconsumed_tail or not decompressor.eof:
+        raise ValueError('SDP повреждён или больше допустимого')
+    return text.decode('utf-8')
+
+
+def is_compact(description) -> bool:
+    return isinstance(description, dict) and 'encoding' in description
+
+
+def encode(description: dict, encoding: str) -> dict:
+    data = _compress(minify(description['sdp']), encoding)
+    return {'type': description['type'], 'encoding': encoding, 'data': base64.b64encode(data).decode('ascii')}
+
+
+def decode(description):
+    '''Компактное описание -> {type, sdp}; обычное возвращается как есть'''
+    if not is_compact(description):
+        return description
+    encoding = description['encoding']
+    if encoding not in COMPACT:
+        raise ValueError(f'Неизвестная кодировка SDP: {encoding}')
+    data = base64.b64decode(description.get('data') or '', validate=True)
+    return {'type': description.get('type'), 'sdp': expand(_decompress(data, encoding))}
+
+
+def _description_type(description: dict) -> bytes:
+    kind = str(description.get('type') or '')
+    if '\0' in kind or len(kind) > 16:
+        raise ValueError('Некорректный type описания сессии')
+    return kind.encode('utf-8')
+
+
+def pack(description) -> bytes:
+    '''Сериализует описание сессии для call_sdp'''
+    if is_compact(description):
+        encoding = description['encoding']
+        if encoding not in COMPACT:
+            raise ValueError(f'Неизвестная кодировка SDP: {encoding}')
+        data = base64.b64decode(description.get('data') or '', validate=True)
+        _decompress(data, encoding)
+        return COMPACT[encoding] + _description_type(description) + b'\0' + data
+
+    if isinstance(description, dict) and set(description) == {'type', 'sdp'} and isinstance(description['sdp'], str):
+        return (COMPACT['zdict1'] + _description_type(description) + b'\0'
+                + _compress(minify(description['sdp']), 'zdict1'))
+
+    data = json.dumps(description, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    if len(data) >= COMPRESS_THRESHOLD:
+        compressed = zlib.compress(data, COMPRESS_LEVEL)
+        if len(compressed) < len(data):
+            return ZLIB + compressed
+    return RAW + data
+
+
+def unpack(blob, encoding: str = None):
+    '''Описание из call_sdp: обычное или в компактной кодировке encoding'''
+    if blob is None:
+        return None
+    blob = bytes(blob)
+    marker, data = blob[:1], blob[1:]
+    stored = _ENCODING_OF.get(marker)
+    if stored is not None:
+        kind, _, compressed = data.partition(b'\0')
+        if encoding == stored:
+            return {'type': kind.decode('utf-8'), 'encoding': encoding,
+                    'data': base64.b64encode(compressed).decode('ascii')}
+        description = {'type': kind.decode('utf-8'), 'sdp': expand(_decompress(compressed, stored))}
+    elif marker == ZLIB:
+        description = json.loads(zlib.decompress(data))
+    elif marker == RAW:
+        description = json.loads(data)
+    else:
+        raise ValueError('Unknown SDP encoding')
+
+    if encoding and isinstance(description, dict) and isinstance(description.get('sdp'), str):
+        return encode(description, encoding)
+    return description
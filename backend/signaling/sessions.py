@@ -0,0 +1,149 @@
+'''Сессионные токены: таблица sessions и кеш проверенных токенов в процессе.
+
+В базе хранится только sha256 токена. Проверка сначала смотрит в
+LRU-кеш с TTL (включая отрицательные ответы), в базу идёт лишь при
+промахе и заодно продлевает срок сессии (sliding expiry). Отзыв сразу
+виден в этом экземпляре и не позже SESSION_CACHE_TTL — в остальных.
+
+Файл одинаковый в backend/auth и backend/signaling.
+'''
+import hashlib
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+import db
+import metrics
+
+SESSION_TTL = int(os.environ.get('SESSION_TTL', str(7 * 24 * 3600)))
+SESSION_CACHE_SIZE = int(os.environ.get('SESSION_CACHE_SIZE', '10000'))
+SESSION_CACHE_TTL = float(os.environ.get('SESSION_CACHE_TTL', '60'))
+SESSION_NEGATIVE_TTL = float(os.environ.get('SESSION_NEGATIVE_TTL', '10'))
+CLEANUP_INTERVAL = 3600
+
+_last_cleanup = 0.0
+
+
+class SessionCache:
+    '''Ограниченный LRU-кеш token_hash -> user_id (None — токен недействителен)'''
+
+    def __init__(self, maxsize: int = SESSION_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        '''Возвращает (найдено, user_id)'''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[0]
+
+    def peek(self, key: str):
+        '''user_id без учёта в hits/misses и без продления LRU; None и при промахе'''
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry[0] if entry is not None and entry[1] >= time.monotonic() else None
+
+    def put(self, key: str, user_id, ttl: float) -> None:
+        with self._lock:
+            self._entries[key] = (user_id, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+cache = SessionCache()
+
+
+def token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def create(cur, user_id: int) -> str:
+    '''Создаёт сессию в текущей транзакции; коммит за вызывающим'''
+    global _last_cleanup
+    if time.monotonic() - _last_cleanup >= CLEANUP_INTERVAL:
+        _last_cleanup = time.monotonic()
+        cur.execute("DELETE FROM sessions WHERE expires_at < CURRENT_TIMESTAMP - INTERVAL '1 day'")
+    token = secrets.token_urlsafe(32)
+    key = token_hash(token)
+    cur.execute(
+        "INSERT INTO sessions (token_hash, user_id, expires_at) "
+        "VALUES (%s, %s, CURRENT_TIMESTAMP + make_interval(secs => %s))",
+        (key, user_id, SESSION_TTL)
+    )
+    cache.put(key, user_id, SESSION_CACHE_TTL)
+    return token
+
+
+def revoke(cur, token: str) -> bool:
+    key = token_hash(token)
+    cur.execute(
+        "UPDATE sessions SET revoked_at = CURRENT_TIMESTAMP WHERE token_hash = %s AND revoked_at IS NULL",
+        (key,)
+    )
+    cache.put(key, None, SESSION_NEGATIVE_TTL)
+    return cur.rowcount > 0
+
+
+def validate(token: str, conn=None):
+    '''Возвращает user_id действующей сессии или None.
+
+    При промахе кеша берёт conn, если он передан, иначе соединение из пула.
+    '''
+    if not token:
+        return None
+    key = token_hash(token)
+    found, user_id = cache.get(key)
+    if found:
+        return user_id
+    own_conn = conn is None
+    if own_conn:
+        conn = db.getconn()
+    try:
+        with metrics.cursor(conn.cursor()) as cur:
+            cur.execute(
+                "UPDATE sessions SET expires_at = CURRENT_TIMESTAMP + make_interval(secs => %s) "
+                "WHERE token_hash = %s AND revoked_at IS NULL AND expires_at > CURRENT_TIMESTAMP "
+                "RETURNING user_id",
+                (SESSION_TTL, key)
+            )
+            row = cur.fetchone()
+        conn.commit()
+    finally:
+        if own_conn:
+            db.putconn(conn)
+    user_id = row[0] if row else None
+    cache.put(key, user_id, SESSION_CACHE_TTL if user_id is not None else SESSION_NEGATIVE_TTL)
+    return user_id
+
+
+def cached(token: str):
+    '''user_id уже проверенной в этом экземпляре сессии, в базу не ходит'''
+    return cache.peek(token_hash(token)) if token else None
+
+
+def token_from_event(event: dict):
+    for name, value in (event.get('headers') or {}).items():
+        if name.lower() == 'x-authorization':
+            return value.removeprefix('Bearer ').strip() or None
+    return None
+
+
+def stats() -> dict:
+    return cache.stats()
@@ -0,0 +1,399 @@
+'''Офлайн-нагрузочный тест обработчиков backend/.
+
+Вызывает handler(event, context) каждой функции напрямую синтетическими
+событиями — без HTTP и платформы. База — локальный Postgres (--dsn) или
+подменная база в памяти процесса (bench/standin.py, по умолчанию).
+
+Сценарии:
+- poll — агенты опрашивают список пользователей, историю звонков и шлют heartbeat;
+- calls — серии /initiate -> /ice -> /answer -> /end;
+- relay — $connect, шторм $default-сообщений между пирами, $disconnect;
+- login — вход с проверкой bcrypt.
+
+Результат — JSON с throughput и p50/p95/p99 по маршрутам; с --compare
+сравнивается с прошлым прогоном и завершается с кодом 1 при регрессии p95.
+
+    python bench/run.py --agents 50 --rounds 20 --output bench/results/$(git rev-parse --short HEAD).json
+    python bench/run.py --compare bench/results/baseline.json
+'''
+import argparse
+import importlib
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+BACKEND = ROOT / 'backend'
+FUNCTIONS = ('auth', 'signaling', 'api-users', 'api-signaling')
+SCENARIOS = ('poll', 'calls', 'relay', 'login')
+PASSWORD = 'bench-password'
+NOISE_MS = 0.1
+
+
+def load_function(name: str):
+    '''Импортирует index.py функции со своими копиями общих модулей.
+
+    У всех функций модули называются одинаково (index, core, db, ...),
+    поэтому перед импортом они убираются из sys.modules: каждая функция
+    получает собственные экземпляры, как при отдельном деплое.
+    '''
+    fn_dir = BACKEND / name
+    local = [path.stem for path in fn_dir.glob('*.py')]
+    for module in local:
+        sys.modules.pop(module, None)
+    sys.path.insert(0, str(fn_dir))
+    try:
+        return importlib.import_module('index')
+    finally:
+        sys.path.remove(str(fn_dir))
+        for module in local:
+            sys.modules.pop(module, None)
+
+
+def http_event(method: str, path: str = '/', body=None, query: dict = None, headers: dict = None) -> dict:
+    return {
+        'httpMethod': method,
+        'url': path,
+        'headers': headers or {},
+        'queryStringParameters': query or {},
+        'body': json.dumps(body) if body is not None else '',
+        'isBase64Encoded': False,
+        'requestContext': {}
+    }
+
+
+def ws_event(route_key: str, connection_id: str, body=None, query: dict = None) -> dict:
+    return {
+        'httpMethod': 'POST',
+        'headers': {},
+        'queryStringParameters': query or {},
+        'body': json.dumps(body) if body is not None else '',
+        'isBase64Encoded': False,
+        'requestContext': {'routeKey': route_key, 'connectionId': connection_id}
+    }
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class Recorder:
+    '''Латентности и коды ответов по маршрутам, потокобезопасно'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.scenario_of = {}
+
+    def call(self, scenario: str, handlers: dict, function: str, label: str, event: dict) -> dict:
+        key = f'{function} {label}'
+        started = time.perf_counter()
+        result = handlers[function].handler(event, None)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        failed = result.get('statusCode', 200) >= 400
+        with self._lock:
+            self.latencies.setdefault(key, []).append(elapsed_ms)
+            self.scenario_of[key] = scenario
+            if failed:
+                self.errors[key] = self.errors.get(key, 0) + 1
+        return result
+
+    def report(self, elapsed: dict) -> dict:
+        routes = {}
+        for key, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            seconds = elapsed.get(self.scenario_of[key]) or 1e-9
+            routes[key] = {
+                'scenario': self.scenario_of[key],
+                'count': len(values),
+                'errors': self.errors.get(key, 0),
+                'rps': round(len(values) / seconds, 1),
+                'mean_ms': round(sum(values) / len(values), 3),
+                'p50_ms': round(percentile(values, 50), 3),
+                'p95_ms': round(percentile(values, 95), 3),
+                'p99_ms': round(percentile(values, 99), 3),
+                'max_ms': round(values[-1], 3)
+            }
+        return routes
+
+
+def body_of(result: dict) -> dict:
+    return json.loads(result.get('body') or '{}')
+
+
+def setup_agents(recorder: Recorder, handlers: dict, count: int) -> list:
+    '''Регистрирует агентов через auth и возвращает их id, телефоны и токены'''
+    run = uuid.uuid4().hex[:6]
+    agents = []
+    for i in range(count):
+        phone = f'+7{int(run, 16) % 10000:04d}{i:06d}'
+        result = recorder.call('setup', handlers, 'auth', 'POST register', http_event(
+            'POST', '/register', {'username': f'bench_{run}_{i}', 'phone': phone, 'password': PASSWORD}
+        ))
+        if result['statusCode'] != 201:
+            raise RuntimeError(f'Не удалось зарегистрировать агента: {result["body"]}')
+        data = body_of(result)
+        agents.append({'id': data['user']['id'], 'phone': phone, 'token': data['token'], 'cursor': None})
+    return agents
+
+
+def poll_unit(recorder: Recorder, handlers: dict, agents: list, unit: int) -> None:
+    agent = agents[unit % len(agents)]
+    auth_headers = {'X-Authorization': f'Bearer {agent["token"]}'}
+
+    query = {'since': str(agent['cursor'])} if agent['cursor'] is not None else {}
+    result = recorder.call('poll', handlers, 'auth', 'GET list_users', http_event('GET', '/', query=query))
+    if result['statusCode'] == 200:
+        agent['cursor'] = body_of(result).get('cursor')
+
+    recorder.call('poll', handlers, 'auth', 'POST heartbeat', http_event(
+        'POST', '/heartbeat', {'user_id': agent['id'], 'status': 'online'}
+    ))
+    recorder.call('poll', handlers, 'signaling', 'GET call_history', http_event(
+        'GET', '/', query={'user_id': str(agent['id']), 'limit': '20'}, headers=auth_headers
+    ))
+    recorder.call('poll', handlers, 'api-users', 'GET list', http_event('GET', '/', query={'action': 'list'}))
+
+
+def call_unit(recorder: Recorder, handlers: dict, agents: list, unit: int) -> None:
+    pairs = max(1, len(agents) // 2)
+    caller = agents[(unit % pairs) * 2]
+    receiver = agents[(unit % pairs) * 2 + 1]
+    caller_headers = {'X-Authorization': f'Bearer {caller["token"]}'}
+    receiver_headers = {'X-Authorization': f'Bearer {receiver["token"]}'}
+
+    result = recorder.call('calls', handlers, 'signaling', 'POST initiate', http_event(
+        'POST', '/initiate',
+        {'caller_id': caller['id'], 'receiver_id': receiver['id'], 'offer': {'type': 'offer', 'sdp': SDP_OFFER}},
+        headers=caller_headers
+    ))
+    if result['statusCode'] != 200:
+        return
+    call_id = body_of(result)['call_id']
+
+    recorder.call('calls', handlers, 'signaling', 'POST ice', http_event(
+        'POST', '/ice',
+        {'call_id': call_id, 'sender_id': caller['id'], 'candidates': ICE_CANDIDATES},
+        headers=caller_headers
+    ))
+    recorder.call('calls', handlers, 'signaling', 'GET sdp', http_event(
+        'GET', '/sdp', query={'call_id': str(call_id)}, headers=receiver_headers
+    ))
+    recorder.call('calls', handlers, 'signaling', 'POST answer', http_event(
+        'POST', '/answer',
+        {'call_id': call_id, 'answer': {'type': 'answer', 'sdp': SDP_OFFER}},
+        headers=receiver_headers
+    ))
+    recorder.call('calls', handlers, 'signaling', 'POST end', http_event(
+        'POST', '/end', {'call_id': call_id, 'user_id': caller['id']}, headers=caller_headers
+    ))
+
+
+def relay_connect(recorder: Recorder, handlers: dict, agents: list, unit: int) -> None:
+    agent = agents[unit]
+    recorder.call('relay', handlers, 'api-signaling', '$connect', ws_event(
+        '$connect', f'bench-conn-{unit}', query={'peer_id': f'peer_{agent["id"]}'}
+    ))
+
+
+def relay_unit(recorder: Recorder, handlers: dict, agents: list, unit: int, messages: int) -> None:
+    connection_id = f'bench-conn-{unit % len(agents)}'
+    rng = random.Random(unit)
+
+    for i in range(messages):
+        if i % 10 == 9:
+            message = {'type': 'ping'}
+        else:
+            peer = agents[rng.randrange(len(agents))]
+            message = {'type': 'ice-candidate', 'to': f'peer_{peer["id"]}', 'candidate': ICE_CANDIDATES[0]}
+        recorder.call('relay', handlers, 'api-signaling', '$default', ws_event('$default', connection_id, message))
+
+
+def relay_disconnect(recorder: Recorder, handlers: dict, agents: list, unit: int) -> None:
+    recorder.call('relay', handlers, 'api-signaling', '$disconnect', ws_event('$disconnect', f'bench-conn-{unit}'))
+
+
+def login_unit(recorder: Recorder, handlers: dict, agents: list, unit: int) -> None:
+    agent = agents[unit % len(agents)]
+    recorder.call('login', handlers, 'auth', 'POST login', http_event(
+        'POST', '/login', {'phone': agent['phone'], 'password': PASSWORD}
+    ))
+
+
+SDP_OFFER = (
+    'v=0\r\no=- 4611731400430051336 2 IN IP4 127.0.0.1\r\ns=-\r\nt=0 0\r\na=group:BUNDLE 0\r\n'
+    'm=audio 9 UDP/TLS/RTP/SAVPF 111 63 9 0 8 13 110 126\r\nc=IN IP4 0.0.0.0\r\n'
+    'a=rtcp:9 IN IP4 0.0.0.0\r\na=ice-ufrag:bench\r\na=ice-pwd:benchbenchbenchbenchbench\r\n'
+    'a=fingerprint:sha-256 ' + ':'.join(['AB'] * 32) + '\r\na=setup:actpass\r\na=mid:0\r\n'
+    'a=sendrecv\r\na=rtcp-mux\r\na=rtpmap:111 opus/48000/2\r\na=fmtp:111 minptime=10;useinbandfec=1\r\n'
+)
+ICE_CANDIDATES = [
+    {'candidate': f'candidate:{i} 1 udp 2122260223 192.168.1.{i} 5{i:04d} typ host generation 0',
+     'sdpMid': '0', 'sdpMLineIndex': 0}
+    for i in range(1, 5)
+]
+
+
+def run_phases(phases: list, concurrency: int) -> float:
+    '''Выполняет фазы сценария по очереди, единицы фазы — параллельно'''
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for fn, units in phases:
+            for future in [pool.submit(fn, unit) for unit in range(units)]:
+                future.result()
+    return time.perf_counter() - started
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list:
+    '''Печатает изменение p95 по маршрутам, возвращает регрессии сверх порога, %'''
+    regressions = []
+    print(f'\nсравнение с {baseline.get("commit") or "baseline"}:')
+    for key, route in current['routes'].items():
+        before = baseline.get('routes', {}).get(key)
+        if not before or not before['p95_ms']:
+            continue
+        change = (route['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100
+        mark = ''
+        # Доли микросекунды на быстрых маршрутах — шум, а не регрессия.
+        if change > threshold and route['p95_ms'] - before['p95_ms'] > NOISE_MS:
+            regressions.append(key)
+            mark = '  <- регрессия'
+        print(f'  {key:32} p95 {before["p95_ms"]:9.3f} -> {route["p95_ms"]:9.3f} ms ({change:+.1f}%){mark}')
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Нагрузочный тест обработчиков backend/')
+    parser.add_argument('--dsn', help='локальный Postgres; без него — подменная база в памяти')
+    parser.add_argument('--db-latency-ms', type=float, default=0.5,
+                        help='задержка подменной базы на запрос, моделирует round-trip (0.5)')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--agents', type=int, default=50)
+    parser.add_argument('--rounds', type=int, default=10, help='повторов сценария на агента')
+    parser.add_argument('--messages', type=int, default=20, help='сообщений на соединение в relay')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--output', help='куда записать JSON с результатами')
+    parser.add_argument('--compare', help='JSON прошлого прогона для сравнения')
+    parser.add_argument('--threshold', type=float, default=20.0, help='допустимый рост p95, %% (20)')
+    args = parser.parse_args(argv)
+
+    scenarios = [name for name in args.scenarios.split(',') if name]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'неизвестные сценарии: {", ".join(sorted(unknown))}')
+
+    os.environ.setdefault('SIGNALING_REGISTRY', 'memory')
+    os.environ.setdefault('BCRYPT_ROUNDS', '10')
+    # Синтетические агенты шлют запросы много чаще телефонов: лимит на клиента
+    # не мерим, ограничение одновременной работы с базой остаётся.
+    for name in ('ADMISSION_RATE', 'ADMISSION_BURST', 'ADMISSION_CALL_RATE', 'ADMISSION_CALL_BURST'):
+        os.environ.setdefault(name, '1000000')
+    database = None
+    if args.dsn:
+        os.environ['DATABASE_URL'] = args.dsn
+    else:
+        import standin
+        os.environ['DATABASE_URL'] = 'standin'
+        database = standin.StandinDatabase(users=args.agents, latency_ms=args.db_latency_ms)
+        standin.install(database)
+
+    handlers = {name: load_function(name) for name in FUNCTIONS}
+    if database is not None:
+        database.password_hash = handlers['auth'].passwords.hash_password(PASSWORD)
+        database.offer_blob = handlers['signaling'].sdp.pack({'type': 'offer', 'sdp': SDP_OFFER})
+
+    recorder = Recorder()
+    elapsed = {}
+    started = time.perf_counter()
+    agents = setup_agents(recorder, handlers, args.agents)
+    elapsed['setup'] = time.perf_counter() - started
+
+    units = args.agents * args.rounds
+    phases = {
+        'poll': [(lambda unit: poll_unit(recorder, handlers, agents, unit), units)],
+        'calls': [(lambda unit: call_unit(recorder, handlers, agents, unit), units)],
+        'relay': [
+            (lambda unit: relay_connect(recorder, handlers, agents, unit), len(agents)),
+            (lambda unit: relay_unit(recorder, handlers, agents, unit, args.messages), units),
+            (lambda unit: relay_disconnect(recorder, handlers, agents, unit), len(agents))
+        ],
+        'login': [(lambda unit: login_unit(recorder, handlers, agents, unit), units)]
+    }
+    # Пар звонящих вдвое меньше агентов: больше параллельных серий дало бы 409 «занят».
+    concurrency = {'calls': min(args.concurrency, max(1, args.agents // 2))}
+
+    for name in scenarios:
+        elapsed[name] = run_phases(phases[name], concurrency.get(name, args.concurrency))
+
+    routes = recorder.report(elapsed)
+    result = {
+        'commit': git_commit(),
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'database': 'postgres' if args.dsn else 'standin',
+        'params': {
+            'agents': args.agents,
+            'rounds': args.rounds,
+            'messages': args.messages,
+            'concurrency': args.concurrency,
+            'db_latency_ms': None if args.dsn else args.db_latency_ms,
+            'bcrypt_rounds': int(os.environ['BCRYPT_ROUNDS'])
+        },
+        'scenarios': {
+            name: {
+                'units': units,
+                'requests': sum(route['count'] for route in routes.values() if route['scenario'] == name),
+                'elapsed_s': round(elapsed[name], 3),
+                'units_per_s': round(units / elapsed[name], 1)
+            }
+            for name in scenarios
+        },
+        'routes': routes
+    }
+    if database is not None:
+        result['db_statements'] = database.statements
+
+    for name, scenario in result['scenarios'].items():
+        print(f'{name:6} {scenario["units_per_s"]:8.1f} серий/с  {scenario["requests"]} запросов за {scenario["elapsed_s"]} с')
+    print(f'\n  {"маршрут":32} {"rps":>8} {"p50":>9} {"p95":>9} {"p99":>9}  ошибок')
+    for key, route in routes.items():
+        print(f'  {key:32} {route["rps"]:8.1f} {route["p50_ms"]:9.3f} {route["p95_ms"]:9.3f} {route["p99_ms"]:9.3f}  {route["errors"]}')
+
+    if args.output:
+        output = Path(args.output)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(result, indent=2, ensure_ascii=False))
+        print(f'\nрезультаты: {output}')
+
+    if args.compare:
+        regressions = compare(result, json.loads(Path(args.compare).read_text()), args.threshold)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,190 @@
+'''Байты сигнализации на установку звонка и CPU ретрансляции по форматам SDP.
+
+Форматы: plain — {type, sdp}, как без компактного режима; deflate и
+zdict1 — компактные описания (backend/signaling/sdp.py), клиент шлёт их
+сам и просит такие же в X-SDP-Encoding.
+
+- setup — тела запросов и ответов одной установки звонка через
+  signaling: POST /initiate, GET /sdp (вызываемый забирает offer),
+  POST /answer, GET /sdp (звонящий забирает answer);
+- relay — offer и answer через api-signaling $default: сообщение и
+  ответ send_to_connection;
+- перед замерами — проверка, что SDP с CRLF переживает encode/decode и
+  pack/unpack в каждом формате без искажений (в том числе когда клиент
+  сжал текст, не заменив CRLF на LF);
+- relay_us — время $default на сообщение с offer: before — прежний путь
+  (разбор и json.dumps всего сообщения в data), after — исходный JSON
+  вставляется в ответ как есть.
+
+    python bench/sdp_wire.py --iterations 20000 --output bench/results/sdp-wire.json
+'''
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+
+from run import body_of, http_event, load_function, ws_event
+
+MODES = ('plain', 'deflate', 'zdict1')
+
+
+def chrome_sdp(kind: str, seed: int) -> str:
+    '''Аудио-SDP в духе Chrome: кодеки, расширения, ICE-кандидаты'''
+    setup = 'actpass' if kind == 'offer' else 'active'
+    fingerprint = ':'.join(f'{(seed * 37 + i * 11) % 256:02X}' for i in range(32))
+    lines = [
+        'v=0', f'o=- {4611731400430051336 + seed} 2 IN IP4 127.0.0.1', 's=-', 't=0 0',
+        'a=group:BUNDLE 0', 'a=extmap-allow-mixed', f'a=msid-semantic: WMS stream{seed}',
+        'm=audio 9 UDP/TLS/RTP/SAVPF 111 63 9 0 8 13 110 126', 'c=IN IP4 0.0.0.0', 'a=rtcp:9 IN IP4 0.0.0.0',
+        f'a=ice-ufrag:{seed:04x}Qz', f'a=ice-pwd:{seed:08x}kPq2LmZx9RtYw1AbCd', 'a=ice-options:trickle',
+        f'a=fingerprint:sha-256 {fingerprint}', f'a=setup:{setup}', 'a=mid:0',
+        'a=extmap:1 urn:ietf:params:rtp-hdrext:ssrc-audio-level',
+        'a=extmap:2 http://www.webrtc.org/experiments/rtp-hdrext/abs-send-time',
+        'a=extmap:3 http://www.ietf.org/id/draft-holmer-rmcat-transport-wide-cc-extensions-01',
+        'a=extmap:4 urn:ietf:params:rtp-hdrext:sdes:mid',
+        'a=sendrecv', f'a=msid:stream{seed} track{seed}', 'a=rtcp-mux', 'a=rtcp-rsize',
+        'a=rtpmap:111 opus/48000/2', 'a=rtcp-fb:111 transport-cc', 'a=fmtp:111 minptime=10;useinbandfec=1',
+        'a=rtpmap:63 red/48000/2', 'a=fmtp:63 111/111', 'a=rtpmap:9 G722/8000', 'a=rtpmap:0 PCMU/8000',
+        'a=rtpmap:8 PCMA/8000', 'a=rtpmap:13 CN/8000', 'a=rtpmap:110 telephone-event/48000',
+        'a=rtpmap:126 telephone-event/8000',
+        f'a=ssrc:{1000000 + seed} cname:c{seed:06x}', f'a=ssrc:{1000000 + seed} msid:stream{seed} track{seed}',
+    ]
+    for i in range(1, 5):
+        ip = f'192.168.{seed % 250}.{i + 10}'
+        lines.append(f'a=candidate:{seed + i} 1 udp 2122260223 {ip} {50000 + i} typ host generation 0 network-id {i}')
+        lines.append(f'a=candidate:{seed + i + 10} 1 tcp 1518280447 {ip} 9 typ host tcptype active generation 0 network-id {i}')
+    lines.append(f'a=candidate:{seed + 30} 1 udp 1686052607 203.0.113.{seed % 250} 61000 typ srflx '
+                 f'raddr 192.168.{seed % 250}.11 rport 50001 generation 0 network-id 1')
+    return '\r\n'.join(lines) + '\r\n'
+
+
+def check_round_trip(sdp, text: str) -> None:
+    '''SDP с CRLF возвращается из каждого формата байт в байт'''
+    description = {'type': 'offer', 'sdp': text}
+    for mode in MODES:
+        if mode == 'plain':
+            got = sdp.unpack(sdp.pack(description))
+        else:
+            got = sdp.decode(sdp.encode(description, mode))
+            client_made = {'type': 'offer', 'encoding': mode,
+                           'data': base64.b64encode(sdp._compress(text, mode)).decode('ascii')}
+            if sdp.decode(client_made)['sdp'] != text or sdp.unpack(sdp.pack(client_made))['sdp'] != text:
+                raise RuntimeError(f'{mode}: CRLF от клиента искажён')
+        if got['sdp'] != text:
+            raise RuntimeError(f'{mode}: SDP искажён при передаче')
+    if sdp.expand(text) != text:
+        raise RuntimeError('expand удваивает CRLF')
+
+
+def call_setup(signaling, database, mode: str, offer: dict, answer: dict) -> int:
+    sdp = signaling.sdp
+    headers = {} if mode == 'plain' else {sdp.ENCODING_HEADER: mode}
+    if mode != 'plain':
+        offer, answer = sdp.encode(offer, mode), sdp.encode(answer, mode)
+    total = 0
+
+    def exchange(event):
+        nonlocal total
+        result = signaling.handler(event, None)
+        if result['statusCode'] != 200:
+            raise RuntimeError(f'{event["url"]}: {result["statusCode"]} {result["body"]}')
+        total += len(event['body'].encode()) + len(result['body'].encode())
+        return result
+
+    result = exchange(http_event('POST', '/initiate', {'caller_id': 1, 'receiver_id': 2, 'offer': offer}, headers=headers))
+    call_id = body_of(result)['call_id']
+    database.offer_blob = sdp.pack(offer)
+    exchange(http_event('GET', '/sdp', query={'call_id': str(call_id)}, headers=headers))
+    exchange(http_event('POST', '/answer', {'call_id': call_id, 'answer': answer}, headers=headers))
+    database.answer_blob = sdp.pack(answer)
+    result = exchange(http_event('GET', '/sdp', query={'call_id': str(call_id)}, headers=headers))
+    if sdp.decode(body_of(result)['answer'])['sdp'] != sdp.decode(answer)['sdp']:
+        raise RuntimeError(f'{mode}: answer искажён')
+    database.offer_blob, database.answer_blob = b'', None
+    return total
+
+
+def legacy_on_message(api):
+    '''$default до передачи исходного JSON: сообщение разбирается и сериализуется заново'''
+    core = api.core
+
+    def on_message(event, connection_id):
+        body = core.json_body(event)
+        target_connection_ids = api.relay(body, connection_id)
+        if target_connection_ids is None:
+            return core.EMPTY_OK
+        if target_connection_ids:
+            return core.response(200, {
+                'action': 'send_to_connection',
+                'connection_id': target_connection_ids[-1],
+                'connection_ids': target_connection_ids,
+                'data': body
+            })
+        return core.raw_response(404, api.PEER_NOT_FOUND_BODY)
+    return on_message
+
+
+def relay(api, messages: list, iterations: int) -> dict:
+    relayed = 0
+    events = [ws_event('$default', 'conn-a', message) for message in messages]
+    for event in events:
+        result = api.handler(event, None)
+        relayed += len(event['body'].encode()) + len(result['body'].encode())
+
+    timings = {}
+    current = api.routes['$default']
+    for name, on_message in (('before', legacy_on_message(api)), ('after', current)):
+        api.routes['$default'] = on_message
+        event = events[0]
+        started = time.perf_counter()
+        for _ in range(iterations):
+            api.handler(event, None)
+        timings[name] = (time.perf_counter() - started) / iterations * 1e6
+    api.routes['$default'] = current
+    return {'bytes': relayed, 'relay_us_before': round(timings['before'], 2), 'relay_us_after': round(timings['after'], 2)}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Байты и CPU сигнализации по форматам SDP')
+    parser.add_argument('--iterations', type=int, default=5000, help='повторов $default для замера CPU')
+    parser.add_argument('--output', help='куда записать JSON с результатами')
+    args = parser.parse_args(argv)
+
+    import standin
+    os.environ['DATABASE_URL'] = 'standin'
+    os.environ.setdefault('SIGNALING_REGISTRY', 'memory')
+    database = standin.StandinDatabase(users=4)
+    standin.install(database)
+    signaling = load_function('signaling')
+    api = load_function('api-signaling')
+    for connection_id, peer_id in (('conn-a', 'peer-a'), ('conn-b', 'peer-b')):
+        api.handler(ws_event('$connect', connection_id, query={'peer_id': peer_id}), None)
+
+    offer = {'type': 'offer', 'sdp': chrome_sdp('offer', 1)}
+    answer = {'type': 'answer', 'sdp': chrome_sdp('answer', 2)}
+    check_round_trip(signaling.sdp, offer['sdp'])
+    results = {}
+    print(f'  {"формат":8} {"setup, байт":>12} {"relay, байт":>12} {"$default до, мкс":>17} {"после, мкс":>11}')
+    for mode in MODES:
+        described = (offer, answer) if mode == 'plain' else (signaling.sdp.encode(offer, mode),
+                                                             signaling.sdp.encode(answer, mode))
+        messages = [{'type': kind, 'to': 'peer-b', 'from': 'peer-a', kind: d}
+                    for kind, d in zip(('offer', 'answer'), described)]
+        row = dict(setup_bytes=call_setup(signaling, database, mode, offer, answer),
+                   **relay(api, messages, args.iterations))
+        results[mode] = row
+        print(f'  {mode:8} {row["setup_bytes"]:12} {row["bytes"]:12} '
+              f'{row["relay_us_before"]:17.2f} {row["relay_us_after"]:11.2f}')
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump({'sdp_bytes': {'offer': len(offer['sdp']), 'answer': len(answer['sdp'])},
+                       'iterations': args.iterations, 'modes': results}, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
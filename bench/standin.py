@@ -0,0 +1,195 @@
+'''Подменная база в памяти процесса для офлайн-бенчмарка обработчиков.
+
+Не исполняет SQL: запрос распознаётся по характерному фрагменту и
+получает правдоподобный ответ нужной формы. Поэтому бенчмарк с ней
+меряет накладные расходы самих обработчиков (маршрутизация, пул,
+bcrypt, сериализация) плюс заданную задержку на каждый запрос к базе —
+ею моделируется сетевой round-trip до Postgres.
+'''
+import itertools
+import threading
+import time
+from datetime import datetime, timedelta
+
+import psycopg2.extensions
+
+SAMPLE_SDP = {
+    'type': 'offer',
+    'sdp': 'v=0\r\no=- 4611731400430051336 2 IN IP4 127.0.0.1\r\ns=-\r\nt=0 0\r\n'
+           'a=group:BUNDLE 0\r\nm=audio 9 UDP/TLS/RTP/SAVPF 111 63 9 0 8 13 110 126\r\n'
+           + ''.join(
+               f'a=candidate:{i} 1 udp 2122260223 192.168.1.{i} 5{i:04d} typ host generation 0\r\n'
+               for i in range(1, 9)
+           )
+}
+
+
+class StandinDatabase:
+    def __init__(self, users: int = 200, latency_ms: float = 0.0, password_hash: str = ''):
+        self.latency = latency_ms / 1000
+        self.password_hash = password_hash
+        self.lock = threading.Lock()
+        self.version = users
+        self.call_ids = itertools.count(1)
+        self.seq = itertools.count(1)
+        self.statements = 0
+        self.offer_blob = b''
+        self.answer_blob = None
+        self.sessions = {}
+        now = datetime.now()
+        self.users = [
+            {
+                'id': i,
+                'username': f'agent{i}',
+                'phone': f'+7900{i:07d}',
+                'role': 'user',
+                'status': 'online',
+                'last_seen': now
+            }
+            for i in range(1, users + 1)
+        ]
+        self.history = [
+            {
+                'id': i,
+                'caller_id': 1 + i % users,
+                'receiver_id': 1 + (i * 7) % users,
+                'caller_phone': '+79000000001',
+                'receiver_phone': '+79000000002',
+                'status': 'completed',
+                'duration': 60 + i,
+                'started_at': now - timedelta(minutes=i),
+                'ended_at': now - timedelta(minutes=i) + timedelta(seconds=60 + i)
+            }
+            for i in range(1, 51)
+        ]
+        self.responders = [
+            ('WITH locked AS', self._initiate),
+            ('WITH prev AS', lambda sql, params: []),
+            ('WITH stuck AS', lambda sql, params: [{'missed': 0, 'completed': 0}]),
+            ('SELECT EXISTS', lambda sql, params: [{'taken': False}]),
+            ('INSERT INTO users', self._insert_user),
+            ('WHERE phone', self._user_by_phone),
+            ('MAX(version)', lambda sql, params: [{'version': self.version, 'cursor': self.version + 1,
+                                                   'horizon': self.version + 1}]),
+            ('FROM users WHERE version', lambda sql, params: self.users[:5]),
+            ('FROM users', lambda sql, params: self.users),
+            ('INSERT INTO sessions', self._insert_session),
+            ('RETURNING user_id', self._validate_session),
+            ('INSERT INTO call_ice_candidates', self._insert_candidates),
+            ('FROM call_ice_candidates', lambda sql, params: []),
+            ('FROM call_sdp', self._sdp),
+            ('create_call_logs_partitions', lambda sql, params: [{'created': 0}]),
+            ('SET rolled_up = TRUE', lambda sql, params: [{'rolled': 0}]),
+            ('FROM call_stats_hourly', lambda sql, params: []),
+            ('FROM call_logs', self._history),
+            ('FROM ws_connections', lambda sql, params: [{'connection_id': 'standin'}]),
+        ]
+
+    def execute(self, sql: str, params) -> list:
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.statements += 1
+        for fragment, responder in self.responders:
+            if fragment in sql:
+                return responder(sql, params)
+        return []
+
+    def _initiate(self, sql, params):
+        return [{'receiver_status': 'online', 'id': next(self.call_ids)}]
+
+    def _history(self, sql, params):
+        limit = params[-1] if isinstance(params, (list, tuple)) and params else 50
+        return self.history[:limit]
+
+    def _insert_user(self, sql, params):
+        with self.lock:
+            self.version += 1
+            user_id = self.version
+        return [{'id': user_id, 'username': params[0], 'phone': params[1], 'role': 'user'}]
+
+    def _user_by_phone(self, sql, params):
+        phones = params[0] if isinstance(params[0], list) else [params[0]]
+        return [
+            {
+                'id': 1000 + i,
+                'username': f'agent{i}',
+                'phone': phone,
+                'password_hash': self.password_hash,
+                'role': 'user',
+                'version': self.version
+            }
+            for i, phone in enumerate(phones)
+        ]
+
+    def _insert_session(self, sql, params):
+        self.sessions[params[0]] = params[1]
+        return []
+
+    def _validate_session(self, sql, params):
+        user_id = self.sessions.get(params[1])
+        return [{'user_id': user_id}] if user_id is not None else []
+
+    def _insert_candidates(self, sql, params):
+        return [{'id': next(self.seq)} for _ in params[1]]
+
+    def _sdp(self, sql, params):
+        return [{'offer': self.offer_blob, 'answer': self.answer_blob}]
+
+
+class StandinCursor:
+    def __init__(self, database: StandinDatabase, as_dict: bool):
+        self.database = database
+        self.as_dict = as_dict
+        self.rows = []
+        self.rowcount = -1
+
+    def execute(self, sql, params=None):
+        rows = self.database.execute(sql, params)
+        self.rows = rows if self.as_dict else [tuple(row.values()) for row in rows]
+        self.rowcount = len(rows)
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class StandinConnection:
+    def __init__(self, database: StandinDatabase):
+        self.database = database
+        self.closed = 0
+
+    def cursor(self, cursor_factory=None):
+        return StandinCursor(self.database, cursor_factory is not None)
+
+    def get_transaction_status(self):
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def set_isolation_level(self, level):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+def install(database: StandinDatabase) -> None:
+    '''Подменяет psycopg2.connect: все пулы обработчиков получат подменную базу'''
+    psycopg2.connect = lambda *args, **kwargs: StandinConnection(database)
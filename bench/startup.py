@@ -0,0 +1,130 @@
+'''Время холодного старта функций backend/.
+
+Каждый замер — новый процесс Python, как у свежего экземпляра функции:
+- import — загрузка index.py со всеми модулями;
+- preflight — первый OPTIONS-запрос;
+- first_db — первое обращение к базе (getconn, курсор, SELECT 1), сюда
+  переезжает импорт драйвера; подменная база (bench/standin.py) или --dsn;
+- process — весь процесс от запуска интерпретатора до выхода.
+
+Также печатается, какие тяжёлые модули (psycopg2, bcrypt) уже загружены
+к моменту ответа на preflight — их там быть не должно.
+
+    python bench/startup.py --repeat 20 --output bench/results/startup-$(git rev-parse --short HEAD).json
+    python bench/startup.py --compare bench/results/startup-baseline.json
+'''
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from run import BACKEND, FUNCTIONS, compare, git_commit
+
+HEAVY_MODULES = ('psycopg2', 'bcrypt')
+PHASES = ('import', 'preflight', 'first_db', 'process')
+
+CHILD = '''
+import json, os, sys, time
+fn_dir, bench_dir = sys.argv[1], sys.argv[2]
+sys.path.insert(0, fn_dir)
+result = {}
+started = time.perf_counter()
+import index
+result['import'] = (time.perf_counter() - started) * 1000
+started = time.perf_counter()
+index.handler({'httpMethod': 'OPTIONS', 'headers': {}}, None)
+result['preflight'] = (time.perf_counter() - started) * 1000
+result['loaded'] = [m for m in %(heavy)r if m in sys.modules]
+result['first_db'] = None
+if hasattr(index, 'db'):
+    try:
+        if os.environ['DATABASE_URL'] == 'standin':
+            sys.path.insert(0, bench_dir)
+            import standin
+            standin.install(standin.StandinDatabase(users=1))
+        started = time.perf_counter()
+        conn = index.db.getconn()
+        cur = index.db.dict_cursor(conn)
+        cur.execute('SELECT 1')
+        index.db.putconn(conn)
+        result['first_db'] = (time.perf_counter() - started) * 1000
+    except ImportError:
+        pass
+print(json.dumps(result))
+''' % {'heavy': HEAVY_MODULES}
+
+
+def measure(name: str, env: dict) -> dict:
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, '-c', CHILD, str(BACKEND / name), os.path.dirname(os.path.abspath(__file__))],
+        env=env, capture_output=True, text=True
+    )
+    elapsed = (time.perf_counter() - started) * 1000
+    if completed.returncode != 0:
+        raise RuntimeError(f'{name}: {completed.stderr.strip().splitlines()[-1]}')
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result['process'] = elapsed
+    return result
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Время холодного старта функций backend/')
+    parser.add_argument('--dsn', help='локальный Postgres для first_db; без него — подменная база')
+    parser.add_argument('--functions', default=','.join(FUNCTIONS))
+    parser.add_argument('--repeat', type=int, default=10, help='запусков на функцию')
+    parser.add_argument('--output', help='куда записать JSON с результатами')
+    parser.add_argument('--compare', help='JSON прошлого прогона для сравнения')
+    parser.add_argument('--threshold', type=float, default=20.0, help='допустимый рост p95, %% (20)')
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ, DATABASE_URL=args.dsn or 'standin')
+    env.setdefault('SIGNALING_REGISTRY', 'memory')
+
+    routes = {}
+    print(f'  {"функция":28} {"p50":>9} {"p95":>9}  загружено к preflight')
+    for name in [n for n in args.functions.split(',') if n]:
+        runs = [measure(name, env) for _ in range(args.repeat)]
+        loaded = sorted({module for run in runs for module in run['loaded']})
+        for phase in PHASES:
+            values = sorted(run[phase] for run in runs if run[phase] is not None)
+            if not values:
+                continue
+            route = {
+                'p50_ms': round(statistics.median(values), 3),
+                'p95_ms': round(values[min(len(values) - 1, int(len(values) * 0.95))], 3),
+                'loaded': loaded
+            }
+            routes[f'{name} {phase}'] = route
+            print(f'  {name + " " + phase:28} {route["p50_ms"]:9.3f} {route["p95_ms"]:9.3f}  '
+                  f'{", ".join(loaded) if phase == "preflight" and loaded else ""}')
+
+    result = {
+        'commit': git_commit(),
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'database': 'postgres' if args.dsn else 'standin',
+        'params': {'repeat': args.repeat},
+        'routes': routes
+    }
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(result, json.load(f), args.threshold)
+        if regressions:
+            print(f'регрессия p95 больше {args.threshold}%: {", ".join(regressions)}')
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,18 @@
+-- Монотонная версия строки пользователя для инкрементальной ленты присутствия
+CREATE SEQUENCE IF NOT EXISTS users_version_seq;
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT nextval('users_version_seq');
+
+CREATE INDEX IF NOT EXISTS idx_users_version ON users(version);
+
+CREATE OR REPLACE FUNCTION users_bump_version() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.version := nextval('users_version_seq');
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_users_bump_version ON users;
+CREATE TRIGGER trg_users_bump_version
+    BEFORE UPDATE ON users
+    FOR EACH ROW EXECUTE FUNCTION users_bump_version();
@@ -0,0 +1,10 @@
+-- Общий реестр WebSocket-соединений сигнализации для нескольких экземпляров функции
+CREATE TABLE IF NOT EXISTS ws_connections (
+    connection_id VARCHAR(255) PRIMARY KEY,
+    peer_id VARCHAR(255) NOT NULL,
+    connected_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_ws_connections_peer ON ws_connections(peer_id, last_seen);
+CREATE INDEX IF NOT EXISTS idx_ws_connections_last_seen ON ws_connections(last_seen);
@@ -0,0 +1,10 @@
+-- Очередь ICE-кандидатов звонка для trickle ICE
+CREATE TABLE IF NOT EXISTS call_ice_candidates (
+    id BIGSERIAL PRIMARY KEY,
+    call_id INTEGER NOT NULL REFERENCES call_logs(id) ON DELETE CASCADE,
+    sender_id INTEGER,
+    candidate JSONB NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_call_ice_candidates_call ON call_ice_candidates(call_id, id);
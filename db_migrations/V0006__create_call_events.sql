@@ -0,0 +1,24 @@
+-- События звонков для long-poll доставки (offer, answer, ice, hangup)
+CREATE TABLE IF NOT EXISTS call_events (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    type VARCHAR(20) NOT NULL,
+    call_id INTEGER,
+    payload JSONB NOT NULL DEFAULT '{}',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_call_events_user ON call_events(user_id, id);
+CREATE INDEX IF NOT EXISTS idx_call_events_created_at ON call_events(created_at);
+
+CREATE OR REPLACE FUNCTION call_events_notify() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('voip_events', NEW.user_id::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_call_events_notify ON call_events;
+CREATE TRIGGER trg_call_events_notify
+    AFTER INSERT ON call_events
+    FOR EACH ROW EXECUTE FUNCTION call_events_notify();
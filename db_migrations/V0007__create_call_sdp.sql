@@ -0,0 +1,10 @@
+-- SDP offer/answer звонка в компактном виде (см. backend/signaling/sdp.py)
+CREATE TABLE IF NOT EXISTS call_sdp (
+    call_id INTEGER PRIMARY KEY REFERENCES call_logs(id) ON DELETE CASCADE,
+    offer BYTEA NOT NULL,
+    answer BYTEA,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    answered_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_call_sdp_unanswered ON call_sdp(created_at) WHERE answer IS NULL;
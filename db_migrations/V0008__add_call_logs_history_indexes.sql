@@ -0,0 +1,9 @@
+-- Составные индексы под keyset-пагинацию истории звонков по (started_at, id)
+CREATE INDEX IF NOT EXISTS idx_call_logs_caller_started ON call_logs(caller_id, started_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_call_logs_receiver_started ON call_logs(receiver_id, started_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_call_logs_started_id ON call_logs(started_at DESC, id DESC);
+
+-- Одностолбцовые индексы покрываются префиксами составных
+DROP INDEX IF EXISTS idx_call_logs_caller;
+DROP INDEX IF EXISTS idx_call_logs_receiver;
+DROP INDEX IF EXISTS idx_call_logs_started_at;
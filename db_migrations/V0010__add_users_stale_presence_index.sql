@@ -0,0 +1,2 @@
+-- Частичный индекс для перевода в offline пользователей без heartbeat
+CREATE INDEX IF NOT EXISTS idx_users_stale_presence ON users(last_seen) WHERE status <> 'offline';
@@ -0,0 +1,23 @@
+-- Часовые сводки по звонкам на пользователя: отчёты читают их вместо call_logs
+CREATE TABLE IF NOT EXISTS call_stats_hourly (
+    user_id INTEGER NOT NULL,
+    hour TIMESTAMP NOT NULL,
+    calls_out INTEGER NOT NULL DEFAULT 0,
+    calls_in INTEGER NOT NULL DEFAULT 0,
+    answered_out INTEGER NOT NULL DEFAULT 0,
+    answered_in INTEGER NOT NULL DEFAULT 0,
+    duration_out BIGINT NOT NULL DEFAULT 0,
+    duration_in BIGINT NOT NULL DEFAULT 0,
+    max_duration INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, hour)
+);
+
+-- Отчёты по всем пользователям за диапазон
+CREATE INDEX IF NOT EXISTS idx_call_stats_hourly_hour ON call_stats_hourly(hour);
+
+-- Звонок уже учтён в сводке
+ALTER TABLE call_logs ADD COLUMN IF NOT EXISTS rolled_up BOOLEAN NOT NULL DEFAULT FALSE;
+
+-- Очередь пакетной догрузки: завершённые, но не учтённые звонки
+CREATE INDEX IF NOT EXISTS idx_call_logs_rollup_pending ON call_logs(id)
+    WHERE ended_at IS NOT NULL AND NOT rolled_up;
@@ -0,0 +1,87 @@
+-- call_logs становится секционированной по месяцам started_at: вставки и
+-- свежая история работают с маленькими секциями, старые месяцы
+-- отсоединяются и архивируются (backend/signaling/partitions.py).
+
+-- Внешние ключи на секционированную таблицу требуют уникальности по id без
+-- started_at, поэтому ICE-кандидаты и SDP звонка держатся без FK: их и так
+-- удаляют /end и сборщик неотвеченных offer.
+ALTER TABLE call_ice_candidates DROP CONSTRAINT IF EXISTS call_ice_candidates_call_id_fkey;
+ALTER TABLE call_sdp DROP CONSTRAINT IF EXISTS call_sdp_call_id_fkey;
+
+-- Создаёт помесячные секции от последней существующей границы до
+-- текущего месяца + months_ahead; возвращает число созданных секций.
+CREATE OR REPLACE FUNCTION create_call_logs_partitions(months_ahead INTEGER DEFAULT 3)
+RETURNS INTEGER AS $$
+DECLARE
+    month_start TIMESTAMP;
+    last_month TIMESTAMP := date_trunc('month', CURRENT_TIMESTAMP) + make_interval(months => months_ahead);
+    created INTEGER := 0;
+BEGIN
+    SELECT COALESCE(MAX((regexp_match(pg_get_expr(c.relpartbound, c.oid), 'TO \(''([^'']+)''\)'))[1]::timestamp),
+                    date_trunc('month', CURRENT_TIMESTAMP))
+    INTO month_start
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'call_logs'::regclass AND pg_get_expr(c.relpartbound, c.oid) <> 'DEFAULT';
+
+    WHILE month_start <= last_month LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF call_logs FOR VALUES FROM (%L) TO (%L)',
+            'call_logs_' || to_char(month_start, 'YYYY_MM'),
+            month_start,
+            month_start + INTERVAL '1 month'
+        );
+        created := created + 1;
+        month_start := month_start + INTERVAL '1 month';
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    legacy_until TIMESTAMP;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'call_logs'::regclass) = 'p' THEN
+        RETURN;
+    END IF;
+
+    ALTER TABLE call_logs RENAME TO call_logs_legacy;
+    -- Первичный ключ по одному id не даёт подключить таблицу секцией: у
+    -- родителя ключ (id, started_at), его индекс legacy получит при ATTACH.
+    -- FK на него (ICE и SDP) сняты выше.
+    ALTER TABLE call_logs_legacy DROP CONSTRAINT call_logs_pkey;
+    ALTER INDEX IF EXISTS idx_call_logs_caller_started RENAME TO call_logs_legacy_caller_started;
+    ALTER INDEX IF EXISTS idx_call_logs_receiver_started RENAME TO call_logs_legacy_receiver_started;
+    ALTER INDEX IF EXISTS idx_call_logs_started_id RENAME TO call_logs_legacy_started_id;
+    ALTER INDEX IF EXISTS idx_call_logs_rollup_pending RENAME TO call_logs_legacy_rollup_pending;
+    -- Статус низкоселективен и нигде не ищется сам по себе
+    DROP INDEX IF EXISTS idx_call_logs_status;
+
+    UPDATE call_logs_legacy SET started_at = COALESCE(ended_at, CURRENT_TIMESTAMP) WHERE started_at IS NULL;
+    ALTER TABLE call_logs_legacy ALTER COLUMN started_at SET NOT NULL;
+
+    -- Значения по умолчанию (в т.ч. nextval общей последовательности id) и CHECK переносятся как есть
+    CREATE TABLE call_logs (LIKE call_logs_legacy INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+        PARTITION BY RANGE (started_at);
+    ALTER TABLE call_logs ADD PRIMARY KEY (id, started_at);
+    ALTER SEQUENCE call_logs_id_seq OWNED BY call_logs.id;
+
+    -- Старые строки целиком остаются одной секцией до конца текущего месяца
+    SELECT date_trunc('month', GREATEST(MAX(started_at), CURRENT_TIMESTAMP)) + INTERVAL '1 month'
+    INTO legacy_until FROM call_logs_legacy;
+    EXECUTE format(
+        'ALTER TABLE call_logs ATTACH PARTITION call_logs_legacy FOR VALUES FROM (MINVALUE) TO (%L)',
+        legacy_until
+    );
+    CREATE TABLE call_logs_default PARTITION OF call_logs DEFAULT;
+
+    -- Совпадающие индексы legacy-секции подключаются, а не строятся заново
+    CREATE INDEX idx_call_logs_caller_started ON call_logs(caller_id, started_at DESC, id DESC);
+    CREATE INDEX idx_call_logs_receiver_started ON call_logs(receiver_id, started_at DESC, id DESC);
+    CREATE INDEX idx_call_logs_started_id ON call_logs(started_at DESC, id DESC);
+    CREATE INDEX idx_call_logs_rollup_pending ON call_logs(id) WHERE ended_at IS NOT NULL AND NOT rolled_up;
+END;
+$$;
+
+SELECT create_call_logs_partitions(3);
@@ -0,0 +1,3 @@
+-- Открытые звонки (без ended_at) для сборщика зависших звонков: индекс
+-- содержит только идущие звонки и не растёт вместе с историей
+CREATE INDEX IF NOT EXISTS idx_call_logs_open ON call_logs(started_at) WHERE ended_at IS NULL;
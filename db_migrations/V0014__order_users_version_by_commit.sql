@@ -0,0 +1,20 @@
+-- Версия строки пользователя — номер записавшей её транзакции, а не nextval.
+-- nextval выдаётся при UPDATE, а виден становится при commit: строка с меньшей
+-- версией могла закоммититься после того, как читатель уже получил курсор
+-- больше неё, и лента "version > cursor" пропускала её навсегда. Все транзакции
+-- с номером меньше txid_snapshot_xmin снимка уже завершены, поэтому курсор
+-- ленты не выше этой границы (backend/auth/users_cache.py, feed_position), и
+-- всё, что закоммитится позже, придёт с version >= cursor.
+ALTER TABLE users ALTER COLUMN version SET DEFAULT txid_current();
+
+CREATE OR REPLACE FUNCTION users_bump_version() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.version := txid_current();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Прежние версии из последовательности несравнимы с номерами транзакций
+UPDATE users SET version = txid_current();
+
+DROP SEQUENCE IF EXISTS users_version_seq;
@@ -0,0 +1,13 @@
+-- Версию строки меняют только изменения, видимые в справочнике и кеше
+-- пользователей (статус, имя, телефон, роль, хеш пароля и т.п.). Heartbeat,
+-- двигающий только last_seen, версию не трогает: иначе каждый сброс буфера
+-- присутствия обновлял версию всем online-пользователям, и дельта ?since=
+-- превращалась в полный список, а кеш auth перечитывался на каждой сверке.
+-- Столбцы сравниваются через jsonb, чтобы триггер не зависел от набора
+-- столбцов users.
+DROP TRIGGER IF EXISTS trg_users_bump_version ON users;
+CREATE TRIGGER trg_users_bump_version
+    BEFORE UPDATE ON users
+    FOR EACH ROW
+    WHEN ((to_jsonb(OLD) - 'last_seen' - 'version') IS DISTINCT FROM (to_jsonb(NEW) - 'last_seen' - 'version'))
+    EXECUTE FUNCTION users_bump_version();
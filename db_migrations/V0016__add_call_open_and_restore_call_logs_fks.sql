@@ -0,0 +1,44 @@
+-- Открытые звонки: id -> started_at и абоненты. call_logs секционирована по
+-- started_at, и запрос только по id перебирал бы все секции; горячие запросы
+-- (/answer, /end, /ice) берут started_at отсюда, и планировщик оставляет одну
+-- секцию. Строка живёт от /initiate до /end или сборщика зависших звонков.
+CREATE TABLE IF NOT EXISTS call_open (
+    call_id INTEGER PRIMARY KEY,
+    started_at TIMESTAMP NOT NULL,
+    caller_id INTEGER,
+    receiver_id INTEGER
+);
+
+INSERT INTO call_open (call_id, started_at, caller_id, receiver_id)
+SELECT id, started_at, caller_id, receiver_id FROM call_logs WHERE ended_at IS NULL
+ON CONFLICT DO NOTHING;
+
+-- V0012 сняла FK ICE-кандидатов и SDP на call_logs: уникального id у
+-- секционированной таблицы нет. Они нужны только открытому звонку, поэтому
+-- ссылаются на call_open и удаляются вместе с ним.
+DELETE FROM call_ice_candidates i WHERE NOT EXISTS (SELECT 1 FROM call_open o WHERE o.call_id = i.call_id);
+DELETE FROM call_sdp s WHERE NOT EXISTS (SELECT 1 FROM call_open o WHERE o.call_id = s.call_id);
+ALTER TABLE call_ice_candidates DROP CONSTRAINT IF EXISTS call_ice_candidates_call_open_fkey;
+ALTER TABLE call_ice_candidates ADD CONSTRAINT call_ice_candidates_call_open_fkey
+    FOREIGN KEY (call_id) REFERENCES call_open(call_id) ON DELETE CASCADE;
+ALTER TABLE call_sdp DROP CONSTRAINT IF EXISTS call_sdp_call_open_fkey;
+ALTER TABLE call_sdp ADD CONSTRAINT call_sdp_call_open_fkey
+    FOREIGN KEY (call_id) REFERENCES call_open(call_id) ON DELETE CASCADE;
+
+-- CREATE TABLE ... (LIKE ... INCLUDING CONSTRAINTS) в V0012 переносит только
+-- CHECK: новые секции остались без FK абонентов на users. FK на родителе
+-- подхватывает такой же FK legacy-секции и создаётся в остальных.
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint
+                   WHERE conrelid = 'call_logs'::regclass AND conname = 'call_logs_caller_id_fkey') THEN
+        ALTER TABLE call_logs ADD CONSTRAINT call_logs_caller_id_fkey
+            FOREIGN KEY (caller_id) REFERENCES users(id);
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint
+                   WHERE conrelid = 'call_logs'::regclass AND conname = 'call_logs_receiver_id_fkey') THEN
+        ALTER TABLE call_logs ADD CONSTRAINT call_logs_receiver_id_fkey
+            FOREIGN KEY (receiver_id) REFERENCES users(id);
+    END IF;
+END;
+$$;
@@ -16,6 +16,13 @@ export class WebRTCCall {
     private onCallEnded: () => void
   ) {}
 
+  private headers(): Record<string, string> {
+    const token = localStorage.getItem('voip_token');
+    return token
+      ? { 'Content-Type': 'application/json', 'X-Authorization': `Bearer ${token}` }
+      : { 'Content-Type': 'application/json' };
+  }
+
   async startCall(receiverId: number, callerId: number): Promise<{offer: RTCSessionDescriptionInit, callId: number}> {
     this.peerConnection = new RTCPeerConnection(this.configuration);
     
@@ -48,7 +55,7 @@ export class WebRTCCall {
 
     const response = await fetch('https://functions.poehali.dev/46bdfd79-a9fb-4730-9257-eeba1e141fb5/initiate', {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: this.headers(),
       body: JSON.stringify({
         caller_id: callerId,
         receiver_id: receiverId,
@@ -96,7 +103,7 @@ export class WebRTCCall {
 
     await fetch('https://functions.poehali.dev/46bdfd79-a9fb-4730-9257-eeba1e141fb5/answer', {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: this.headers(),
       body: JSON.stringify({
         call_id: callId,
         answer: answer
@@ -110,7 +117,7 @@ export class WebRTCCall {
     if (this.callId) {
       await fetch('https://functions.poehali.dev/46bdfd79-a9fb-4730-9257-eeba1e141fb5/end', {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: this.headers(),
         body: JSON.stringify({ call_id: this.callId })
       });
     }
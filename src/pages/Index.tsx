@@ -45,6 +45,8 @@ export default function Index() {
   const remoteAudioRef = useRef<HTMLAudioElement>(null);
   const webrtcCallRef = useRef<WebRTCCall | null>(null);
   const callTimerRef = useRef<NodeJS.Timeout | null>(null);
+  const usersCursorRef = useRef<number | null>(null);
+  const retryAtRef = useRef<Record<string, number>>({});
 
   useEffect(() => {
     const userStr = localStorage.getItem('voip_user');
@@ -61,6 +63,7 @@ export default function Index() {
     const interval = setInterval(() => {
       loadUsers();
       loadCallLogs();
+      sendHeartbeat(user.id);
     }, 5000);
 
     return () => clearInterval(interval);
@@ -84,19 +87,71 @@ export default function Index() {
     };
   }, [inCall]);
 
+  const authHeaders = (): Record<string, string> => {
+    const token = localStorage.getItem('voip_token');
+    return token ? { 'X-Authorization': `Bearer ${token}` } : {};
+  };
+
+  // 429 и 503 приходят с Retry-After: до этого момента опросы функции не шлём
+  const canPoll = (fn: string) => Date.now() >= (retryAtRef.current[fn] ?? 0);
+
+  const holdOff = (fn: string, response: Response) => {
+    if (response.status !== 429 && response.status !== 503) return;
+    const seconds = Number(response.headers.get('Retry-After'));
+    retryAtRef.current[fn] = Date.now() + (seconds > 0 ? seconds : 5) * 1000;
+  };
+
+  const sendHeartbeat = (userId: number) => {
+    if (!canPoll('auth')) return;
+    fetch('https://functions.poehali.dev/a8f30b33-3fc0-41e9-9521-78bb1cb2cab3/heartbeat', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json', ...authHeaders() },
+      body: JSON.stringify({ user_id: userId })
+    }).then(response => holdOff('auth', response)).catch(() => {});
+  };
+
   const loadUsers = async () => {
+    if (!canPoll('auth')) return;
     try {
-      const response = await fetch('https://functions.poehali.dev/a8f30b33-3fc0-41e9-9521-78bb1cb2cab3');
+      const cursor = usersCursorRef.current;
+      const url = cursor === null
+        ? 'https://functions.poehali.dev/a8f30b33-3fc0-41e9-9521-78bb1cb2cab3'
+        : `https://functions.poehali.dev/a8f30b33-3fc0-41e9-9521-78bb1cb2cab3?since=${cursor}`;
+      const response = await fetch(url, { headers: authHeaders() });
+      if (!response.ok) {
+        holdOff('auth', response);
+        return;
+      }
       const data = await response.json();
-      setUsers(data.users || []);
+      usersCursorRef.current = data.cursor ?? null;
+
+      if (!data.delta) {
+        setUsers(data.users || []);
+        return;
+      }
+      if (!data.users?.length) return;
+
+      setUsers(prev => {
+        const changed = new Map<number, User>(data.users.map((u: User) => [u.id, u]));
+        const merged = prev.map(u => changed.get(u.id) ?? u);
+        prev.forEach(u => changed.delete(u.id));
+        return [...changed.values(), ...merged];
+      });
     } catch (error) {
       console.error('Failed to load users:', error);
     }
   };
 
   const loadCallLogs = async () => {
+    if (!canPoll('signaling')) return;
     try {
-      const response = await fetch('https://functions.poehali.dev/46bdfd79-a9fb-4730-9257-eeba1e141fb5');
+      const response = await fetch('https://functions.poehali.dev/46bdfd79-a9fb-4730-9257-eeba1e141fb5', {
+        headers: authHeaders()
+      });
+      if (!response.ok) {
+        holdOff('signaling', response);
+        return;
+      }
       const data = await response.json();
       setCallLogs(data.calls || []);
     } catch (error) {
@@ -161,6 +216,13 @@ export default function Index() {
   };
 
   const logout = () => {
+    const token = localStorage.getItem('voip_token');
+    if (token) {
+      fetch('https://functions.poehali.dev/a8f30b33-3fc0-41e9-9521-78bb1cb2cab3/logout', {
+        method: 'POST',
+        headers: { 'X-Authorization': `Bearer ${token}` }
+      }).catch(() => {});
+    }
     localStorage.removeItem('voip_user');
     localStorage.removeItem('voip_token');
     navigate('/login');